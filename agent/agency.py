@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any, List
+from typing import Any, Callable, List, Optional
 
 from rich.console import Console
 
@@ -24,12 +24,24 @@ class Agency:
     llm: LLM
     tasks: List[Task]
     silence_actions: bool
+    on_change: Optional[Callable[[], None]]
 
-    def __init__(self, pubsub: PubSub, llm: LLM, silence_actions: bool) -> None:
+    def __init__(
+        self,
+        pubsub: PubSub,
+        llm: LLM,
+        silence_actions: bool,
+        on_change: Optional[Callable[[], None]] = None,
+    ) -> None:
         self.pubsub = pubsub
         self.llm = llm
         self.tasks = []
         self.silence_actions = silence_actions
+        self.on_change = on_change
+
+    def notify(self):
+        if self.on_change:
+            self.on_change()
 
     def get_new_task_id(self) -> str:
         return f"task_{len(self.tasks) + 1}"
@@ -79,6 +91,7 @@ class Agency:
                     style="green",
                 )
             self.pubsub.publish("task_created", task)
+            self.notify()
             return True
         except Exception as e:
             console.print(f"Error creating task: {e}", style="bold red")
@@ -126,6 +139,7 @@ class Agency:
                 if task.id == task_id:
                     task.requirements = requirements
                     self.pubsub.publish("task_requirements_modified", task)
+                    self.notify()
                     if not self.silence_actions:
                         console.print(
                             f"Modified requirements for task: [italic]{task.description}[/italic]",
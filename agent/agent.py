@@ -1,28 +1,42 @@
+import asyncio
+import contextvars
 import json
+import os
 import threading
-import time
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 from rich.console import Console
 from rich.markdown import Markdown
+from rich.status import Status
 
 from agent.agency import Agency
+from agent.context import ContextWindow
 from agent.environment import Environment
 from agent.memory import MemoryEngine
 from llms.llm import LLM, Message
+from llms.streaming import StreamCallbacks
 from memory.vector_store import VectorStore
-from tools.index import Toolbox
+from tools.index import Tool, ToolCall, Toolbox
 from tools.libraries.core.send_message_to_user import send_message_to_user, prompt_user
 from utils.pubsub import PubSub
-from utils.tokens import get_current_num_tokens, truncate_message
+from utils.tokens import TokenCounter, truncate_message
+from utils.tracing import tracer
 from roles.identity import IdentityManager
 
 console = Console()
 
 
+class ResponseSuperseded(Exception):
+    """
+    Raised from the stream callbacks of a response new input has made stale,
+    which ends its stream.
+    """
+
+
 class Agent:
     pubsub: PubSub
-    messages: List[Message] = []
+    messages: List[Message]
     toolbox: Toolbox
     llm: LLM
     environment: Environment
@@ -30,11 +44,28 @@ class Agent:
     identity: IdentityManager
     vector_store: Optional[VectorStore]
     agency: Agency
+    context: ContextWindow
+    tokens: TokenCounter
     running: bool = False
     awake: bool = False
     thread: threading.Thread
+    wakeup: threading.Event
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    async_wakeup: Optional[asyncio.Event] = None
     verbose: bool
     silence_actions: bool
+    show_status: bool
+    stream: bool
+    early_dispatch: bool
+    supersede: bool
+    response_shown: bool
+    state_prompt: str
+    response_generation: int = 0
+    superseded_turns: int = 0
+    started_tool_calls: Dict[str, Future[str]]
+    started_tool_tasks: Dict[str, asyncio.Task[str]]
+    responder: ThreadPoolExecutor
+    last_response: Optional[Future[Message]] = None
     iteration: int = 0
 
     def __init__(
@@ -45,18 +76,46 @@ class Agent:
         toolbox: Toolbox,
         verbose: bool,
         silence_actions: bool,
+        show_status: bool = True,
+        stream: bool = False,
     ) -> None:
         self.pubsub = pubsub
         self.llm = llm
         self.toolbox = toolbox
         self.verbose = verbose
         self.silence_actions = silence_actions
-        self.environment = Environment(pubsub=pubsub)
+        self.show_status = show_status
+        self.stream = stream
+        self.early_dispatch = (
+            os.environ.get("EARLY_TOOL_DISPATCH", "true").lower() == "true"
+        )
+        self.supersede = (
+            os.environ.get("SUPERSEDE_ON_NEW_INPUT", "true").lower() == "true"
+        )
+        self.response_shown = False
+        self.state_prompt = ""
+        self.started_tool_calls = {}
+        self.started_tool_tasks = {}
+        self.responder = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="agent-response"
+        )
+        self.messages = []
+        self.wakeup = threading.Event()
+        self.environment = Environment(pubsub=pubsub, on_stimulus=self.wake)
         self.memory = MemoryEngine(pubsub=pubsub, vector_store=vector_store, llm=llm)
-        self.agency = Agency(pubsub=pubsub, llm=llm, silence_actions=silence_actions)
+        self.agency = Agency(
+            pubsub=pubsub,
+            llm=llm,
+            silence_actions=silence_actions,
+            on_change=self.wake,
+        )
         self.vector_store = vector_store
+        self.tokens = TokenCounter(model=llm.model_name)
+        self.context = ContextWindow(model=llm.model_name, llm=llm, counter=self.tokens)
         self.thread = threading.Thread(target=self.run)
-        self.identity = IdentityManager(pubsub=pubsub, toolbox=self.toolbox)
+        self.identity = IdentityManager(
+            pubsub=pubsub, toolbox=self.toolbox, silence_actions=silence_actions
+        )
 
         self.initialize_default_tools()
 
@@ -81,6 +140,14 @@ class Agent:
 
     def stop(self):
         self.running = False
+        self.responder.shutdown(wait=False)
+        self.wake()
+
+    def wake(self):
+        self.wakeup.set()
+        if self.loop and self.async_wakeup:
+            # Stimuli can arrive from other threads, such as tools on the pool
+            self.loop.call_soon_threadsafe(self.async_wakeup.set)
 
     def error(self, message: str):
         self.pubsub.publish("agent_error", message)
@@ -93,19 +160,73 @@ class Agent:
         self.pubsub.publish("agent_log", json_messages)
 
     def run(self):
-        if self.running:
+        while self.running:
+            # Clear before checking so a stimulus arriving mid-check re-arms the wait
+            self.wakeup.clear()
             self.memory.sync_messages(self.messages)
             if self.check_waking_state():
-                self.log_messages()
-                self.iteration += 1
-                if self.verbose:
-                    self.log(f"Iteration {self.iteration}")
-                response_message = self.reason()
-                self.act(response_message)
-                self.run()
+                settle_time = self.environment.settle_time()
+                if settle_time > 0:
+                    # More messages may be on the way, answer them all at once
+                    self.wakeup.wait(settle_time)
+                    continue
+                self.step()
+                continue
 
-            time.sleep(1)
-            self.run()
+            self.wakeup.wait()
+
+    async def run_async(self):
+        """
+        Runs the agent loop on the current event loop instead of its own thread.
+        """
+        self.running = True
+        self.loop = asyncio.get_running_loop()
+        self.async_wakeup = asyncio.Event()
+        while self.running:
+            self.async_wakeup.clear()
+            self.memory.sync_messages(self.messages)
+            if self.check_waking_state():
+                settle_time = self.environment.settle_time()
+                if settle_time > 0:
+                    try:
+                        await asyncio.wait_for(self.async_wakeup.wait(), settle_time)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self.step_async()
+                continue
+
+            await self.async_wakeup.wait()
+
+    def start_iteration(self):
+        self.log_messages()
+        self.iteration += 1
+        if self.verbose:
+            self.log(f"Iteration {self.iteration} ({self.check_token_length()} tokens)")
+
+    def step(self):
+        with tracer.span("iteration") as span:
+            self.start_iteration()
+            span.set("iteration", self.iteration)
+            self.environment.in_turn = True
+            try:
+                response_message = self.reason()
+                if response_message:
+                    self.act(response_message)
+            finally:
+                self.environment.in_turn = False
+
+    async def step_async(self):
+        with tracer.span("iteration") as span:
+            self.start_iteration()
+            span.set("iteration", self.iteration)
+            self.environment.in_turn = True
+            try:
+                response_message = await self.reason_async()
+                if response_message:
+                    await self.act_async(response_message)
+            finally:
+                self.environment.in_turn = False
 
     def check_waking_state(self):
         if self.agency.has_incomplete_tasks():
@@ -125,11 +246,220 @@ class Agent:
         """
         This is where the agent will reason about the environment.
         """
-        self.memory.evaluate_memory(self.environment.peek_environment())
+        with tracer.span("memory.evaluate_memory"):
+            self.memory.evaluate_memory(self.environment.peek_environment())
+
+        self.add_prompt_message()
+
+        # Only one live status can be on screen, so hosted sessions go without
+        status = (
+            console.status("[bold blue]Simmy is thinking...", spinner="dots12")
+            if self.show_status
+            else None
+        )
+        if status:
+            status.start()
+        self.started_tool_calls = {}
+        try:
+            response_message = self.get_response(status)
+        finally:
+            if status:
+                status.stop()
+        if not response_message:
+            return self.on_superseded()
+        with tracer.span("truncate_message"):
+            response_message = truncate_message(response_message)
+
+        return self.add_response_message(response_message)
+
+    async def reason_async(self):
+        # Vector stores are synchronous, so recall happens off the event loop
+        with tracer.span("memory.evaluate_memory"):
+            await asyncio.to_thread(
+                self.memory.evaluate_memory, self.environment.peek_environment()
+            )
+
+        self.add_prompt_message()
+
+        self.started_tool_tasks = {}
+        response_message = await self.get_response_async()
+        if not response_message:
+            return self.on_superseded()
+        with tracer.span("truncate_message"):
+            response_message = truncate_message(response_message)
+
+        return self.add_response_message(response_message)
+
+    def get_response(self, status: Optional[Status]) -> Optional[Message]:
+        """
+        Gets the model's response, or None if new user input arrives first and
+        makes it stale. The prompt already sent stays in the history, and the
+        next turn answers it together with the new input.
+        """
+        messages = self.get_context()
+        tools = self.toolbox.get_tools_listed()
+        stream = self.get_stream_callbacks(status)
+        self.response_shown = False
+        # Stepped directly, as in batch runs, there's no loop to take new input
+        if not self.supersede or not self.running:
+            return self.llm.get_response(messages, tools, stream=stream)
+
+        received = self.environment.user_messages_received
+        future = self.start_response(messages, tools, stream)
+        while True:
+            self.wakeup.clear()
+            if future.done():
+                return future.result()
+            if self.is_superseded(received, bool(self.started_tool_calls)):
+                # A blocking request can't be cancelled, so it's left to finish
+                # on its own thread, while a stream ends at its next chunk
+                self.response_generation += 1
+                return None
+            self.wakeup.wait()
+
+    def start_response(
+        self,
+        messages: List[Message],
+        tools: List[Tool],
+        stream: Optional[StreamCallbacks],
+    ) -> Future[Message]:
+        """
+        Requests a response on the agent's response worker. If a superseded
+        request left behind is still holding it, the new one gets a thread of
+        its own instead of queueing behind it.
+        """
+        context = contextvars.copy_context()
+        if not self.last_response or self.last_response.done():
+            future = self.responder.submit(
+                context.run, self.llm.get_response, messages, tools, stream
+            )
+            self.last_response = future
+        else:
+            future = Future()
+
+            def run():
+                try:
+                    future.set_result(
+                        context.run(self.llm.get_response, messages, tools, stream)
+                    )
+                except BaseException as e:
+                    future.set_exception(e)
+
+            threading.Thread(target=run, name="agent-response", daemon=True).start()
+        future.add_done_callback(lambda _: self.wake())
+        return future
+
+    async def get_response_async(self) -> Optional[Message]:
+        response = self.llm.get_response_async(
+            self.get_context(),
+            self.toolbox.get_tools_listed(),
+            stream=self.get_stream_callbacks(None, run_async=True),
+        )
+        self.response_shown = False
+        # Without run_async there's nothing to wake us for new input
+        if not self.supersede or not self.async_wakeup:
+            return await response
+
+        received = self.environment.user_messages_received
+        task = asyncio.ensure_future(response)
+        while True:
+            self.async_wakeup.clear()
+            if task.done():
+                return task.result()
+            if self.is_superseded(received, bool(self.started_tool_tasks)):
+                self.response_generation += 1
+                task.cancel()
+                return None
+            wakeup = asyncio.ensure_future(self.async_wakeup.wait())
+            await asyncio.wait({task, wakeup}, return_when=asyncio.FIRST_COMPLETED)
+            wakeup.cancel()
+
+    def is_superseded(self, received: int, tools_started: bool) -> bool:
+        if self.environment.user_messages_received == received:
+            return False
+        # Once the user has seen part of the reply or tools have started, finish it
+        return not self.response_shown and not tools_started
+
+    def on_superseded(self) -> None:
+        self.superseded_turns += 1
+        self.log("Superseded the response in flight with new user input.")
+        self.pubsub.publish("agent_turn_superseded", self.iteration)
+        return None
+
+    def get_context(self) -> List[Message]:
+        messages = self.fit_context()
+        if not self.state_prompt:
+            return messages
+        # Sent with every request but never kept, so the history before it
+        # stays byte for byte the same and providers can reuse its cache
+        return messages + [
+            Message(id=None, role="user", content=self.state_prompt, tool_calls=None)
+        ]
+
+    def fit_context(self) -> List[Message]:
+        with tracer.span("context.fit", messages=len(self.messages)) as span:
+            messages = self.context.fit(self.messages)
+            span.set("fitted_messages", len(messages))
+            span.set("history_tokens", self.tokens.count_messages(self.messages))
+            return messages
+
+    def get_stream_callbacks(
+        self, status: Optional[Status], run_async: bool = False
+    ) -> Optional[StreamCallbacks]:
+        if not self.stream:
+            return None
+        generation = self.response_generation
+
+        def check_current():
+            # A superseded response mustn't show text or start tools in the next turn
+            if generation != self.response_generation:
+                raise ResponseSuperseded()
+
+        def on_text(delta: str):
+            check_current()
+            # The spinner would fight with the streamed text for the same line
+            if status:
+                status.stop()
+            self.response_shown = True
+            self.pubsub.publish("new_agent_message_delta", delta)
+
+        held_back = False
+
+        def on_tool_call(tool_call: ToolCall):
+            # Start tools while the model is still writing the rest of its
+            # response, as long as they change nothing and nothing before them
+            # had to wait for the response to finish
+            nonlocal held_back
+            check_current()
+            tool = self.toolbox.get_tool(tool_call.name)
+            if held_back or not tool or not tool.read_only:
+                held_back = True
+                return
+            if run_async:
+                task = self.toolbox.start_tool_call_async(tool_call)
+                if task:
+                    self.started_tool_tasks[tool_call.id] = task
+                return
+            future = self.toolbox.start_tool_call(tool_call)
+            if future:
+                self.started_tool_calls[tool_call.id] = future
+
+        return StreamCallbacks(
+            on_text=on_text,
+            on_tool_call=on_tool_call if self.early_dispatch else None,
+        )
+
+    def add_prompt_message(self):
+        with tracer.span("build_prompt") as span:
+            prompt = self.build_prompt()
+            self.state_prompt = self.build_state_prompt()
+            span.set_size("prompt_bytes", prompt + self.state_prompt)
 
-        prompt = self.build_prompt()
+        self.pubsub.publish("new_agent_perception", prompt + self.state_prompt)
+        if not prompt:
+            return
 
-        self.messages.append(
+        self.add_message(
             Message(
                 id=None,
                 role="user",
@@ -138,13 +468,12 @@ class Agent:
             )
         )
 
-        with console.status("[bold blue]Simmy is thinking...", spinner="dots12"):
-            response_message = self.llm.get_response(
-                self.messages, self.toolbox.get_tools_listed()
-            )
-            response_message = truncate_message(response_message)
+    def add_message(self, message: Message):
+        self.messages.append(message)
+        self.pubsub.publish("agent_message_added", message)
 
-        self.messages.append(response_message)
+    def add_response_message(self, response_message: Message):
+        self.add_message(response_message)
 
         if self.verbose:
             self.log(f"Response message: {response_message}\n")
@@ -155,12 +484,35 @@ class Agent:
         """
         This is where the agent will act based on the message.
         """
+        if not self.prepare_tool_calls(message) or not message.tool_calls:
+            return
 
+        with tracer.span("run_tool_calls", tool_calls=len(message.tool_calls)):
+            returned_messages = self.toolbox.run_tool_calls(
+                message.tool_calls, started=self.started_tool_calls
+            )
+        self.started_tool_calls = {}
+        return self.add_tool_messages(message, returned_messages)
+
+    async def act_async(self, message: Message):
+        if not self.prepare_tool_calls(message) or not message.tool_calls:
+            return
+
+        with tracer.span("run_tool_calls", tool_calls=len(message.tool_calls)):
+            returned_messages = await self.toolbox.run_tool_calls_async(
+                message.tool_calls, started=self.started_tool_tasks
+            )
+        self.started_tool_tasks = {}
+        return self.add_tool_messages(message, returned_messages)
+
+    def prepare_tool_calls(self, message: Message) -> bool:
         if message.content:
-            return self.send_message(message.content)
+            self.send_message(message.content)
+            return False
 
         if not message.tool_calls:
-            return self.error("No tool calls or message provided.")
+            self.error("No tool calls or message provided.")
+            return False
 
         for tool_call in message.tool_calls:
             if self.verbose:
@@ -171,12 +523,15 @@ class Agent:
                 console.print(
                     f"[bold]Running[/bold] {tool_call.name}", style="bright_black"
                 )
+        return True
 
-            returned_message = self.toolbox.run_tool(
-                tool_name=tool_call.name, arguments=tool_call.arguments
-            )
+    def add_tool_messages(self, message: Message, returned_messages: List[str]):
+        if not message.tool_calls:
+            return False
+
+        for tool_call, returned_message in zip(message.tool_calls, returned_messages):
             self.pubsub.publish("new_tool_message", returned_message)
-            self.messages.append(
+            self.add_message(
                 Message(
                     id=None,
                     content=returned_message,
@@ -208,28 +563,42 @@ class Agent:
         return agency
 
     def build_prompt(self):
+        """
+        What's new this turn, which is kept in the history.
+        """
         perception = self.percieve()
-        memory = self.remember()
-        agency = self.get_agency()
 
         prompt = ""
 
         if perception:
             prompt += f"# Environment:\n{perception}\n"
 
+        return prompt
+
+    def build_state_prompt(self):
+        """
+        The agent's current memory and tasks, which only the latest request needs.
+        """
+        memory = self.remember()
+        agency = self.get_agency()
+
+        prompt = ""
+
         if memory:
             prompt += f"# Memory:\n{memory}\n"
 
         if agency:
             prompt += f"# Agency:\n{agency}\n"
 
-        self.pubsub.publish("new_agent_perception", prompt)
-
         return prompt
 
     def check_token_length(self):
         try:
-            tokens = get_current_num_tokens(self.messages, self.llm.model_name)
+            tokens = self.tokens.count_request(
+                self.messages,
+                self.toolbox.get_tools_listed(),
+                self.llm.system_prompt,
+            )
             return tokens
         except Exception as e:
             self.error(f"Error getting token length: {e}")
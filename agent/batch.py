@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from agent.sessions import SessionManager
+
+
+@dataclass
+class BatchJob:
+    id: str
+    prompt: str
+
+
+@dataclass
+class BatchResult:
+    id: str
+    prompt: str
+    # "completed", "idle", "max_iterations", "timeout" or "error"
+    status: str
+    replies: List[str] = field(default_factory=list)
+    tasks: List[Dict[str, Any]] = field(default_factory=list)
+    iterations: int = 0
+    usage: Dict[str, int] = field(
+        default_factory=lambda: {"input_tokens": 0, "output_tokens": 0}
+    )
+    started_at: float = 0.0
+    duration: float = 0.0
+    error: Optional[str] = None
+
+
+def read_jobs(path: str) -> List[BatchJob]:
+    """
+    Reads a JSONL file where each line is {"prompt": ...}, with an optional "id".
+    """
+    jobs = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not entry.get("prompt"):
+                raise ValueError(f"Line {line_number} of {path} has no prompt.")
+            jobs.append(
+                BatchJob(id=str(entry.get("id", line_number)), prompt=entry["prompt"])
+            )
+    return jobs
+
+
+# Jobs that errored or timed out are run again when a batch is picked up again
+FINISHED_STATUSES = ["completed", "idle", "max_iterations"]
+
+
+def read_finished_ids(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    finished = set()
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                if entry["status"] in FINISHED_STATUSES:
+                    finished.add(entry["id"])
+            except (ValueError, KeyError):
+                # A line cut short by a crash, the job will just run again
+                continue
+    return finished
+
+
+class BatchRunner:
+    """
+    Runs a file of prompts headlessly, each in its own session, with up to
+    `concurrency` sessions in flight. A job is finished once the agent has
+    replied and has no incomplete tasks, or when it goes idle without doing so.
+    """
+
+    manager: SessionManager
+    concurrency: int
+    max_iterations: int
+    timeout: float
+    output_lock: asyncio.Lock
+
+    def __init__(
+        self,
+        manager: SessionManager,
+        concurrency: Optional[int] = None,
+        max_iterations: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.manager = manager
+        self.concurrency = concurrency or int(os.environ.get("BATCH_CONCURRENCY", 16))
+        self.max_iterations = max_iterations or int(
+            os.environ.get("BATCH_MAX_ITERATIONS", 25)
+        )
+        self.timeout = timeout or float(os.environ.get("BATCH_JOB_TIMEOUT", 600))
+        self.output_lock = asyncio.Lock()
+
+    async def run_job(self, job: BatchJob, result: BatchResult):
+        session = self.manager.create_session(f"batch-{job.id}-{time.time_ns()}")
+        agent = session.agent
+        try:
+            for event in ["new_agent_message", "new_agent_prompt"]:
+                session.pubsub.subscribe(event, result.replies.append)
+
+            def add_usage(message: Any):
+                for key, value in (getattr(message, "usage", None) or {}).items():
+                    result.usage[key] = result.usage.get(key, 0) + value
+
+            session.pubsub.subscribe("agent_message_added", add_usage)
+
+            session.pubsub.publish("new_user_message", job.prompt)
+            result.status = "max_iterations"
+            while result.iterations < self.max_iterations:
+                agent.memory.sync_messages(agent.messages)
+                if not agent.check_waking_state():
+                    result.status = "idle"
+                    break
+                await agent.step_async()
+                result.iterations += 1
+                if result.replies and not agent.agency.has_incomplete_tasks():
+                    result.status = "completed"
+                    break
+        finally:
+            result.tasks = [asdict(task) for task in agent.agency.tasks]
+            self.manager.close_session(session.id)
+
+    async def run_and_record(self, job: BatchJob, output_path: str):
+        result = BatchResult(
+            id=job.id, prompt=job.prompt, status="error", started_at=time.time()
+        )
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.run_job(job, result), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            result.status = "timeout"
+        except Exception as e:
+            result.status = "error"
+            result.error = str(e)
+        result.duration = time.perf_counter() - started
+
+        async with self.output_lock:
+            # Written as each job finishes, so a long run can be picked up again
+            with open(output_path, "a") as f:
+                f.write(json.dumps(asdict(result)) + "\n")
+        return result
+
+    async def run(self, input_path: str, output_path: str) -> List[BatchResult]:
+        """
+        Runs every job in input_path which doesn't already have a finished
+        result in output_path, appending results to output_path as they finish.
+        """
+        finished = read_finished_ids(output_path)
+        queue: asyncio.Queue[BatchJob] = asyncio.Queue()
+        for job in read_jobs(input_path):
+            if job.id not in finished:
+                queue.put_nowait(job)
+
+        results: List[BatchResult] = []
+
+        async def worker():
+            while not queue.empty():
+                job = queue.get_nowait()
+                results.append(await self.run_and_record(job, output_path))
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        return results
@@ -0,0 +1,188 @@
+import os
+from typing import List, Optional
+
+from llms.llm import LLM, Message
+from utils.tokens import TokenCounter, count_cached, get_current_num_tokens
+
+SUMMARY_SYSTEM_PROMPT = """
+You are compressing the earlier part of a conversation between a user and an AI agent.
+Summarize the turns below in a few short bullet points. Keep user requests, decisions,
+file paths, task ids and results that may matter later. Leave out anything else.
+"""
+
+
+class ContextWindow:
+    """
+    Keeps the messages sent to the model under a token budget. The first turns
+    are pinned, recent turns are kept verbatim, and the turns in between are
+    compacted into a single summary message.
+    """
+
+    model: str
+    llm: Optional[LLM]
+    counter: TokenCounter
+    token_budget: int
+    target_ratio: float
+    pinned_turns: int
+    summary_tokens: int
+    summary_mode: str
+
+    compacted_until: int
+    summary: Optional[Message]
+
+    def __init__(
+        self,
+        model: str,
+        llm: Optional[LLM] = None,
+        token_budget: Optional[int] = None,
+        pinned_turns: Optional[int] = None,
+        counter: Optional[TokenCounter] = None,
+    ) -> None:
+        self.model = model
+        self.llm = llm
+        self.counter = counter or TokenCounter(model)
+        self.token_budget = token_budget or int(
+            os.environ.get("CONTEXT_TOKEN_BUDGET", 60000)
+        )
+        self.pinned_turns = (
+            pinned_turns
+            if pinned_turns is not None
+            else int(os.environ.get("CONTEXT_PINNED_TURNS", 1))
+        )
+        self.target_ratio = float(os.environ.get("CONTEXT_TARGET_RATIO", 0.75))
+        self.summary_tokens = int(os.environ.get("CONTEXT_SUMMARY_TOKENS", 1000))
+        self.summary_mode = os.environ.get("CONTEXT_SUMMARY_MODE", "extractive")
+        self.reset()
+
+    def reset(self):
+        self.compacted_until = 0
+        self.summary = None
+
+    def count(self, messages: List[Message]) -> int:
+        return get_current_num_tokens(messages, self.model)
+
+    def get_turn_starts(self, messages: List[Message]) -> List[int]:
+        """
+        A turn starts at each user or system message, and owns the assistant
+        message and tool results after it, so tool calls and their results are
+        never split apart.
+        """
+        starts = [
+            index
+            for index, message in enumerate(messages)
+            if message.role in ("user", "system")
+        ]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        return starts
+
+    def fit(self, messages: List[Message]) -> List[Message]:
+        if self.compacted_until > len(messages):
+            self.reset()
+
+        counts = self.counter.message_counts(messages)
+        if self.compacted_until == 0 and self.counter.total <= self.token_budget:
+            return messages
+
+        starts = self.get_turn_starts(messages)
+        if len(starts) <= self.pinned_turns + 1:
+            return messages
+
+        pinned_end = starts[self.pinned_turns]
+        first_compactable = max(self.compacted_until, pinned_end)
+        pinned_tokens = sum(counts[:pinned_end])
+        summary_tokens = self.count([self.summary]) if self.summary else 0
+
+        if (
+            pinned_tokens + summary_tokens + sum(counts[first_compactable:])
+            <= self.token_budget
+        ):
+            return self.assemble(messages[:pinned_end], messages[first_compactable:])
+
+        # Move the boundary in one jump down to the target, rather than a turn at
+        # a time, so the start of the window stays the same for as many turns as
+        # possible.
+        target = int(self.token_budget * self.target_ratio)
+        reserved_tokens = pinned_tokens + self.summary_tokens
+        boundary = starts[-1]
+        kept_tokens = 0
+        for start, end in reversed(list(zip(starts, starts[1:] + [len(messages)]))):
+            if start < first_compactable:
+                break
+            turn_tokens = sum(counts[start:end])
+            if reserved_tokens + kept_tokens + turn_tokens > target:
+                break
+            kept_tokens += turn_tokens
+            boundary = start
+
+        if boundary > first_compactable:
+            self.summary = self.summarize(
+                messages[pinned_end:boundary],
+                messages[first_compactable:boundary],
+            )
+            self.compacted_until = boundary
+
+        return self.assemble(
+            messages[:pinned_end], messages[max(self.compacted_until, pinned_end) :]
+        )
+
+    def assemble(self, pinned: List[Message], recent: List[Message]) -> List[Message]:
+        if self.summary:
+            return pinned + [self.summary] + recent
+        return pinned + recent
+
+    def summarize(
+        self, compacted: List[Message], newly_compacted: List[Message]
+    ) -> Optional[Message]:
+        if self.summary_mode == "llm" and self.llm:
+            content = self.summarize_with_llm(newly_compacted, self.summary)
+        else:
+            content = self.summarize_extractive(compacted)
+
+        if not content:
+            return None
+
+        return Message(
+            id=None,
+            role="user",
+            content=f"# Summary of earlier conversation:\n{content}",
+            tool_calls=None,
+        )
+
+    def describe_message(self, message: Message, length: int = 200) -> str:
+        if message.tool_calls:
+            calls = ", ".join(
+                f"{tool_call.name}({tool_call.arguments})"
+                for tool_call in message.tool_calls
+            )
+            return f"{message.role} called: {calls}"[:length]
+        content = " ".join((message.content or "").split())
+        return f"{message.role}: {content}"[:length]
+
+    def summarize_extractive(self, messages: List[Message]) -> str:
+        # Newest lines are kept first, since they are the most likely to matter
+        lines: List[str] = []
+        tokens = 0
+        for message in reversed(messages):
+            line = f"- {self.describe_message(message)}"
+            line_tokens = count_cached(line, self.model)
+            if tokens + line_tokens > self.summary_tokens:
+                break
+            lines.append(line)
+            tokens += line_tokens
+        return "\n".join(reversed(lines))
+
+    def summarize_with_llm(
+        self, messages: List[Message], previous: Optional[Message]
+    ) -> str:
+        if not self.llm:
+            return ""
+        transcript = "\n".join(
+            self.describe_message(message, length=2000) for message in messages
+        )
+        if previous and previous.content:
+            transcript = f"{previous.content}\n{transcript}"
+        try:
+            return self.llm.get_text_response(transcript, SUMMARY_SYSTEM_PROMPT)
+        except Exception:
+            return self.summarize_extractive(messages)
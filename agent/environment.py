@@ -1,4 +1,6 @@
-from typing import List
+import os
+import time
+from typing import Callable, List, Optional
 
 from utils.pubsub import PubSub
 
@@ -7,24 +9,58 @@ unseen_messages = []
 
 class Environment:
     pubsub: PubSub
-
-    unseen_messages: List[str] = []
-    new_tool_messages: List[str] = []
-
-    def __init__(self, pubsub: PubSub) -> None:
+    on_stimulus: Optional[Callable[[], None]]
+
+    unseen_messages: List[str]
+    new_tool_messages: List[str]
+    debounce: float
+    max_debounce: float
+    first_unseen_at: float
+    last_unseen_at: float
+    user_messages_received: int
+    in_turn: bool
+    coalescing: bool
+
+    def __init__(
+        self, pubsub: PubSub, on_stimulus: Optional[Callable[[], None]] = None
+    ) -> None:
         self.pubsub = pubsub
+        self.on_stimulus = on_stimulus
+        self.unseen_messages = []
+        self.new_tool_messages = []
+        self.debounce = int(os.environ.get("INPUT_DEBOUNCE_MS", 250)) / 1000
+        self.max_debounce = int(os.environ.get("INPUT_MAX_DEBOUNCE_MS", 2000)) / 1000
+        self.first_unseen_at = 0.0
+        self.last_unseen_at = 0.0
+        self.user_messages_received = 0
+        self.in_turn = False
+        self.coalescing = False
 
         self.listen_to_messages()
         self.listen_to_new_tool_messages()
 
+    def notify(self):
+        if self.on_stimulus:
+            self.on_stimulus()
+
     def listen_to_messages(self):
-        self.pubsub.subscribe(
-            "new_user_message", lambda message: self.unseen_messages.append(message)
-        )
+        def new_user_message(message):
+            now = time.monotonic()
+            if not self.unseen_messages:
+                self.first_unseen_at = now
+                # A message to an idle agent is answered straight away
+                self.coalescing = self.in_turn
+            self.last_unseen_at = now
+            self.unseen_messages.append(message)
+            self.user_messages_received += 1
+            self.notify()
+
+        self.pubsub.subscribe("new_user_message", new_user_message)
 
     def listen_to_new_tool_messages(self):
         def new_tool_message(message):
             self.new_tool_messages.append(message)
+            self.notify()
 
         self.pubsub.subscribe("new_tool_message", new_tool_message)
 
@@ -55,6 +91,20 @@ class Environment:
         {"".join(["- {}".format(message) for message in self.new_tool_messages])}
         """
 
+    def settle_time(self) -> float:
+        """
+        How much longer to wait for the user to finish a burst of messages that
+        began during a turn, so they're all answered in the next one. Never more
+        than max_debounce in total.
+        """
+        if not self.unseen_messages or not self.debounce or not self.coalescing:
+            return 0.0
+        settles_at = min(
+            self.last_unseen_at + self.debounce,
+            self.first_unseen_at + self.max_debounce,
+        )
+        return max(0.0, settles_at - time.monotonic())
+
     def new_stimuli(self):
         return len(self.unseen_messages) > 0 or len(self.new_tool_messages) > 0
 
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import zlib
+from dataclasses import asdict, dataclass, field
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+from agent.agency import Task
+from agent.agent import Agent
+from llms.llm import Message
+from memory.vector_store import Record
+
+TASK_EVENTS = [
+    "task_created",
+    "task_completed",
+    "task_notes_modified",
+    "task_requirements_modified",
+]
+
+
+@dataclass
+class SessionState:
+    messages: List[Message] = field(default_factory=list)
+    tasks: List[Task] = field(default_factory=list)
+    role: Optional[str] = None
+    memory: List[Record] = field(default_factory=list)
+
+    def apply(self, entry: Dict[str, Any]):
+        kind = entry["type"]
+        if kind == "message":
+            self.messages.append(Message.from_json(entry["message"]))
+        elif kind == "task":
+            task = Task(**entry["task"])
+            for index, existing in enumerate(self.tasks):
+                if existing.id == task.id:
+                    self.tasks[index] = task
+                    break
+            else:
+                self.tasks.append(task)
+        elif kind == "role":
+            self.role = entry["role"]
+        elif kind == "memory":
+            self.memory = [Record(**record) for record in entry["records"]]
+        else:
+            raise ValueError(f"Unknown journal entry type: {kind}")
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "messages": [message.to_json() for message in self.messages],
+            "tasks": [asdict(task) for task in self.tasks],
+            "role": self.role,
+            "memory": [asdict(record) for record in self.memory],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "SessionState":
+        return cls(
+            messages=[Message.from_json(message) for message in data["messages"]],
+            tasks=[Task(**task) for task in data["tasks"]],
+            role=data.get("role"),
+            memory=[Record(**record) for record in data["memory"]],
+        )
+
+
+def encode_line(data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, separators=(",", ":"))
+    return f"{zlib.crc32(payload.encode()):08x} {payload}\n"
+
+
+def decode_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns None for lines that are incomplete or fail their checksum.
+    """
+    checksum, _, payload = line.rstrip("\n").partition(" ")
+    if not line.endswith("\n") or not payload:
+        return None
+    try:
+        if int(checksum, 16) != zlib.crc32(payload.encode()):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class SessionJournal:
+    """
+    An append-only, checksummed log of a session's messages, tasks, role and
+    memory. Each change is written as one line as it happens, and every
+    snapshot_every entries the full state is written to a snapshot so that
+    resuming only has to replay the journal written since.
+    """
+
+    directory: str
+    snapshot_every: int
+    fsync: bool
+    generation: int
+    entries: int
+    file: Optional[IO[str]]
+    get_state: Optional[Callable[[], SessionState]]
+    lock: threading.Lock
+
+    def __init__(
+        self,
+        directory: str,
+        snapshot_every: Optional[int] = None,
+        fsync: Optional[bool] = None,
+    ) -> None:
+        self.directory = directory
+        self.snapshot_every = snapshot_every or int(
+            os.environ.get("JOURNAL_SNAPSHOT_EVERY", 1000)
+        )
+        self.fsync = (
+            fsync
+            if fsync is not None
+            else os.environ.get("JOURNAL_FSYNC", "false").lower() == "true"
+        )
+        self.generation = 0
+        self.entries = 0
+        self.file = None
+        self.get_state = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, "snapshot.log")
+
+    def journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"journal-{generation}.log")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path) or any(
+            name.startswith("journal-") for name in os.listdir(self.directory)
+        )
+
+    def read_snapshot(self) -> Tuple[int, SessionState]:
+        if not os.path.exists(self.snapshot_path):
+            return 0, SessionState()
+        with open(self.snapshot_path, "r") as f:
+            data = decode_line(f.read())
+        if data is None:
+            raise ValueError(f"Snapshot {self.snapshot_path} is corrupt.")
+        return data["generation"], SessionState.from_json(data["state"])
+
+    def load(self) -> SessionState:
+        """
+        Rebuilds the session from the snapshot and the journal written after it.
+        A torn or corrupt tail, as left by a crash mid-write, is dropped.
+        """
+        generation, state = self.read_snapshot()
+        self.generation = generation
+        self.entries = 0
+
+        path = self.journal_path(generation)
+        if not os.path.exists(path):
+            return state
+
+        valid_bytes = 0
+        with open(path, "r") as f:
+            for line in f:
+                entry = decode_line(line)
+                if entry is None:
+                    break
+                state.apply(entry)
+                valid_bytes += len(line.encode())
+                self.entries += 1
+        if valid_bytes < os.path.getsize(path):
+            # Later appends must not land after the garbage
+            with open(path, "r+") as f:
+                f.truncate(valid_bytes)
+        return state
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.journal_path(self.generation), "a")
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def append(self, entry: Dict[str, Any]):
+        with self.lock:
+            self.open()
+            assert self.file is not None
+            self.file.write(encode_line(entry))
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.entries += 1
+            if self.get_state and self.entries >= self.snapshot_every:
+                self.write_snapshot(self.get_state())
+
+    def write_snapshot(self, state: SessionState):
+        # Called with the lock held
+        generation = self.generation + 1
+        temporary_path = self.snapshot_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            f.write(encode_line({"generation": generation, "state": state.to_json()}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+
+        if self.file:
+            self.file.close()
+            self.file = None
+        previous = self.journal_path(self.generation)
+        self.generation = generation
+        self.entries = 0
+        if os.path.exists(previous):
+            os.remove(previous)
+
+    def snapshot(self):
+        if not self.get_state:
+            return
+        with self.lock:
+            self.write_snapshot(self.get_state())
+
+    def restore(self, agent: Agent, state: SessionState):
+        agent.messages.extend(state.messages)
+        agent.agency.tasks = state.tasks
+        agent.memory.current_memory = state.memory
+        if state.role and agent.identity.current_role:
+            if state.role != agent.identity.current_role.name:
+                agent.identity.set_role(state.role)
+
+    def attach(self, agent: Agent):
+        """
+        Starts journaling an agent's changes as they're published.
+        """
+
+        def get_state() -> SessionState:
+            return SessionState(
+                messages=list(agent.messages),
+                tasks=list(agent.agency.tasks),
+                role=agent.identity.current_role.name
+                if agent.identity.current_role
+                else None,
+                memory=list(agent.memory.current_memory),
+            )
+
+        self.get_state = get_state
+        agent.pubsub.subscribe(
+            "agent_message_added",
+            lambda message: self.append(
+                {"type": "message", "message": message.to_json()}
+            ),
+        )
+        for event in TASK_EVENTS:
+            agent.pubsub.subscribe(
+                event, lambda task: self.append({"type": "task", "task": asdict(task)})
+            )
+        agent.pubsub.subscribe(
+            "role_changed", lambda role: self.append({"type": "role", "role": role})
+        )
+        agent.pubsub.subscribe(
+            "memory_committed",
+            lambda records: self.append(
+                {"type": "memory", "records": [asdict(record) for record in records]}
+            ),
+        )
@@ -14,8 +14,8 @@ class MemoryEngine:
     messages: List[Message]
     llm: LLM
 
-    current_memory: List[Record] = []
-    proposed_memory: List[Record] = []
+    current_memory: List[Record]
+    proposed_memory: List[Record]
 
     def __init__(
         self, pubsub: PubSub, vector_store: Optional[VectorStore], llm: LLM
@@ -23,6 +23,9 @@ class MemoryEngine:
         self.pubsub = pubsub
         self.vector_store = vector_store
         self.llm = llm
+        self.messages = []
+        self.current_memory = []
+        self.proposed_memory = []
 
     def is_setup(self) -> bool:
         if self.vector_store is None:
@@ -62,7 +65,10 @@ class MemoryEngine:
         self.proposed_memory = memory
 
     def commit_memory(self):
+        changed = self.current_memory != self.proposed_memory
         self.current_memory = self.proposed_memory
+        if changed:
+            self.pubsub.publish("memory_committed", self.current_memory)
 
     def delete_memories(self, memories: List[int]):
         # wipe the memory
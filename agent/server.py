@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+from collections import deque
+from dataclasses import asdict, is_dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from agent.sessions import Session, SessionManager
+from llms.scheduler import schedulers
+from utils.http import get_pool_stats
+
+# PubSub topics forwarded to event stream clients
+STREAMED_EVENTS = [
+    "new_user_message",
+    "new_agent_message",
+    "new_agent_prompt",
+    "new_agent_message_delta",
+    "task_created",
+    "task_completed",
+    "task_notes_modified",
+    "task_requirements_modified",
+    "role_changed",
+    "agent_error",
+    "agent_turn_superseded",
+]
+
+
+class EventLog:
+    """
+    A bounded, numbered buffer of a session's events. Clients can reconnect
+    with the last id they saw and pick up where they left off.
+    """
+
+    events: Deque[Tuple[int, str, Any]]
+    next_id: int
+    closed: bool
+    condition: threading.Condition
+
+    def __init__(self, max_events: int) -> None:
+        self.events = deque(maxlen=max_events)
+        self.next_id = 1
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def add(self, event: str, data: Any):
+        if hasattr(data, "to_json"):
+            data = data.to_json()
+        elif is_dataclass(data) and not isinstance(data, type):
+            data = asdict(data)
+        with self.condition:
+            self.events.append((self.next_id, event, data))
+            self.next_id += 1
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def wait_for(self, after: int, timeout: float) -> List[Tuple[int, str, Any]]:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed or self.next_id - 1 > after, timeout=timeout
+            )
+            return [event for event in self.events if event[0] > after]
+
+
+class SessionHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections when many clients arrive at once
+    request_queue_size = 128
+
+
+class SessionServer:
+    """
+    Serves agent sessions over HTTP. Messages are posted as JSON, and each
+    session's PubSub events are streamed back as server-sent events.
+
+        POST   /sessions                  {"id": optional} -> {"id": ...}
+        GET    /sessions                  -> {"sessions": [...]}
+        POST   /sessions/<id>/messages    {"content": ...}
+        GET    /sessions/<id>/events      text/event-stream
+        DELETE /sessions/<id>
+        GET    /stats                     connection pools and rate limits
+    """
+
+    manager: SessionManager
+    logs: Dict[str, EventLog]
+    max_events: int
+    heartbeat: float
+    lock: threading.Lock
+    httpd: Optional[SessionHTTPServer]
+
+    def __init__(
+        self,
+        manager: SessionManager,
+        max_events: Optional[int] = None,
+        heartbeat: float = 15.0,
+    ) -> None:
+        self.manager = manager
+        self.logs = {}
+        self.max_events = max_events or int(os.environ.get("SERVER_EVENT_BUFFER", 1000))
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    def create_session(self, session_id: Optional[str] = None) -> Session:
+        session = self.manager.create_session(session_id)
+        log = EventLog(self.max_events)
+        for event in STREAMED_EVENTS:
+            session.pubsub.subscribe(
+                event, lambda data, event=event: log.add(event, data)
+            )
+        with self.lock:
+            self.logs[session.id] = log
+        session.agent.start()
+        return session
+
+    def close_session(self, session_id: str):
+        self.manager.close_session(session_id)
+        with self.lock:
+            log = self.logs.pop(session_id, None)
+        if log:
+            log.close()
+
+    def get_log(self, session_id: str) -> Optional[EventLog]:
+        with self.lock:
+            return self.logs.get(session_id)
+
+    def listen(self, host: str, port: int) -> int:
+        """
+        Binds the server, returning the port it's listening on.
+        """
+        self.httpd = SessionHTTPServer((host, port), self.create_handler())
+        return self.httpd.server_address[1]
+
+    def serve(self, host: str, port: int):
+        self.listen(host, port)
+        assert self.httpd is not None
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        for session_id in list(self.logs):
+            self.close_session(session_id)
+
+    def create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def send_json(self, status: int, body: Any):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def read_json(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return {}
+                return json.loads(self.rfile.read(length))
+
+            def route(self) -> Tuple[List[str], Dict[str, List[str]]]:
+                url = urlparse(self.path)
+                return [part for part in url.path.split("/") if part], parse_qs(
+                    url.query
+                )
+
+            def do_GET(self):
+                parts, query = self.route()
+                if parts == ["sessions"]:
+                    self.send_json(
+                        200,
+                        {
+                            "sessions": [
+                                {"id": session.id, "created_at": session.created_at}
+                                for session in server.manager.list_sessions()
+                            ]
+                        },
+                    )
+                elif parts == ["stats"]:
+                    self.send_json(
+                        200,
+                        {
+                            "http": get_pool_stats(),
+                            "rate_limits": [
+                                scheduler.get_metrics()
+                                for scheduler in list(schedulers.values())
+                            ],
+                        },
+                    )
+                elif (
+                    len(parts) == 3 and parts[0] == "sessions" and parts[2] == "events"
+                ):
+                    after = (
+                        self.headers.get("Last-Event-ID")
+                        or query.get("after", ["0"])[0]
+                    )
+                    try:
+                        after_id = int(after)
+                    except ValueError:
+                        self.send_json(400, {"error": "Invalid event id."})
+                        return
+                    self.stream_events(parts[1], after_id)
+                else:
+                    self.send_json(404, {"error": "Not found."})
+
+            def do_POST(self):
+                parts, _ = self.route()
+                try:
+                    body = self.read_json()
+                except ValueError:
+                    self.send_json(400, {"error": "Invalid JSON."})
+                    return
+                if parts == ["sessions"]:
+                    try:
+                        session = server.create_session(body.get("id"))
+                    except ValueError as e:
+                        self.send_json(409, {"error": str(e)})
+                        return
+                    self.send_json(201, {"id": session.id})
+                elif (
+                    len(parts) == 3
+                    and parts[0] == "sessions"
+                    and parts[2] == "messages"
+                ):
+                    if not body.get("content"):
+                        self.send_json(400, {"error": "No content provided."})
+                        return
+                    try:
+                        server.manager.send_message(parts[1], body["content"])
+                    except ValueError as e:
+                        self.send_json(404, {"error": str(e)})
+                        return
+                    self.send_json(202, {"status": "accepted"})
+                else:
+                    self.send_json(404, {"error": "Not found."})
+
+            def do_DELETE(self):
+                parts, _ = self.route()
+                if len(parts) != 2 or parts[0] != "sessions":
+                    self.send_json(404, {"error": "Not found."})
+                    return
+                try:
+                    server.close_session(parts[1])
+                except ValueError as e:
+                    self.send_json(404, {"error": str(e)})
+                    return
+                self.send_json(200, {"status": "closed"})
+
+            def stream_events(self, session_id: str, after: int):
+                log = server.get_log(session_id)
+                if not log:
+                    self.send_json(404, {"error": f"Session {session_id} not found."})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    while True:
+                        events = log.wait_for(after, timeout=server.heartbeat)
+                        if not events:
+                            if log.closed:
+                                return
+                            # Keeps proxies from timing out an idle stream
+                            self.wfile.write(b": heartbeat\n\n")
+                        for event_id, event, data in events:
+                            self.wfile.write(
+                                f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode()
+                            )
+                            after = event_id
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+        return Handler
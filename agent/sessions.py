@@ -0,0 +1,120 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from agent.agent import Agent
+from llms.llm import LLM
+from memory.vector_store import VectorStore
+from tools.index import ToolLimits, Toolbox
+from utils.pubsub import PubSub
+
+
+@dataclass
+class Session:
+    id: str
+    agent: Agent
+    pubsub: PubSub
+    created_at: float = field(default_factory=time.time)
+    task: Optional["asyncio.Task[None]"] = None
+
+
+class SessionManager:
+    """
+    Hosts many isolated agents in one process. Each session gets its own
+    PubSub, Toolbox and history, while the LLM client, vector store, token
+    caches, tool definitions, tool thread pool and tool limits are shared.
+    Sharing the limits means a per-file lock or a tool's max_concurrency
+    holds across every session, not just within one.
+    """
+
+    llm: LLM
+    vector_store: Optional[VectorStore]
+    verbose: bool
+    stream: bool
+    executor: ThreadPoolExecutor
+    limits: ToolLimits
+    sessions: Dict[str, Session]
+    lock: threading.Lock
+
+    def __init__(
+        self,
+        llm: LLM,
+        vector_store: Optional[VectorStore] = None,
+        verbose: bool = False,
+        tool_workers: Optional[int] = None,
+        stream: bool = False,
+    ) -> None:
+        self.llm = llm
+        self.vector_store = vector_store
+        self.verbose = verbose
+        self.stream = stream
+        self.executor = ThreadPoolExecutor(
+            max_workers=tool_workers or int(os.environ.get("SESSION_TOOL_WORKERS", 32)),
+            thread_name_prefix="session-tools",
+        )
+        self.limits = ToolLimits()
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create_session(self, session_id: Optional[str] = None) -> Session:
+        session_id = session_id or uuid.uuid4().hex
+        pubsub = PubSub()
+        agent = Agent(
+            pubsub=pubsub,
+            llm=self.llm,
+            vector_store=self.vector_store,
+            toolbox=Toolbox(pubsub=pubsub, executor=self.executor, limits=self.limits),
+            verbose=self.verbose,
+            silence_actions=True,
+            show_status=False,
+            stream=self.stream,
+        )
+        session = Session(id=session_id, agent=agent, pubsub=pubsub)
+        with self.lock:
+            if session_id in self.sessions:
+                raise ValueError(f"Session {session_id} already exists.")
+            self.sessions[session_id] = session
+        return session
+
+    def start_session(self, session_id: Optional[str] = None) -> Session:
+        """Creates a session whose agent runs on its own thread."""
+        session = self.create_session(session_id)
+        session.agent.start()
+        return session
+
+    def start_session_async(self, session_id: Optional[str] = None) -> Session:
+        """Creates a session whose agent runs on the current event loop."""
+        session = self.create_session(session_id)
+        session.task = asyncio.get_running_loop().create_task(session.agent.run_async())
+        return session
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def list_sessions(self) -> List[Session]:
+        with self.lock:
+            return list(self.sessions.values())
+
+    def send_message(self, session_id: str, message: str) -> None:
+        session = self.get_session(session_id)
+        if not session:
+            raise ValueError(f"Session {session_id} not found.")
+        session.pubsub.publish("new_user_message", message)
+
+    def close_session(self, session_id: str) -> None:
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if not session:
+            raise ValueError(f"Session {session_id} not found.")
+        session.agent.stop()
+
+    def close_all(self) -> None:
+        for session in self.list_sessions():
+            self.close_session(session.id)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,90 @@
+"""
+Measures how quickly the agent loop wakes up for new stimuli, and checks that
+the stack stays flat across iterations.
+
+Run from the repository root:
+    python -m benchmarks.agent_loop --iterations 10000
+"""
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+from typing import List
+
+from agent.agent import Agent
+from llms.llm import LLM, Message
+from tools.index import Tool, Toolbox
+from utils.pubsub import PubSub
+
+
+def stack_depth() -> int:
+    depth = 0
+    frame = sys._getframe()
+    while frame:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop.")
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    published_at = 0.0
+    latencies: List[float] = []
+    depths: List[int] = []
+    replied = threading.Event()
+
+    def get_model_response(
+        messages: List[Message], tools: List[Tool], system_prompt: str
+    ) -> Message:
+        latencies.append(time.perf_counter() - published_at)
+        depths.append(stack_depth())
+        return Message(id=None, content="ok", role="assistant", tool_calls=None)
+
+    llm = LLM(
+        name="Mock",
+        model_name="mock",
+        get_model_response=get_model_response,
+    )
+    llm.startup("")
+
+    pubsub = PubSub()
+    pubsub.subscribe("new_agent_message", lambda message: replied.set())
+
+    agent = Agent(
+        pubsub=pubsub,
+        llm=llm,
+        vector_store=None,
+        toolbox=Toolbox(pubsub=pubsub),
+        verbose=False,
+        silence_actions=True,
+    )
+    agent.start()
+
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        replied.clear()
+        # Keep the history flat so the numbers isolate the scheduler
+        agent.messages.clear()
+        published_at = time.perf_counter()
+        pubsub.publish("new_user_message", "ping")
+        replied.wait()
+    elapsed = time.perf_counter() - started
+
+    agent.stop()
+    agent.thread.join()
+
+    latencies_us = sorted(latency * 1e6 for latency in latencies)
+    print(f"Iterations:          {len(latencies_us)}")
+    print(f"Total time:          {elapsed:.2f}s")
+    print(f"Wake latency p50:    {statistics.median(latencies_us):.1f}us")
+    print(f"Wake latency p99:    {latencies_us[int(len(latencies_us) * 0.99)]:.1f}us")
+    print(f"Stack depth min/max: {min(depths)}/{max(depths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares the IVF index against exact search: how many of the true top-k
+records it finds (recall@k) and how long a query takes, for each number of
+lists probed, where 0 is the default that scales with the number of lists. Vectors are drawn around random topics, so they cluster the way
+embeddings of related memories do.
+
+Run from the repository root:
+    python -m benchmarks.ann
+    python -m benchmarks.ann --size 200000 --dimensions 512 --nprobes 4,16,64
+"""
+
+import argparse
+import statistics
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from memory.ivf_index import IVFIndex
+from memory.numpy_vector_store import NumpyIndex, normalize
+from memory.vector_store import Record
+
+
+def build_vectors(
+    size: int, dimensions: int, topics: int, rng: np.random.Generator
+) -> np.ndarray:
+    centers = rng.standard_normal((topics, dimensions), dtype=np.float32)
+    vectors = centers[rng.integers(topics, size=size)]
+    vectors += 0.6 * rng.standard_normal((size, dimensions), dtype=np.float32)
+    return normalize(vectors)
+
+
+def build_records(size: int) -> List[Record]:
+    return [
+        Record(
+            id=None,
+            title=f"Record {i}",
+            content="",
+            type="record",
+            similarity=None,
+            importance="low",
+        )
+        for i in range(size)
+    ]
+
+
+def measure(
+    index: NumpyIndex, queries: np.ndarray, limit: int
+) -> Tuple[List[List[int]], float]:
+    results = []
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        result = index.search(query, limit, threshold=-1.0)
+        samples.append((time.perf_counter() - started) * 1e6)
+        results.append([row for row, _ in result[0]])
+    return results, statistics.median(samples)
+
+
+def get_recall(results: List[List[int]], expected: List[List[int]]) -> float:
+    found = sum(len(set(r) & set(e)) for r, e in zip(results, expected))
+    return found / sum(len(e) for e in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IVF index.")
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=1000)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobes", type=str, default="1,2,4,8,16,32,0")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = build_vectors(args.size, args.dimensions, args.topics, rng)
+    queries = build_vectors(args.queries, args.dimensions, args.topics, rng)
+
+    exact = NumpyIndex(args.dimensions, capacity=args.size)
+    exact.add(build_records(args.size), vectors)
+    expected, exact_p50 = measure(exact, queries, args.limit)
+
+    ann = IVFIndex(args.dimensions, nlist=args.nlist)
+    approximate = NumpyIndex(args.dimensions, capacity=args.size)
+    approximate.add(build_records(args.size), vectors)
+    started = time.perf_counter()
+    approximate.attach_ann(ann)
+    build_seconds = time.perf_counter() - started
+
+    print(
+        f"{args.size} vectors, {args.dimensions} dimensions, "
+        f"{len(ann.lists)} lists built in {build_seconds:.1f}s"
+    )
+    print(f"{'search':<18} {'recall@' + str(args.limit):>10} {'p50 (us)':>10}")
+    print(f"{'exact':<18} {1.0:>10.3f} {exact_p50:>10.1f}")
+    for nprobe in [int(nprobe) for nprobe in args.nprobes.split(",")]:
+        ann.nprobe = nprobe
+        results, p50 = measure(approximate, queries, args.limit)
+        recall = get_recall(results, expected)
+        label = f"nprobe {ann.get_nprobe()}" + ("" if nprobe else " (auto)")
+        print(f"{label:<18} {recall:>10.3f} {p50:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures how long converting the history into a provider request takes each
+turn, as the history grows. "incremental" is what build_openai_request and
+build_anthropic_request do now, with one new message and a fresh state block
+each turn. "full" converts every message from scratch, as they used to.
+
+Run from the repository root:
+    python -m benchmarks.conversion
+    python -m benchmarks.conversion --sizes 100,1000,10000 --repeat 500
+"""
+
+import argparse
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.overhead import build_history
+from llms.anthropic import build_anthropic_request, message_to_anthropic_message
+from llms.conversion import MessageConverter
+from llms.llm import Message
+from llms.openai import build_openai_request, message_to_openai_message
+
+
+def convert_fully(
+    convert: Callable[[Message], Any], merge_roles: bool, messages: List[Message]
+) -> List[Dict[str, Any]]:
+    merger = MessageConverter("full", convert, merge_roles=merge_roles)
+    converted: List[Dict[str, Any]] = []
+    for message in messages:
+        merger.append(converted, convert(message))
+    return converted
+
+
+def measure(size: int, repeat: int, build: Callable[[List[Message]], Any]) -> float:
+    history = build_history(size)
+    samples = []
+    for i in range(repeat + 5):
+        history.append(
+            Message(id=None, role="user", content=f"New message {i}", tool_calls=None)
+        )
+        state = Message(
+            id=None, role="user", content=f"# Agency:\n{i}", tool_calls=None
+        )
+        started = time.perf_counter()
+        build(history + [state])
+        # The first few calls fill the caches
+        if i >= 5:
+            samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message conversion.")
+    parser.add_argument("--sizes", type=str, default="10,100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    paths: Dict[str, Callable[[List[Message]], Any]] = {
+        "openai incremental": lambda messages: build_openai_request(messages, [], ""),
+        "openai full": lambda messages: convert_fully(
+            message_to_openai_message, False, messages
+        ),
+        "anthropic incremental": lambda messages: build_anthropic_request(
+            messages, [], ""
+        ),
+        "anthropic full": lambda messages: convert_fully(
+            message_to_anthropic_message, True, messages
+        ),
+    }
+
+    print(f"{'size':>6} {'path':<22} {'p50 (us)':>12}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for name, build in paths.items():
+            print(f"{size:>6} {name:<22} {measure(size, args.repeat, build):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures embedding a set of memories twice, as a re-sync does: once with an
+empty embedding cache, then again with every text already cached. The model
+is simulated by the hashing embedder, plus a delay per batch standing in for
+the API round trip.
+
+Run from the repository root:
+    python -m benchmarks.embedding
+    python -m benchmarks.embedding --records 10000 --latency-ms 300
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from memory.embedder import (
+    Embedder,
+    EmbeddingCache,
+    HashingEmbedder,
+    embed_hashing_batch,
+)
+
+
+def build_texts(count: int, rng: np.random.Generator) -> List[str]:
+    words = [f"word{i}" for i in range(5000)]
+    return [
+        f"# Memory {i}\n" + " ".join(rng.choice(words, size=60)) for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding cache.")
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--dimensions", type=int, default=512)
+    args = parser.parse_args()
+
+    HashingEmbedder.dimensions = args.dimensions
+    batches = []
+
+    def embed_batch(texts: List[str]) -> np.ndarray:
+        batches.append(len(texts))
+        time.sleep(args.latency_ms / 1000)
+        return embed_hashing_batch(texts)
+
+    texts = build_texts(args.records, np.random.default_rng(0))
+    with tempfile.TemporaryDirectory() as directory:
+        embedder = Embedder(
+            name="simulated",
+            embed_batch=embed_batch,
+            dimensions=args.dimensions,
+            batch_size=args.batch_size,
+        )
+        embedder.cache = EmbeddingCache(os.path.join(directory, "embeddings.sqlite"))
+
+        print(f"{'pass':<8} {'batches':>8} {'seconds':>10}")
+        for name in ["cold", "cached"]:
+            batches.clear()
+            started = time.perf_counter()
+            embedder.embed(texts)
+            seconds = time.perf_counter() - started
+            print(f"{name:<8} {len(batches):>8} {seconds:>10.3f}")
+
+        HashingEmbedder.cache = None
+        started = time.perf_counter()
+        HashingEmbedder.embed(texts)
+        seconds = time.perf_counter() - started
+        print(f"hashing embedder alone: {args.records / seconds:,.0f} texts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Measures the framework's own overhead per iteration, with the model replaced
+by a ScriptedLLM, at several history sizes. Results can be saved as a baseline
+and later runs compared against it to catch regressions.
+
+Run from the repository root:
+    python -m benchmarks.overhead
+    python -m benchmarks.overhead --save benchmarks/baselines/overhead.json
+    python -m benchmarks.overhead --compare benchmarks/baselines/overhead.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from agent.agent import Agent
+from llms.llm import Message
+from llms.scripted import ScriptedLLM
+from tools.index import Tool, ToolCall, Toolbox
+from utils.pubsub import PubSub
+
+DEFAULT_BASELINE = "benchmarks/baselines/overhead.json"
+
+noop_tool = Tool(
+    name="benchmark_noop",
+    description="Does nothing.",
+    function=lambda args, ps: "ok",
+    parameters={"type": "object", "properties": {}},
+)
+
+
+def build_history(size: int) -> List[Message]:
+    history = []
+    for i in range(size):
+        turn = i // 4
+        kind = i % 4
+        if kind == 0:
+            history.append(
+                Message(
+                    id=None,
+                    role="user",
+                    content=f"# Environment:\nUser said: message number {turn}, "
+                    + "with some detail about what they want done. " * 4,
+                    tool_calls=None,
+                )
+            )
+        elif kind == 1:
+            history.append(
+                Message(
+                    id=None,
+                    role="assistant",
+                    content=None,
+                    tool_calls=[
+                        ToolCall(
+                            id=f"history-{turn}",
+                            name="benchmark_noop",
+                            arguments={"query": f"lookup {turn}"},
+                        )
+                    ],
+                )
+            )
+        elif kind == 2:
+            history.append(
+                Message(
+                    id=None,
+                    role="tool",
+                    content=f"Result for lookup {turn}. " * 8,
+                    tool_calls=None,
+                    tool_call_id=f"history-{turn}",
+                )
+            )
+        else:
+            history.append(
+                Message(
+                    id=None,
+                    role="assistant",
+                    content=f"Done with step {turn}.",
+                    tool_calls=None,
+                )
+            )
+    return history
+
+
+def create_agent(size: int) -> Agent:
+    llm = ScriptedLLM(
+        script=[
+            Message(
+                id=None,
+                role="assistant",
+                content=None,
+                tool_calls=[ToolCall(id="", name="benchmark_noop", arguments={})],
+            )
+        ]
+    )
+    llm.startup("You are a benchmark.")
+
+    pubsub = PubSub()
+    # Something on the other end of the events, as simple-agent.py would have
+    for event in ["agent_log", "toolbox_log", "new_agent_perception"]:
+        pubsub.subscribe(event, lambda data: None)
+
+    toolbox = Toolbox(pubsub=pubsub)
+    toolbox.register_tool(noop_tool)
+    agent = Agent(
+        pubsub=pubsub,
+        llm=llm,
+        vector_store=None,
+        toolbox=toolbox,
+        verbose=False,
+        silence_actions=True,
+        show_status=False,
+    )
+    agent.messages.extend(build_history(size))
+    return agent
+
+
+def restore_history(agent: Agent, size: int):
+    """
+    Drops what an iteration appended, keeping the token counter in step so the
+    next iteration sees the same history size without a recount.
+    """
+    del agent.messages[size:]
+    counter = agent.tokens
+    del counter.counts[size:]
+    counter.total = sum(counter.counts)
+    counter.last_message = agent.messages[-1] if agent.messages else None
+
+
+def measure(run: Callable[[], Any], repeat: int, reset: Callable[[], Any]) -> Dict:
+    for _ in range(min(5, repeat)):
+        run()
+        reset()
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1e6)
+        reset()
+
+    samples.sort()
+    return {
+        "p50_us": round(statistics.median(samples), 2),
+        "p95_us": round(samples[int(len(samples) * 0.95)], 2),
+    }
+
+
+def run_size(size: int, repeat: int) -> Dict[str, Dict]:
+    agent = create_agent(size)
+    environment = agent.environment.peek_environment()
+    tool_calls = [ToolCall(id="call", name="benchmark_noop", arguments={})]
+
+    def reset():
+        restore_history(agent, size)
+
+    phases: Dict[str, Callable[[], Any]] = {
+        "build_prompt": lambda: agent.build_prompt() + agent.build_state_prompt(),
+        "evaluate_memory": lambda: agent.memory.evaluate_memory(environment),
+        "pubsub_dispatch": lambda: agent.pubsub.publish("agent_log", "message"),
+        "log_messages": agent.log_messages,
+        "context_fit": agent.fit_context,
+        "tool_dispatch": lambda: agent.toolbox.run_tool_calls(tool_calls),
+        "iteration": agent.step,
+    }
+    return {name: measure(run, repeat, reset) for name, run in phases.items()}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, floor_us: float) -> bool:
+    regressed = False
+    for size, phases in results.items():
+        for phase, stats in phases.items():
+            before = baseline.get("results", {}).get(size, {}).get(phase)
+            if not before:
+                continue
+            ratio = stats["p50_us"] / before["p50_us"] if before["p50_us"] else 1.0
+            slower = stats["p50_us"] - before["p50_us"] > floor_us
+            status = "ok"
+            if ratio > 1 + tolerance and slower:
+                status = "REGRESSED"
+                regressed = True
+            print(
+                f"{size:>6} {phase:<16} {before['p50_us']:>12.1f} "
+                f"{stats['p50_us']:>12.1f} {ratio:>7.2f}x  {status}"
+            )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark framework overhead.")
+    parser.add_argument("--sizes", type=str, default="10,1000,10000")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--save", type=str, help="Write the results to this file.")
+    parser.add_argument(
+        "--compare",
+        type=str,
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        help="Compare against a saved baseline, exiting 1 on regressions.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="How much slower a phase's p50 can get before it counts as a regression.",
+    )
+    parser.add_argument(
+        "--floor-us",
+        type=float,
+        default=5.0,
+        help="Differences smaller than this are treated as noise.",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        results[str(size)] = run_size(size, args.repeat)
+
+    print(f"{'size':>6} {'phase':<16} {'p50 (us)':>12} {'p95 (us)':>12}")
+    for size, phases in results.items():
+        for phase, stats in phases.items():
+            print(
+                f"{size:>6} {phase:<16} {stats['p50_us']:>12.1f} {stats['p95_us']:>12.1f}"
+            )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare}:")
+        print(
+            f"{'size':>6} {'phase':<16} {'baseline':>12} {'current':>12} {'ratio':>8}"
+        )
+        if compare(results, baseline, args.tolerance, args.floor_us):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Runs the OpenAI backend against a local fake provider which answers with 429s
+once its own requests per second are used up, to check that the rate limit
+scheduler keeps every call succeeding and interactive calls ahead of
+background ones.
+
+Run from the repository root:
+    python -m benchmarks.rate_limit --clients 20 --calls 10 --server-rps 20
+    OPENAI_RPM=900 LLM_BURST_SECONDS=1 python -m benchmarks.rate_limit
+    python -m benchmarks.rate_limit --serve --port 8766   # just the fake server
+
+The fake server can also stand in for the provider when running the agent:
+    OPENAI_BASE_URL=http://127.0.0.1:8766/v1 OPENAI_API_KEY=fake python simple-agent.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    requests_per_second: int
+    window_started: float
+    window_count: int
+    served: int
+    rejected: int
+    lock: threading.Lock
+
+    def __init__(self, port: int, requests_per_second: int) -> None:
+        super().__init__(("127.0.0.1", port), FakeProviderHandler)
+        self.requests_per_second = requests_per_second
+        self.window_started = time.monotonic()
+        self.window_count = 0
+        self.served = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self) -> float:
+        """
+        Returns 0 if the request is allowed, otherwise how long until it would be.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_started >= 1:
+                self.window_started = now
+                self.window_count = 0
+            if self.window_count < self.requests_per_second:
+                self.window_count += 1
+                self.served += 1
+                return 0.0
+            self.rejected += 1
+            return 1 - (now - self.window_started)
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    # Keeps connections alive, like a real provider
+    protocol_version = "HTTP/1.1"
+    server: FakeProviderServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str]):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        retry_after = self.server.admit()
+        if retry_after:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                {
+                    "retry-after": str(max(1, round(retry_after))),
+                    "retry-after-ms": str(int(retry_after * 1000)),
+                },
+            )
+            return
+        self.send_json(
+            200,
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "fake",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "ok"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 20,
+                    "completion_tokens": 1,
+                    "total_tokens": 21,
+                },
+            },
+            {},
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the rate limit scheduler.")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--server-rps", type=int, default=20)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument(
+        "--serve", action="store_true", help="Only run the fake provider."
+    )
+    args = parser.parse_args()
+
+    server = FakeProviderServer(args.port, args.server_rps)
+    port = server.server_address[1]
+    if args.serve:
+        print(f"Fake provider on http://127.0.0.1:{port}/v1, {args.server_rps} rps")
+        server.serve_forever()
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    # Enough retries that a long burst still gets through
+    os.environ.setdefault("LLM_MAX_RETRIES", "50")
+
+    from llms.llm import Message
+    from llms.openai import OpenAILLM
+    from utils.http import get_pool_stats
+
+    OpenAILLM.startup("")
+
+    latencies: Dict[str, List[float]] = {"interactive": [], "background": []}
+    errors: List[str] = []
+
+    def run_client(index: int):
+        # Every other client does background work, like summaries
+        kind = "background" if index % 2 else "interactive"
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            try:
+                if kind == "background":
+                    OpenAILLM.get_text_response("summarize", "")
+                else:
+                    OpenAILLM.get_response(
+                        [Message(id=None, role="user", content="hi", tool_calls=None)],
+                        [],
+                    )
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    clients = [
+        threading.Thread(target=run_client, args=(i,)) for i in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    total = args.clients * args.calls
+    print(
+        f"Calls:            {total - len(errors)}/{total} succeeded in {elapsed:.2f}s"
+    )
+    print(f"Server served:    {server.served}, rejected with 429: {server.rejected}")
+    for kind, values in latencies.items():
+        if values:
+            values.sort()
+            print(
+                f"{kind.capitalize():<17} p50 {statistics.median(values) * 1000:.0f}ms, "
+                f"p95 {values[int(len(values) * 0.95)] * 1000:.0f}ms"
+            )
+    print(f"Scheduler:        {OpenAILLM.get_scheduler().get_metrics()}")
+    print(f"HTTP pools:       {get_pool_stats()}")
+    for error in errors[:5]:
+        print(f"  {error}")
+
+
+if __name__ == "__main__":
+    main()
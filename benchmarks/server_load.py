@@ -0,0 +1,163 @@
+"""
+Drives the session server with many concurrent clients and reports how long
+it takes from posting a message to the agent's reply arriving on the event
+stream. By default a server with a ScriptedLLM is started in-process, so the
+numbers are the framework's own.
+
+Run from the repository root:
+    python -m benchmarks.server_load --clients 50 --messages 20
+    python -m benchmarks.server_load --url http://127.0.0.1:8765
+"""
+
+import argparse
+import http.client
+import json
+import queue
+import statistics
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from agent.server import SessionServer
+from agent.sessions import SessionManager
+from llms.llm import Message
+from llms.scripted import ScriptedLLM
+
+REPLY_EVENTS = {"new_agent_message", "new_agent_prompt"}
+
+
+def request(
+    host: str, port: int, method: str, path: str, body: Optional[Any] = None
+) -> Any:
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        payload = json.dumps(body) if body is not None else None
+        connection.request(
+            method, path, body=payload, headers={"Content-Type": "application/json"}
+        )
+        response = connection.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            raise Exception(f"{method} {path} failed with {response.status}: {data}")
+        return json.loads(data) if data else None
+    finally:
+        connection.close()
+
+
+def read_events(host: str, port: int, session_id: str, events: queue.Queue):
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    connection.request("GET", f"/sessions/{session_id}/events")
+    response = connection.getresponse()
+    event = None
+    try:
+        while True:
+            line = response.readline()
+            if not line:
+                return
+            line = line.decode().rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: ") :]
+            elif line.startswith("data: ") and event:
+                events.put((event, time.perf_counter()))
+                event = None
+    except (OSError, http.client.HTTPException):
+        return
+    finally:
+        connection.close()
+
+
+def run_client(
+    host: str, port: int, messages: int, latencies: List[float], errors: List[str]
+):
+    try:
+        session_id = request(host, port, "POST", "/sessions", {})["id"]
+        events: queue.Queue[Tuple[str, float]] = queue.Queue()
+        threading.Thread(
+            target=read_events, args=(host, port, session_id, events), daemon=True
+        ).start()
+
+        for i in range(messages):
+            sent_at = time.perf_counter()
+            request(
+                host,
+                port,
+                "POST",
+                f"/sessions/{session_id}/messages",
+                {"content": f"message {i}"},
+            )
+            while True:
+                event, received_at = events.get(timeout=60)
+                if event in REPLY_EVENTS:
+                    latencies.append(received_at - sent_at)
+                    break
+
+        request(host, port, "DELETE", f"/sessions/{session_id}")
+    except Exception as e:
+        errors.append(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the session server.")
+    parser.add_argument("--url", type=str, help="A running server to test instead.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="How long the in-process scripted LLM takes to respond.",
+    )
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname or "127.0.0.1", url.port or 80
+    else:
+        llm = ScriptedLLM(
+            script=[Message(id=None, role="assistant", content="ok", tool_calls=None)],
+            delay=args.latency_ms / 1000,
+        )
+        llm.startup("")
+        server = SessionServer(manager=SessionManager(llm=llm))
+        host = "127.0.0.1"
+        port = server.listen(host, 0)
+        assert server.httpd is not None
+        threading.Thread(target=server.httpd.serve_forever, daemon=True).start()
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    started = time.perf_counter()
+    clients = [
+        threading.Thread(
+            target=run_client, args=(host, port, args.messages, latencies, errors)
+        )
+        for _ in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+
+    if server:
+        server.shutdown()
+        server.manager.close_all()
+
+    if not latencies:
+        print(f"No replies received. Errors: {errors[:5]}")
+        return
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    print(f"Clients:          {args.clients}")
+    print(f"Replies:          {len(latencies_ms)} in {elapsed:.2f}s")
+    print(f"Throughput:       {len(latencies_ms) / elapsed:.1f} replies/s")
+    print(f"Latency p50:      {statistics.median(latencies_ms):.2f}ms")
+    print(f"Latency p99:      {latencies_ms[int(len(latencies_ms) * 0.99)]:.2f}ms")
+    print(f"Errors:           {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {error}")
+
+
+if __name__ == "__main__":
+    main()
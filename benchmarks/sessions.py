@@ -0,0 +1,157 @@
+"""
+Runs many isolated sessions against a mock LLM on a single event loop, and
+reports per-session memory overhead and turn latency. Fails if a session sees
+another's messages, or if tool limits don't hold across sessions.
+
+Run from the repository root:
+    python -m benchmarks.sessions --sessions 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from agent.sessions import SessionManager
+from llms.llm import LLM, Message
+from tools.index import Tool, ToolCall, file_lock_key
+from utils.pubsub import PubSub
+
+
+def check_shared_limits(manager: SessionManager) -> int:
+    """
+    Writes one file from several sessions at once, returning the most writes
+    that were ever running together.
+    """
+    running = 0
+    most_running = 0
+    counter_lock = threading.Lock()
+
+    def write_file(args: Any, pubsub: PubSub) -> str:
+        nonlocal running, most_running
+        with counter_lock:
+            running += 1
+            most_running = max(most_running, running)
+        time.sleep(0.01)
+        with counter_lock:
+            running -= 1
+        return "ok"
+
+    tool = Tool(
+        name="write_file",
+        description="",
+        function=write_file,
+        parameters={},
+        concurrent=True,
+        lock_key=file_lock_key,
+    )
+    sessions = [manager.create_session() for _ in range(4)]
+    threads = []
+    for session in sessions:
+        session.agent.toolbox.register_tool(tool)
+        tool_call = ToolCall(id="0", name="write_file", arguments={"file_path": "x"})
+        threads.append(
+            threading.Thread(
+                target=session.agent.toolbox.run_tool_calls, args=([tool_call],)
+            )
+        )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for session in sessions:
+        manager.close_session(session.id)
+    return most_running
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark hosted sessions.")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    async def get_model_response_async(
+        messages: List[Message], tools: List[Tool], system_prompt: str
+    ) -> Message:
+        await asyncio.sleep(args.latency_ms / 1000)
+        # Echo the session's own last input so isolation can be checked
+        return Message(
+            id=None,
+            content=f"echo {messages[-1].content}",
+            role="assistant",
+            tool_calls=None,
+        )
+
+    llm = LLM(
+        name="Mock",
+        model_name="mock",
+        get_model_response=lambda messages, tools, system_prompt: Message(
+            id=None, content="", role="assistant", tool_calls=None
+        ),
+        get_model_response_async=get_model_response_async,
+    )
+    llm.startup("")
+
+    manager = SessionManager(llm=llm)
+    # Warm up the shared pieces so they aren't counted against the sessions
+    manager.close_session(manager.create_session().id)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = [manager.start_session_async(f"s{i}") for i in range(args.sessions)]
+    await asyncio.sleep(0)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    created_bytes = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    replies: Dict[str, asyncio.Future[float]] = {}
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    for session in sessions:
+        future: asyncio.Future[float] = loop.create_future()
+        replies[session.id] = future
+        session.pubsub.subscribe(
+            "new_agent_message",
+            lambda message, future=future: future.done()
+            or future.set_result(time.perf_counter() - started),
+        )
+        manager.send_message(session.id, f"hello from {session.id}")
+
+    latencies = sorted(await asyncio.gather(*replies.values()))
+    elapsed = time.perf_counter() - started
+
+    leaked = [
+        session.id
+        for session in sessions
+        if any(
+            message.content
+            and "hello from" in message.content
+            and f"hello from {session.id}" not in message.content
+            for message in session.agent.messages
+        )
+    ]
+
+    for session in sessions:
+        session.agent.stop()
+    await asyncio.gather(*[session.task for session in sessions if session.task])
+    most_running = check_shared_limits(manager)
+    manager.close_all()
+
+    print(f"Sessions:             {len(sessions)}")
+    print(f"Memory per session:   {created_bytes / len(sessions) / 1024:.1f} KiB")
+    print(f"All replies in:       {elapsed * 1000:.1f}ms")
+    print(f"Turn latency p50:     {statistics.median(latencies) * 1000:.1f}ms")
+    print(f"Turn latency p99:     {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+    print(f"Sessions with leaks:  {len(leaked)}")
+    print(f"Most same-file writes: {most_running}")
+
+    assert len(latencies) == len(sessions), "Not every session replied"
+    assert not leaked, f"Sessions saw other sessions' messages: {leaked}"
+    assert most_running == 1, "A file was written by two sessions at once"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
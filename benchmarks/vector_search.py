@@ -0,0 +1,71 @@
+"""
+Measures how long the NumPy vector store takes to find the closest records to
+a query, as the number of records grows. Random vectors stand in for
+embeddings, so no embedding API is needed.
+
+Run from the repository root:
+    python -m benchmarks.vector_search
+    python -m benchmarks.vector_search --sizes 1000,50000 --dimensions 1536
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from memory.numpy_vector_store import NumpyIndex
+from memory.vector_store import Record
+
+
+def build_index(size: int, dimensions: int, rng: np.random.Generator) -> NumpyIndex:
+    index = NumpyIndex(dimensions)
+    records = [
+        Record(
+            id=None,
+            title=f"Record {i}",
+            content="",
+            type="record",
+            similarity=None,
+            importance="low",
+        )
+        for i in range(size)
+    ]
+    index.add(records, rng.standard_normal((size, dimensions), dtype=np.float32))
+    return index
+
+
+def measure(
+    index: NumpyIndex, batch: int, limit: int, repeat: int, rng: np.random.Generator
+) -> float:
+    samples = []
+    for _ in range(repeat):
+        queries = rng.standard_normal((batch, index.dimensions), dtype=np.float32)
+        started = time.perf_counter()
+        index.search(queries, limit, threshold=0.0)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector search.")
+    parser.add_argument("--sizes", type=str, default="1000,10000,50000")
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--batches", type=str, default="1,16")
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>7} {'dims':>5} {'batch':>6} {'p50 (us)':>10} {'per query':>10}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        index = build_index(size, args.dimensions, rng)
+        for batch in [int(batch) for batch in args.batches.split(",")]:
+            p50 = measure(index, batch, args.limit, args.repeat, rng)
+            print(
+                f"{size:>7} {args.dimensions:>5} {batch:>6} {p50:>10.1f} {p50 / batch:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
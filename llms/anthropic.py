@@ -1,16 +1,22 @@
 import json
 from dataclasses import dataclass
 import os
-from typing import Dict, cast, List
+from typing import Any, Dict, cast, List, Union
 
 from anthropic.types.message_create_params import ToolChoiceToolChoiceAny
 from dotenv import load_dotenv
 
+from llms.conversion import MessageConverter
 from llms.llm import LLM, Message
-from tools.index import Tool, ToolCall
-from anthropic import Anthropic
+from llms.streaming import ResponseTextStream, StreamCallbacks
+from tools.index import Tool, ToolCall, get_compiled
+from utils.http import get_async_http_client, get_http_client
+from utils.tracing import tracer
+from anthropic import Anthropic, AsyncAnthropic
+from anthropic.types.beta.prompt_caching import PromptCachingBetaMessage
 from anthropic.types import (
     ContentBlock,
+    Message as AnthropicMessage,
     TextBlockParam,
     ToolParam,
     ToolUseBlock,
@@ -22,7 +28,9 @@ from anthropic.types import (
 load_dotenv()
 
 anthropic_client: Anthropic
+anthropic_async_client: AsyncAnthropic
 anthropic_model = "claude-3-5-sonnet-20240620"
+anthropic_prompt_caching = True
 
 
 @dataclass
@@ -34,10 +42,24 @@ class AnthropicTool:
 
 def init_anthropic_llm():
     global anthropic_client
+    global anthropic_async_client
     global anthropic_model
+    global anthropic_prompt_caching
 
+    # Retries are left to the rate limit scheduler, which shares them across calls
     anthropic_client = Anthropic(
         api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        max_retries=0,
+        http_client=get_http_client(),
+    )
+    anthropic_async_client = AsyncAnthropic(
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        max_retries=0,
+        http_client=get_async_http_client(),
+    )
+
+    anthropic_prompt_caching = (
+        os.environ.get("ANTHROPIC_PROMPT_CACHING", "true").lower() == "true"
     )
 
     if os.environ.get("ANTHROPIC_MODEL"):
@@ -157,41 +179,83 @@ def anthropic_message_content_to_message_content(content: List[ContentBlock]) ->
     return " ".join([block.text for block in content if block.type == "text"])
 
 
-def ensure_alternating_roles(messages: List[MessageParam]) -> List[MessageParam]:
-    new_messages: List[MessageParam] = []
+def compile_anthropic_tools(tools: List[Tool]) -> List[ToolParam]:
+    tool_list = [tool_to_anthropic_tool_call(tool) for tool in tools]
+    if anthropic_prompt_caching and tool_list:
+        cast(Dict[str, Any], tool_list[-1])["cache_control"] = {"type": "ephemeral"}
+    return tool_list
 
-    for message in messages:
-        if new_messages and new_messages[-1]["role"] == message["role"]:
-            new_messages[-1]["content"] = cast(
-                List[ContentBlock],
-                cast(List[ContentBlock], new_messages[-1]["content"])
-                + cast(List[ContentBlock], message["content"]),
-            )
-        else:
-            new_messages.append(message)
 
-    return new_messages
+# Consecutive messages with the same role are merged, as the API requires
+# roles to alternate
+anthropic_converter = MessageConverter(
+    "anthropic", message_to_anthropic_message, merge_roles=True
+)
 
 
-def get_anthropic_model_response(
+def with_cache_breakpoint(message: Dict[str, Any]) -> Dict[str, Any]:
+    # Converted messages are shared, so the breakpoint goes on a copy
+    content = message["content"]
+    if isinstance(content, str) or not content:
+        return message
+    return {
+        **message,
+        "content": list(content[:-1])
+        + [{**content[-1], "cache_control": {"type": "ephemeral"}}],
+    }
+
+
+def build_anthropic_request(
     messages: List[Message], tools: List[Tool], system_prompt: str
-) -> Message:
-    if not anthropic_client:
-        raise ValueError("Anthropic client not initialized")
+) -> Dict[str, Any]:
+    with tracer.span("convert_messages", messages=len(messages)) as span:
+        tool_list = get_compiled(
+            tools,
+            "anthropic:cached" if anthropic_prompt_caching else "anthropic",
+            compile_anthropic_tools,
+        )
+        # The history before the last message carries over to the next turn
+        formatted_messages = anthropic_converter.convert_messages(messages[:-1])
+        system: Union[str, List[Dict[str, Any]]] = system_prompt
+        if anthropic_prompt_caching:
+            # Tools, then the system prompt, then the history are cached as one
+            # prefix. The last message is this turn's input, so the history
+            # before it is what the next turn can reuse.
+            system = [
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+            if formatted_messages:
+                formatted_messages[-1] = with_cache_breakpoint(formatted_messages[-1])
+        if messages:
+            anthropic_converter.append(
+                formatted_messages, anthropic_converter.get_converted(messages[-1])
+            )
+        span.set_size("payload_bytes", formatted_messages)
 
-    tool_list = [tool_to_anthropic_tool_call(tool) for tool in tools]
-    formatted_messages = ensure_alternating_roles(
-        [message_to_anthropic_message(message) for message in messages]
-    )
+    return {
+        "system": system,
+        "model": anthropic_model,
+        "max_tokens": int(os.environ.get("MAX_TOKENS", 1024)),
+        "messages": formatted_messages,
+        "tools": tool_list,
+        "tool_choice": ToolChoiceToolChoiceAny(type="any"),
+    }
 
-    message = anthropic_client.messages.create(
-        system=system_prompt,
-        model=anthropic_model,
-        max_tokens=int(os.environ.get("MAX_TOKENS", 1024)),
-        messages=formatted_messages,
-        tools=tool_list,
-        tool_choice=ToolChoiceToolChoiceAny(type="any"),
-    )
+
+def anthropic_response_to_message(
+    message: Union[AnthropicMessage, PromptCachingBetaMessage],
+) -> Message:
+    usage = {
+        "input_tokens": message.usage.input_tokens,
+        "output_tokens": message.usage.output_tokens,
+    }
+    for key in ["cache_creation_input_tokens", "cache_read_input_tokens"]:
+        if getattr(message.usage, key, None):
+            usage[key] = getattr(message.usage, key)
 
     if message.stop_reason == "tool_use":
         return Message(
@@ -202,6 +266,7 @@ def get_anthropic_model_response(
                 anthropic_tool_call_to_tool_call(cast(ToolUseBlock, tc))
                 for tc in message.content
             ],
+            usage=usage,
         )
 
     if message.stop_reason == "max_tokens":
@@ -212,6 +277,7 @@ def get_anthropic_model_response(
             if message.content
             else "Max tokens reached.",
             tool_calls=None,
+            usage=usage,
         )
 
     return Message(
@@ -220,12 +286,126 @@ def get_anthropic_model_response(
         role="assistant",
         tool_calls=None,
         tool_call_id=None,
+        usage=usage,
     )
 
 
+def get_messages_client(client: Union[Anthropic, AsyncAnthropic]) -> Any:
+    # Cache breakpoints are only accepted by the prompt caching beta
+    if anthropic_prompt_caching:
+        return client.beta.prompt_caching.messages
+    return client.messages
+
+
+def get_anthropic_model_response(
+    messages: List[Message], tools: List[Tool], system_prompt: str
+) -> Message:
+    if not anthropic_client:
+        raise ValueError("Anthropic client not initialized")
+
+    request = build_anthropic_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=anthropic_model) as span:
+        message = get_messages_client(anthropic_client).create(**request)
+        span.set("usage", message.usage.model_dump())
+
+    return anthropic_response_to_message(message)
+
+
+async def get_anthropic_model_response_async(
+    messages: List[Message], tools: List[Tool], system_prompt: str
+) -> Message:
+    if not anthropic_async_client:
+        raise ValueError("Anthropic client not initialized")
+
+    request = build_anthropic_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=anthropic_model) as span:
+        message = await get_messages_client(anthropic_async_client).create(**request)
+        span.set("usage", message.usage.model_dump())
+
+    return anthropic_response_to_message(message)
+
+
+class AnthropicStreamAccumulator:
+    """
+    Follows a message stream to publish text as it arrives. The final Message is
+    built from the stream's final message, exactly as the non-streaming path.
+    """
+
+    text: ResponseTextStream
+    callbacks: StreamCallbacks
+    index: int
+
+    def __init__(self, tools: List[Tool], callbacks: StreamCallbacks) -> None:
+        self.text = ResponseTextStream(tools, callbacks)
+        self.callbacks = callbacks
+        self.index = 0
+
+    def add_event(self, event: Any):
+        if event.type == "content_block_start":
+            self.index = event.index
+            if event.content_block.type == "tool_use":
+                self.text.start_tool_call(self.index, event.content_block.name)
+        elif event.type == "text":
+            self.text.add_text(event.text)
+        elif event.type == "input_json":
+            self.text.add_tool_arguments(self.index, event.partial_json)
+        elif event.type == "content_block_stop":
+            if event.content_block.type == "tool_use" and self.callbacks.on_tool_call:
+                self.callbacks.on_tool_call(
+                    anthropic_tool_call_to_tool_call(event.content_block)
+                )
+
+
+def stream_anthropic_model_response(
+    messages: List[Message],
+    tools: List[Tool],
+    system_prompt: str,
+    callbacks: StreamCallbacks,
+) -> Message:
+    if not anthropic_client:
+        raise ValueError("Anthropic client not initialized")
+
+    accumulator = AnthropicStreamAccumulator(tools, callbacks)
+    request = build_anthropic_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=anthropic_model, stream=True) as span:
+        with get_messages_client(anthropic_client).stream(**request) as stream:
+            for event in stream:
+                accumulator.add_event(event)
+            message = stream.get_final_message()
+        span.set("usage", message.usage.model_dump())
+
+    return anthropic_response_to_message(message)
+
+
+async def stream_anthropic_model_response_async(
+    messages: List[Message],
+    tools: List[Tool],
+    system_prompt: str,
+    callbacks: StreamCallbacks,
+) -> Message:
+    if not anthropic_async_client:
+        raise ValueError("Anthropic client not initialized")
+
+    accumulator = AnthropicStreamAccumulator(tools, callbacks)
+    request = build_anthropic_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=anthropic_model, stream=True) as span:
+        async with get_messages_client(anthropic_async_client).stream(
+            **request
+        ) as stream:
+            async for event in stream:
+                accumulator.add_event(event)
+            message = await stream.get_final_message()
+        span.set("usage", message.usage.model_dump())
+
+    return anthropic_response_to_message(message)
+
+
 AnthropicLLM = LLM(
     name="Anthropic",
     model_name=anthropic_model,
     get_model_response=get_anthropic_model_response,
+    get_model_response_async=get_anthropic_model_response_async,
+    stream_model_response=stream_anthropic_model_response,
+    stream_model_response_async=stream_anthropic_model_response_async,
     on_startup=init_anthropic_llm,
 )
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from tools.index import Tool, get_compiled
+
+CACHE_MODES = ["off", "cache", "record", "replay"]
+
+
+def get_tool_schemas(tools: List[Tool]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": tool.name,
+            "description": tool.description,
+            "parameters": tool.parameters,
+        }
+        for tool in tools
+    ]
+
+
+def get_cache_key(
+    llm: str,
+    model: str,
+    system_prompt: str,
+    messages: List[Dict[str, Any]],
+    tools: List[Tool],
+) -> str:
+    """
+    A stable hash of everything that decides what the model is asked. Usage is
+    left out, as it's only known after the fact.
+    """
+    request = {
+        "llm": llm,
+        "model": model,
+        "max_tokens": int(os.environ.get("MAX_TOKENS", 1024)),
+        "system_prompt": system_prompt,
+        "messages": [
+            {key: value for key, value in message.items() if key != "usage"}
+            for message in messages
+        ],
+        "tools": get_compiled(tools, "cache_key", get_tool_schemas),
+    }
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResponseStore:
+    """
+    Responses kept on disk, one file per key. Once the files add up to more
+    than max_bytes, the least recently used are removed.
+    """
+
+    directory: str
+    max_bytes: int
+    sizes: "OrderedDict[str, int]"
+    total_bytes: int
+    lock: threading.Lock
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self):
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entries.append((stat.st_mtime, file_name[: -len(".json")], stat.st_size))
+        # Oldest first, the mtime is bumped on every hit
+        for _, key, size in sorted(entries):
+            self.sizes[key] = size
+            self.total_bytes += size
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if key not in self.sizes:
+                return None
+            path = self.get_path(key)
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self.remove(key)
+                return None
+            self.sizes.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: Dict[str, Any]):
+        payload = json.dumps(data)
+        with self.lock:
+            path = self.get_path(key)
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "w") as f:
+                f.write(payload)
+            os.replace(temporary_path, path)
+            self.total_bytes -= self.sizes.pop(key, 0)
+            self.sizes[key] = len(payload)
+            self.total_bytes += len(payload)
+            self.evict()
+
+    def evict(self):
+        # Called with the lock held
+        while self.total_bytes > self.max_bytes and len(self.sizes) > 1:
+            self.remove(next(iter(self.sizes)))
+
+    def remove(self, key: str):
+        self.total_bytes -= self.sizes.pop(key, 0)
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+
+class Cassette:
+    """
+    A JSONL recording of responses by key. When recording, the file is started
+    over. When replaying, a key asked for more than once gets its responses in
+    the order they were recorded, then the last one again.
+    """
+
+    path: str
+    recording: bool
+    responses: Dict[str, Deque[Dict[str, Any]]]
+    last: Dict[str, Dict[str, Any]]
+    lock: threading.Lock
+
+    def __init__(self, path: str, recording: bool) -> None:
+        self.path = path
+        self.recording = recording
+        self.responses = {}
+        self.last = {}
+        self.lock = threading.Lock()
+        if recording:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            open(path, "w").close()
+        else:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise ValueError(f"No cassette found at {self.path}.")
+        with open(self.path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.responses.setdefault(entry["key"], deque()).append(
+                    entry["response"]
+                )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            responses = self.responses.get(key)
+            if responses:
+                self.last[key] = responses.popleft()
+            return self.last.get(key)
+
+    def record(self, key: str, data: Dict[str, Any]):
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "response": data}) + "\n")
+
+
+class ResponseCache:
+    """
+    Serves model responses for requests seen before. "cache" reads through an
+    on-disk store, "record" captures every response to a cassette, and
+    "replay" answers only from the cassette, so a run needs no network.
+    """
+
+    mode: str
+    store: Optional[ResponseStore]
+    cassette: Optional[Cassette]
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        mode: str,
+        directory: Optional[str] = None,
+        max_bytes: int = 100_000_000,
+        cassette_path: Optional[str] = None,
+    ) -> None:
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode {mode}, expected one of {', '.join(CACHE_MODES)}."
+            )
+        self.mode = mode
+        self.store = None
+        self.cassette = None
+        self.hits = 0
+        self.misses = 0
+        if mode == "cache":
+            if not directory:
+                raise ValueError("The response cache needs a directory.")
+            self.store = ResponseStore(directory, max_bytes)
+        elif mode in ["record", "replay"]:
+            if not cassette_path:
+                raise ValueError(f"Cache mode {mode} needs a cassette path.")
+            self.cassette = Cassette(cassette_path, recording=mode == "record")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = None
+        if self.store:
+            data = self.store.get(key)
+        elif self.cassette and not self.cassette.recording:
+            data = self.cassette.get(key)
+            if data is None:
+                raise Exception(
+                    f"No recorded response for request {key[:12]} in {self.cassette.path}."
+                )
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: Dict[str, Any]):
+        if self.store:
+            self.store.put(key, data)
+        elif self.cassette and self.cassette.recording:
+            self.cassette.record(key, data)
+
+
+response_cache: Optional[ResponseCache] = None
+response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the cache shared by every LLM, configured by LLM_CACHE_MODE,
+    LLM_CACHE_DIR, LLM_CACHE_MAX_MB and LLM_CACHE_CASSETTE. None when off.
+    """
+    global response_cache
+    mode = os.environ.get("LLM_CACHE_MODE", "off").lower()
+    if mode == "off":
+        return None
+    with response_cache_lock:
+        if not response_cache:
+            response_cache = ResponseCache(
+                mode,
+                directory=os.environ.get("LLM_CACHE_DIR", ".cache/llm"),
+                max_bytes=int(os.environ.get("LLM_CACHE_MAX_MB", 100)) * 1_000_000,
+                cassette_path=os.environ.get("LLM_CACHE_CASSETTE"),
+            )
+        return response_cache
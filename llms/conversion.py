@@ -0,0 +1,130 @@
+import operator
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+from llms.llm import Message
+
+
+class ConversionState:
+    """
+    What a converter produced for one history. The output for the first k
+    messages is converted[: sizes[k - 1] - 1] + [tails[k - 1]], as a later
+    message may have been merged into the last one. Appending never changes
+    anything before the last converted message.
+    """
+
+    messages: List[Message]
+    converted: List[Dict[str, Any]]
+    sizes: List[int]
+    tails: List[Dict[str, Any]]
+
+    def __init__(self) -> None:
+        self.messages = []
+        self.converted = []
+        self.sizes = []
+        self.tails = []
+
+    def common_prefix(self, messages: List[Message]) -> int:
+        length = min(len(messages), len(self.messages))
+        # List comparison checks identity before equality, so this stays in C
+        if messages[:length] == self.messages[:length]:
+            return length
+        # Often only the last message is new, like the agent's state block
+        if length and messages[: length - 1] == self.messages[: length - 1]:
+            return length - 1
+        return list(map(operator.is_, messages, self.messages)).index(False)
+
+    def truncate(self, length: int):
+        """
+        Forgets everything after the first length messages.
+        """
+        if length == len(self.messages):
+            return
+        del self.messages[length:]
+        del self.sizes[length:]
+        del self.tails[length:]
+        if length:
+            del self.converted[self.sizes[-1] - 1 :]
+            self.converted.append(self.tails[-1])
+        else:
+            self.converted = []
+
+
+class MessageConverter:
+    """
+    Converts a history into a provider's messages incrementally. Each Message
+    keeps its own converted form, which is treated as immutable, and only the
+    messages appended since the last call for the same history are converted
+    and merged. Histories are told apart by their first message, so sessions
+    sharing a backend don't undo each other's work.
+    """
+
+    provider: str
+    convert: Callable[[Message], Any]
+    merge_roles: bool
+    max_histories: int
+    states: "OrderedDict[int, ConversionState]"
+    lock: threading.Lock
+
+    def __init__(
+        self,
+        provider: str,
+        convert: Callable[[Message], Any],
+        merge_roles: bool = False,
+        max_histories: int = 64,
+    ) -> None:
+        self.provider = provider
+        self.convert = convert
+        self.merge_roles = merge_roles
+        self.max_histories = max_histories
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_converted(self, message: Message) -> Dict[str, Any]:
+        converted = message.converted.get(self.provider)
+        if converted is None:
+            converted = self.convert(message)
+            message.converted[self.provider] = converted
+        return converted
+
+    def append(self, converted: List[Dict[str, Any]], item: Dict[str, Any]):
+        if self.merge_roles and converted and converted[-1]["role"] == item["role"]:
+            # A new message rather than an extended one, the old one is shared
+            converted[-1] = {
+                **converted[-1],
+                "content": list(converted[-1]["content"]) + list(item["content"]),
+            }
+        else:
+            converted.append(item)
+
+    def get_state(self, messages: List[Message]) -> ConversionState:
+        # Called with the lock held. The state holds on to the first message,
+        # so its id can't be reused while the state is around.
+        key = id(messages[0])
+        state = self.states.get(key)
+        if state is None:
+            state = ConversionState()
+            self.states[key] = state
+            while len(self.states) > self.max_histories:
+                self.states.popitem(last=False)
+        self.states.move_to_end(key)
+        return state
+
+    def convert_messages(self, messages: List[Message]) -> List[Dict[str, Any]]:
+        """
+        Returns a new list, which callers may change. The messages in it are
+        shared, so any change to one has to be made on a copy.
+        """
+        if not messages:
+            return []
+        with self.lock:
+            state = self.get_state(messages)
+            common = state.common_prefix(messages)
+            state.truncate(common)
+            for message in messages[common:]:
+                self.append(state.converted, self.get_converted(message))
+                state.messages.append(message)
+                state.sizes.append(len(state.converted))
+                state.tails.append(state.converted[-1])
+            return list(state.converted)
@@ -1,8 +1,18 @@
-from dataclasses import asdict, dataclass
-from typing import Callable, List, Optional
-import time
+import asyncio
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
+from llms.cache import get_cache_key, get_response_cache
+from llms.scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    RateLimitScheduler,
+    get_scheduler,
+)
+from llms.streaming import StreamCallbacks, replay_response, track_emitted
 from tools.index import Tool, ToolCall
+from utils.tracing import tracer
 
 
 @dataclass
@@ -12,14 +22,53 @@ class Message:
     role: str
     tool_calls: Optional[List[ToolCall]]
     tool_call_id: Optional[str] = None
+    # Tokens the provider billed for the response, as input_tokens/output_tokens,
+    # plus cache_read_input_tokens/cache_creation_input_tokens for cached input
+    usage: Optional[Dict[str, int]] = None
+    # Each provider's converted form, made once and then shared, so a message
+    # mustn't be changed after it's been sent
+    converted: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
 
     def to_json(self):
-        return asdict(self)
+        return {
+            "id": self.id,
+            "content": self.content,
+            "role": self.role,
+            "tool_calls": [asdict(tool_call) for tool_call in self.tool_calls]
+            if self.tool_calls is not None
+            else None,
+            "tool_call_id": self.tool_call_id,
+            "usage": dict(self.usage) if self.usage is not None else None,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Message":
+        tool_calls = data.get("tool_calls")
+        return cls(
+            id=data.get("id"),
+            content=data.get("content"),
+            role=data["role"],
+            tool_calls=[ToolCall(**tool_call) for tool_call in tool_calls]
+            if tool_calls
+            else None,
+            tool_call_id=data.get("tool_call_id"),
+            usage=data.get("usage"),
+        )
 
 
 class LLM:
     get_model_response: Callable[[List[Message], List[Tool], str], Message]
+    get_model_response_async: Optional[
+        Callable[[List[Message], List[Tool], str], Awaitable[Message]]
+    ] = None
+    stream_model_response: Optional[
+        Callable[[List[Message], List[Tool], str, StreamCallbacks], Message]
+    ] = None
+    stream_model_response_async: Optional[
+        Callable[[List[Message], List[Tool], str, StreamCallbacks], Awaitable[Message]]
+    ] = None
     on_startup: Optional[Callable[[], None]] = None
+    scheduler: Optional[RateLimitScheduler] = None
     name: str
     model_name: str
     system_prompt: str
@@ -30,10 +79,24 @@ class LLM:
         model_name,
         get_model_response: Callable[[List[Message], List[Tool], str], Message],
         on_startup: Optional[Callable[[], None]] = None,
+        get_model_response_async: Optional[
+            Callable[[List[Message], List[Tool], str], Awaitable[Message]]
+        ] = None,
+        stream_model_response: Optional[
+            Callable[[List[Message], List[Tool], str, StreamCallbacks], Message]
+        ] = None,
+        stream_model_response_async: Optional[
+            Callable[
+                [List[Message], List[Tool], str, StreamCallbacks], Awaitable[Message]
+            ]
+        ] = None,
     ):
         self.name = name
         self.model_name = model_name
         self.get_model_response = get_model_response
+        self.get_model_response_async = get_model_response_async
+        self.stream_model_response = stream_model_response
+        self.stream_model_response_async = stream_model_response_async
         self.on_startup = on_startup
 
     def startup(self, system_prompt: str):
@@ -41,29 +104,177 @@ class LLM:
         if self.on_startup:
             self.on_startup()
 
-    def get_response(self, messages: List[Message], tools: List[Tool]) -> Message:
-        return self.get_model_response(messages, tools, self.system_prompt)
-        # sometimes useful for testing:
-        # time.sleep(1)
-        # return Message(
-        #     id=str(time.time()),
-        #     content=None,
-        #     role="assistant",
-        #     tool_calls=[
-        #         ToolCall(
-        #             id=str(time.time()),
-        #             name="prompt_user",
-        #             arguments={"content": "This is a test from the model"},
-        #         )
-        #     ],
-        # )
+    def get_scheduler(self) -> RateLimitScheduler:
+        if not self.scheduler:
+            self.scheduler = get_scheduler(self.name.lower(), self.model_name)
+        return self.scheduler
 
-    def get_text_response(self, message: str, system_prompt: str) -> str:
-        response = self.get_model_response(
-            [Message(id=None, content=message, role="user", tool_calls=None)],
-            [],
+    def estimate_tokens(self, messages: List[Message], system_prompt: str) -> int:
+        if not self.get_scheduler().tokens.limit:
+            return 0
+        # About four characters a token, plus the most the reply can use
+        characters = len(system_prompt) + sum(
+            len(message.content or "") + len(str(message.tool_calls or ""))
+            for message in messages
+        )
+        return characters // 4 + int(os.environ.get("MAX_TOKENS", 1024))
+
+    def get_usage(self, response: Message) -> Optional[int]:
+        if not response.usage:
+            return None
+        return sum(response.usage.values())
+
+    def get_request_key(
+        self, messages: List[Message], tools: List[Tool], system_prompt: str
+    ) -> Optional[str]:
+        if not get_response_cache():
+            return None
+        return get_cache_key(
+            self.name,
+            self.model_name,
             system_prompt,
+            [message.to_json() for message in messages],
+            tools,
+        )
+
+    def get_cached_response(self, key: Optional[str]) -> Optional[Message]:
+        cache = get_response_cache()
+        if not key or not cache:
+            return None
+        data = cache.get(key)
+        if data is None:
+            return None
+        response = Message.from_json(data)
+        # Nothing was billed for it this time
+        response.usage = None
+        return response
+
+    def cache_response(self, key: Optional[str], response: Message):
+        cache = get_response_cache()
+        if key and cache:
+            cache.put(key, response.to_json())
+
+    def get_response(
+        self,
+        messages: List[Message],
+        tools: List[Tool],
+        stream: Optional[StreamCallbacks] = None,
+    ) -> Message:
+        with tracer.span(
+            "llm.get_response", llm=self.name, messages=len(messages), tools=len(tools)
+        ) as span:
+            key = self.get_request_key(messages, tools, self.system_prompt)
+            cached = self.get_cached_response(key)
+            if cached:
+                span.set("cached", True)
+                if stream:
+                    replay_response(cached.content, cached.tool_calls, tools, stream)
+                return cached
+            stream_model_response = self.stream_model_response
+            if stream and stream_model_response:
+                # A stream that fails part way isn't retried, as that would
+                # send the same deltas and tool calls again
+                tracked, can_retry = track_emitted(stream)
+                response = self.get_scheduler().call(
+                    lambda: stream_model_response(
+                        messages, tools, self.system_prompt, tracked
+                    ),
+                    priority=INTERACTIVE,
+                    tokens=self.estimate_tokens(messages, self.system_prompt),
+                    get_usage=self.get_usage,
+                    can_retry=can_retry,
+                )
+            else:
+                response = self.get_scheduler().call(
+                    lambda: self.get_model_response(
+                        messages, tools, self.system_prompt
+                    ),
+                    priority=INTERACTIVE,
+                    tokens=self.estimate_tokens(messages, self.system_prompt),
+                    get_usage=self.get_usage,
+                )
+            self.cache_response(key, response)
+            span.set("tool_calls", len(response.tool_calls or []))
+            return response
+
+    async def get_response_async(
+        self,
+        messages: List[Message],
+        tools: List[Tool],
+        stream: Optional[StreamCallbacks] = None,
+    ) -> Message:
+        with tracer.span(
+            "llm.get_response", llm=self.name, messages=len(messages), tools=len(tools)
+        ) as span:
+            key = self.get_request_key(messages, tools, self.system_prompt)
+            cached = self.get_cached_response(key)
+            if cached:
+                span.set("cached", True)
+                if stream:
+                    replay_response(cached.content, cached.tool_calls, tools, stream)
+                return cached
+            stream_model_response_async = self.stream_model_response_async
+            if stream and stream_model_response_async:
+                tracked, can_retry = track_emitted(stream)
+                response = await self.get_scheduler().call_async(
+                    lambda: stream_model_response_async(
+                        messages, tools, self.system_prompt, tracked
+                    ),
+                    priority=INTERACTIVE,
+                    tokens=self.estimate_tokens(messages, self.system_prompt),
+                    get_usage=self.get_usage,
+                    can_retry=can_retry,
+                )
+            else:
+                response = await self.get_scheduler().call_async(
+                    lambda: self.call_model_async(messages, tools, self.system_prompt),
+                    priority=INTERACTIVE,
+                    tokens=self.estimate_tokens(messages, self.system_prompt),
+                    get_usage=self.get_usage,
+                )
+            self.cache_response(key, response)
+            span.set("tool_calls", len(response.tool_calls or []))
+            return response
+
+    async def call_model_async(
+        self, messages: List[Message], tools: List[Tool], system_prompt: str
+    ) -> Message:
+        if self.get_model_response_async:
+            return await self.get_model_response_async(messages, tools, system_prompt)
+        # Backends without an async client still work, just off the event loop
+        return await asyncio.to_thread(
+            self.get_model_response, messages, tools, system_prompt
         )
+
+    def get_text_response(self, message: str, system_prompt: str) -> str:
+        # Background work like summaries yields to the agent's own turns
+        messages = [Message(id=None, content=message, role="user", tool_calls=None)]
+        key = self.get_request_key(messages, [], system_prompt)
+        response = self.get_cached_response(key)
+        if not response:
+            response = self.get_scheduler().call(
+                lambda: self.get_model_response(messages, [], system_prompt),
+                priority=BACKGROUND,
+                tokens=self.estimate_tokens(messages, system_prompt),
+                get_usage=self.get_usage,
+            )
+            self.cache_response(key, response)
+        if not response.content:
+            return ""
+        return response.content
+
+    async def get_text_response_async(self, message: str, system_prompt: str) -> str:
+        messages = [Message(id=None, content=message, role="user", tool_calls=None)]
+        key = self.get_request_key(messages, [], system_prompt)
+        response = self.get_cached_response(key)
+        if not response:
+            response = await self.get_scheduler().call_async(
+                lambda: self.call_model_async(messages, [], system_prompt),
+                priority=BACKGROUND,
+                tokens=self.estimate_tokens(messages, system_prompt),
+                get_usage=self.get_usage,
+            )
+            self.cache_response(key, response)
         if not response.content:
             return ""
         return response.content
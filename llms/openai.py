@@ -1,10 +1,12 @@
 import json
 import os
-from typing import List
+from typing import Any, Dict, List, Optional, Set
 
 from dotenv import load_dotenv
-from openai import NOT_GIVEN, OpenAI
+from openai import NOT_GIVEN, AsyncOpenAI, OpenAI
 from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
     ChatCompletionAssistantMessageParam,
     ChatCompletionMessageParam,
     ChatCompletionMessageToolCall,
@@ -17,14 +19,20 @@ from openai.types.chat.chat_completion_message_tool_call_param import (
     ChatCompletionMessageToolCallParam,
     Function,
 )
+from openai.types import CompletionUsage
 from openai.types.shared_params import FunctionDefinition
 
+from llms.conversion import MessageConverter
 from llms.llm import LLM, Message
-from tools.index import Tool, ToolCall
+from llms.streaming import ResponseTextStream, StreamCallbacks
+from tools.index import Tool, ToolCall, get_compiled
+from utils.http import get_async_http_client, get_http_client
+from utils.tracing import tracer
 
 load_dotenv()
 
 openai_client: OpenAI
+openai_async_client: AsyncOpenAI
 openai_model: str = "gpt-4o-mini"
 
 
@@ -91,34 +99,58 @@ def message_to_openai_message(message: Message) -> ChatCompletionMessageParam:
     raise ValueError(f"Invalid message role: {message.role}")
 
 
-def get_openai_model_response(
+def compile_openai_tools(tools: List[Tool]) -> List[ChatCompletionToolParam]:
+    return [tool_to_openai_tool_call(tool) for tool in tools]
+
+
+openai_converter = MessageConverter("openai", message_to_openai_message)
+
+
+def build_openai_request(
     messages: List[Message], tools: List[Tool], system_prompt: str
-) -> Message:
-    if not openai_client:
-        raise ValueError("OpenAI client not initialized")
+) -> Dict[str, Any]:
+    with tracer.span("convert_messages", messages=len(messages)) as span:
+        tool_list = get_compiled(tools, "openai", compile_openai_tools)
 
-    tool_list = [tool_to_openai_tool_call(tool) for tool in tools]
-
-    response = openai_client.chat.completions.create(
-        model=openai_model,
-        max_tokens=int(os.environ.get("MAX_TOKENS", 1024)),
-        messages=[
-            message_to_openai_message(
-                Message(
-                    id=None,
-                    role="system",
-                    content=system_prompt,
-                    tool_calls=None,
-                    tool_call_id=None,
+        request = {
+            "model": openai_model,
+            "max_tokens": int(os.environ.get("MAX_TOKENS", 1024)),
+            "messages": [
+                message_to_openai_message(
+                    Message(
+                        id=None,
+                        role="system",
+                        content=system_prompt,
+                        tool_calls=None,
+                        tool_call_id=None,
+                    )
                 )
-            )
-        ]
-        + [message_to_openai_message(message) for message in messages],
-        tools=tool_list if len(tool_list) > 0 else NOT_GIVEN,
-        parallel_tool_calls=True,
-        tool_choice="required",
-    )
+            ]
+            + openai_converter.convert_messages(messages),
+            "tools": tool_list if len(tool_list) > 0 else NOT_GIVEN,
+            "parallel_tool_calls": True,
+            "tool_choice": "required",
+        }
+        span.set_size("payload_bytes", request["messages"])
+        return request
+
+
+def openai_usage_to_usage(usage: Optional[CompletionUsage]) -> Optional[Dict[str, int]]:
+    if not usage:
+        return None
+    # Reported like Anthropic's, where cached input isn't part of input_tokens
+    details = (usage.model_extra or {}).get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens") or 0
+    result = {
+        "input_tokens": usage.prompt_tokens - cached_tokens,
+        "output_tokens": usage.completion_tokens,
+    }
+    if cached_tokens:
+        result["cache_read_input_tokens"] = cached_tokens
+    return result
 
+
+def openai_response_to_message(response: ChatCompletion) -> Message:
     message = response.choices[0].message
 
     if message.tool_calls is None:
@@ -128,6 +160,7 @@ def get_openai_model_response(
             role=message.role,
             tool_calls=None,
             tool_call_id=None,
+            usage=openai_usage_to_usage(response.usage),
         )
 
     return Message(
@@ -136,14 +169,193 @@ def get_openai_model_response(
         role=message.role,
         tool_calls=[openai_tool_call_to_tool_call(tc) for tc in message.tool_calls],
         tool_call_id=None,
+        usage=openai_usage_to_usage(response.usage),
     )
 
 
+def get_openai_model_response(
+    messages: List[Message], tools: List[Tool], system_prompt: str
+) -> Message:
+    if not openai_client:
+        raise ValueError("OpenAI client not initialized")
+
+    request = build_openai_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=openai_model) as span:
+        response = openai_client.chat.completions.create(**request)
+        if response.usage:
+            span.set("usage", response.usage.model_dump())
+
+    return openai_response_to_message(response)
+
+
+async def get_openai_model_response_async(
+    messages: List[Message], tools: List[Tool], system_prompt: str
+) -> Message:
+    if not openai_async_client:
+        raise ValueError("OpenAI client not initialized")
+
+    request = build_openai_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=openai_model) as span:
+        response = await openai_async_client.chat.completions.create(**request)
+        if response.usage:
+            span.set("usage", response.usage.model_dump())
+
+    return openai_response_to_message(response)
+
+
+class OpenAIStreamAccumulator:
+    """
+    Collects a streamed chat completion into the same Message the non-streaming
+    path would return.
+    """
+
+    text: ResponseTextStream
+    callbacks: StreamCallbacks
+    role: str
+    content: List[str]
+    tool_calls: Dict[int, Dict[str, str]]
+    dispatched: Set[int]
+    usage: Optional[CompletionUsage]
+
+    def __init__(self, tools: List[Tool], callbacks: StreamCallbacks) -> None:
+        self.text = ResponseTextStream(tools, callbacks)
+        self.callbacks = callbacks
+        self.role = "assistant"
+        self.content = []
+        self.tool_calls = {}
+        self.dispatched = set()
+        self.usage = None
+
+    def add_chunk(self, chunk: ChatCompletionChunk):
+        if chunk.usage:
+            # Sent on a final chunk with no choices
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        if delta.role:
+            self.role = delta.role
+        if delta.content:
+            self.content.append(delta.content)
+            self.text.add_text(delta.content)
+        for tool_call in delta.tool_calls or []:
+            entry = self.tool_calls.setdefault(
+                tool_call.index, {"id": "", "name": "", "arguments": ""}
+            )
+            if tool_call.id:
+                entry["id"] = tool_call.id
+            if tool_call.function and tool_call.function.name:
+                entry["name"] += tool_call.function.name
+                self.text.start_tool_call(tool_call.index, entry["name"])
+            if tool_call.function and tool_call.function.arguments:
+                entry["arguments"] += tool_call.function.arguments
+                self.text.add_tool_arguments(
+                    tool_call.index, tool_call.function.arguments
+                )
+                self.dispatch_if_complete(tool_call.index)
+
+    def dispatch_if_complete(self, index: int):
+        if not self.callbacks.on_tool_call or index in self.dispatched:
+            return
+        entry = self.tool_calls[index]
+        # Arguments are a JSON object, so they can only be complete on a "}"
+        if not entry["id"] or not entry["arguments"].rstrip().endswith("}"):
+            return
+        try:
+            arguments = json.loads(entry["arguments"])
+        except json.JSONDecodeError:
+            return
+        self.dispatched.add(index)
+        self.callbacks.on_tool_call(
+            ToolCall(name=entry["name"], arguments=arguments, id=entry["id"])
+        )
+
+    def to_message(self) -> Message:
+        if not self.tool_calls:
+            return Message(
+                id=None,
+                content="".join(self.content) if self.content else None,
+                role=self.role,
+                tool_calls=None,
+                tool_call_id=None,
+                usage=openai_usage_to_usage(self.usage),
+            )
+
+        return Message(
+            id=None,
+            content=None,
+            role=self.role,
+            tool_calls=[
+                ToolCall(
+                    name=entry["name"],
+                    arguments=json.loads(entry["arguments"] or "{}"),
+                    id=entry["id"],
+                )
+                for _, entry in sorted(self.tool_calls.items())
+            ],
+            tool_call_id=None,
+            usage=openai_usage_to_usage(self.usage),
+        )
+
+
+def stream_openai_model_response(
+    messages: List[Message],
+    tools: List[Tool],
+    system_prompt: str,
+    callbacks: StreamCallbacks,
+) -> Message:
+    if not openai_client:
+        raise ValueError("OpenAI client not initialized")
+
+    accumulator = OpenAIStreamAccumulator(tools, callbacks)
+    request = build_openai_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=openai_model, stream=True):
+        stream = openai_client.chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            accumulator.add_chunk(chunk)
+
+    return accumulator.to_message()
+
+
+async def stream_openai_model_response_async(
+    messages: List[Message],
+    tools: List[Tool],
+    system_prompt: str,
+    callbacks: StreamCallbacks,
+) -> Message:
+    if not openai_async_client:
+        raise ValueError("OpenAI client not initialized")
+
+    accumulator = OpenAIStreamAccumulator(tools, callbacks)
+    request = build_openai_request(messages, tools, system_prompt)
+    with tracer.span("llm.http", model=openai_model, stream=True):
+        stream = await openai_async_client.chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            accumulator.add_chunk(chunk)
+
+    return accumulator.to_message()
+
+
 def init_openai_llm():
     global openai_client
+    global openai_async_client
     global openai_model
 
-    openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    # Retries are left to the rate limit scheduler, which shares them across calls
+    openai_client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        max_retries=0,
+        http_client=get_http_client(),
+    )
+    openai_async_client = AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        max_retries=0,
+        http_client=get_async_http_client(),
+    )
 
     env_model = os.environ.get("OPENAI_MODEL")
     if env_model != "" and env_model is not None:
@@ -156,5 +368,8 @@ OpenAILLM = LLM(
     name="OpenAI",
     model_name=openai_model,
     get_model_response=get_openai_model_response,
+    get_model_response_async=get_openai_model_response_async,
+    stream_model_response=stream_openai_model_response,
+    stream_model_response_async=stream_openai_model_response_async,
     on_startup=init_openai_llm,
 )
@@ -0,0 +1,408 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+# Lower runs first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# Rate limited or overloaded, which holds back every call to the provider
+RATE_LIMIT_STATUS_CODES = {429, 529}
+# Worth another try for the call that got them, along with any 5xx
+RETRYABLE_STATUS_CODES = {408, 409} | RATE_LIMIT_STATUS_CODES
+
+
+class TokenBucket:
+    """
+    Refills continuously at a per-minute limit, holding at most burst_seconds
+    worth. A limit of 0 never runs dry.
+    """
+
+    limit: int
+    capacity: float
+    level: float
+    updated_at: float
+
+    def __init__(self, limit: int, burst_seconds: float = 60) -> None:
+        self.limit = limit
+        self.capacity = max(1.0, limit * burst_seconds / 60)
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        if not self.limit:
+            return
+        rate = self.limit / 60
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.limit:
+            return 0.0
+        self.refill(now)
+        # A single call larger than the whole bucket only waits for a full one
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.limit / 60)
+
+    def take(self, amount: float):
+        if self.limit:
+            self.level -= amount
+
+
+@dataclass(order=True)
+class Waiter:
+    priority: int
+    sequence: int
+    tokens: int = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    event: Optional[threading.Event] = field(default=None, compare=False)
+    future: Optional[asyncio.Future] = field(default=None, compare=False)
+    loop: Optional[asyncio.AbstractEventLoop] = field(default=None, compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def is_connection_error(error: Exception) -> bool:
+    # The provider SDKs raise their own errors from the underlying httpx one
+    cause: Optional[BaseException] = error
+    while cause:
+        if isinstance(cause, (httpx.TransportError, ConnectionError, TimeoutError)):
+            return True
+        cause = cause.__cause__
+    return False
+
+
+def is_retryable(error: Exception) -> bool:
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    return is_connection_error(error)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Reads how long the provider asked us to wait, in seconds, if it said.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitScheduler:
+    """
+    Queues calls to one provider and model so they stay under its requests
+    and tokens per minute, letting higher priority calls go first. Calls which
+    are rate limited anyway wait for the provider's retry-after, or back off
+    with jitter, then go back into the queue. Timeouts, dropped connections and
+    server errors are retried the same way, but only hold back the call that
+    failed.
+    """
+
+    name: str
+    requests: TokenBucket
+    tokens: TokenBucket
+    max_retries: int
+    max_backoff: float
+    blocked_until: float
+    waiters: List[Waiter]
+    sequence: Any
+    lock: threading.Lock
+    timer: Optional[threading.Timer]
+    timer_due: float
+    waits: Deque[float]
+    granted: int
+    rate_limited: int
+    retries: int
+    max_queue_depth: int
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_retries: int = 5,
+        max_backoff: float = 60.0,
+        burst_seconds: float = 60,
+    ) -> None:
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.blocked_until = 0.0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.timer = None
+        self.timer_due = 0.0
+        self.waits = deque(maxlen=1000)
+        self.granted = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.max_queue_depth = 0
+
+    def enqueue(self, waiter: Waiter):
+        with self.lock:
+            heapq.heappush(self.waiters, waiter)
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+            self.dispatch()
+
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self.waiters if not waiter.cancelled)
+
+    def dispatch(self):
+        # Called with the lock held
+        while self.waiters:
+            waiter = self.waiters[0]
+            if waiter.cancelled:
+                heapq.heappop(self.waiters)
+                continue
+            now = time.monotonic()
+            wait = max(
+                self.blocked_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(waiter.tokens, now),
+            )
+            if wait > 0:
+                self.schedule_dispatch(now + wait)
+                return
+            heapq.heappop(self.waiters)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.granted += 1
+            self.waits.append(now - waiter.enqueued_at)
+            self.grant(waiter)
+
+    def grant(self, waiter: Waiter):
+        if waiter.event:
+            waiter.event.set()
+        elif waiter.future and waiter.loop:
+            future = waiter.future
+
+            def resolve():
+                if not future.done():
+                    future.set_result(None)
+
+            waiter.loop.call_soon_threadsafe(resolve)
+
+    def schedule_dispatch(self, due: float):
+        if self.timer and self.timer_due <= due:
+            return
+        if self.timer:
+            self.timer.cancel()
+        self.timer_due = due
+        self.timer = threading.Timer(max(0.0, due - time.monotonic()), self.on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def on_timer(self):
+        with self.lock:
+            self.timer = None
+            self.dispatch()
+
+    def acquire(self, priority: int, tokens: int):
+        waiter = Waiter(
+            priority=priority,
+            sequence=next(self.sequence),
+            tokens=tokens,
+            enqueued_at=time.monotonic(),
+            event=threading.Event(),
+        )
+        self.enqueue(waiter)
+        assert waiter.event is not None
+        waiter.event.wait()
+
+    async def acquire_async(self, priority: int, tokens: int):
+        loop = asyncio.get_running_loop()
+        waiter = Waiter(
+            priority=priority,
+            sequence=next(self.sequence),
+            tokens=tokens,
+            enqueued_at=time.monotonic(),
+            future=loop.create_future(),
+            loop=loop,
+        )
+        self.enqueue(waiter)
+        assert waiter.future is not None
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self.lock:
+                waiter.cancelled = True
+            raise
+
+    def record_usage(self, estimated: int, actual: Optional[int]):
+        """
+        Corrects the token budget once the provider reports what a call used.
+        """
+        if actual is None:
+            return
+        with self.lock:
+            self.tokens.take(actual - estimated)
+
+    def get_backoff(self, error: Exception, attempt: int) -> float:
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            # A little jitter so every waiting call doesn't retry in the same instant
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1 + 0.1))
+        return random.uniform(0, min(self.max_backoff, 2**attempt))
+
+    def should_retry(
+        self,
+        error: Exception,
+        attempt: int,
+        can_retry: Optional[Callable[[], bool]] = None,
+    ) -> bool:
+        return (
+            is_retryable(error)
+            and attempt < self.max_retries
+            and (not can_retry or can_retry())
+        )
+
+    def on_retry(self, error: Exception, attempt: int) -> float:
+        """
+        Records a retry, returning how long the failed call should wait
+        before it goes back into the queue.
+        """
+        delay = self.get_backoff(error, attempt)
+        with self.lock:
+            self.retries += 1
+            if get_status_code(error) not in RATE_LIMIT_STATUS_CODES:
+                return delay
+            self.rate_limited += 1
+            # The limit is shared, so everything queued waits, not just this call
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            return 0.0
+
+    def call(
+        self,
+        function: Callable[[], T],
+        priority: int = INTERACTIVE,
+        tokens: int = 0,
+        get_usage: Optional[Callable[[T], Optional[int]]] = None,
+        can_retry: Optional[Callable[[], bool]] = None,
+    ) -> T:
+        """
+        Runs function once the limits allow, retrying it on failures worth
+        retrying. can_retry is asked first, for calls that can't safely be
+        repeated once they've got part way.
+        """
+        attempt = 0
+        while True:
+            self.acquire(priority, tokens)
+            try:
+                result = function()
+            except Exception as e:
+                if not self.should_retry(e, attempt, can_retry):
+                    raise
+                time.sleep(self.on_retry(e, attempt))
+                attempt += 1
+                continue
+            if get_usage:
+                self.record_usage(tokens, get_usage(result))
+            return result
+
+    async def call_async(
+        self,
+        function: Callable[[], Awaitable[T]],
+        priority: int = INTERACTIVE,
+        tokens: int = 0,
+        get_usage: Optional[Callable[[T], Optional[int]]] = None,
+        can_retry: Optional[Callable[[], bool]] = None,
+    ) -> T:
+        attempt = 0
+        while True:
+            await self.acquire_async(priority, tokens)
+            try:
+                result = await function()
+            except Exception as e:
+                if not self.should_retry(e, attempt, can_retry):
+                    raise
+                await asyncio.sleep(self.on_retry(e, attempt))
+                attempt += 1
+                continue
+            if get_usage:
+                self.record_usage(tokens, get_usage(result))
+            return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            waits = sorted(self.waits)
+            return {
+                "name": self.name,
+                "queue_depth": self.queue_depth(),
+                "max_queue_depth": self.max_queue_depth,
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "wait_p50": statistics.median(waits) if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+                "blocked_for": max(0.0, self.blocked_until - time.monotonic()),
+            }
+
+
+schedulers: Dict[Tuple[str, str], RateLimitScheduler] = {}
+schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str, model: str) -> RateLimitScheduler:
+    """
+    Returns the scheduler shared by every caller of a provider and model.
+    Limits come from <PROVIDER>_RPM and <PROVIDER>_TPM, falling back to
+    LLM_RPM and LLM_TPM, with 0 meaning unlimited. LLM_BURST_SECONDS limits
+    how much of a minute's budget can be spent at once, for providers which
+    enforce their limits over shorter windows.
+    """
+    key = (provider, model)
+    with schedulers_lock:
+        if key not in schedulers:
+            prefix = provider.upper()
+            schedulers[key] = RateLimitScheduler(
+                name=f"{provider}/{model}",
+                requests_per_minute=int(
+                    os.environ.get(f"{prefix}_RPM", os.environ.get("LLM_RPM", 0))
+                ),
+                tokens_per_minute=int(
+                    os.environ.get(f"{prefix}_TPM", os.environ.get("LLM_TPM", 0))
+                ),
+                max_retries=int(os.environ.get("LLM_MAX_RETRIES", 5)),
+                burst_seconds=float(os.environ.get("LLM_BURST_SECONDS", 60)),
+            )
+        return schedulers[key]
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from llms.llm import LLM, Message
+from llms.streaming import StreamCallbacks, replay_response
+from tools.index import Tool, ToolCall
+
+
+def message_from_script(entry: Dict[str, Any]) -> Message:
+    tool_calls = entry.get("tool_calls")
+    return Message(
+        id=entry.get("id"),
+        content=entry.get("content"),
+        role=entry.get("role", "assistant"),
+        tool_calls=[
+            ToolCall(
+                id=tool_call.get("id", ""),
+                name=tool_call["name"],
+                arguments=tool_call.get("arguments", {}),
+            )
+            for tool_call in tool_calls
+        ]
+        if tool_calls
+        else None,
+        usage=entry.get("usage"),
+    )
+
+
+def load_script(path: str) -> List[Message]:
+    """
+    Loads a script from a JSON file holding a list of messages, for example:
+        [{"tool_calls": [{"name": "send_message_to_user", "arguments": {"content": "Hi"}}]}]
+    """
+    with open(path, "r") as f:
+        return [message_from_script(entry) for entry in json.load(f)]
+
+
+class ScriptedLLM(LLM):
+    """
+    Replays a fixed sequence of responses instead of calling a model, so runs
+    are deterministic and free. Useful for tests and for benchmarking the
+    framework without network time. Sessions sharing one instance take turns
+    through the same script.
+    """
+
+    script: List[Message]
+    script_path: Optional[str]
+    position: int
+    calls: int
+    repeat: bool
+    delay: float
+    lock: threading.Lock
+
+    def __init__(
+        self,
+        script: Optional[List[Message]] = None,
+        script_path: Optional[str] = None,
+        repeat: bool = True,
+        delay: float = 0.0,
+        model_name: str = "scripted",
+    ):
+        super().__init__(
+            name="Scripted",
+            model_name=model_name,
+            get_model_response=self.get_scripted_response,
+            on_startup=self.load,
+            stream_model_response=self.stream_scripted_response,
+        )
+        self.script = script or []
+        self.script_path = script_path
+        self.position = 0
+        self.calls = 0
+        self.repeat = repeat
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.script_path:
+            self.script = load_script(self.script_path)
+        if not self.script:
+            raise ValueError(
+                "No script provided. Set SCRIPTED_LLM_FILE to a JSON list of messages."
+            )
+
+    def next_response(self) -> Message:
+        with self.lock:
+            if self.position >= len(self.script):
+                if not self.repeat:
+                    raise ValueError("Scripted LLM has run out of responses.")
+                self.position = 0
+            scripted = self.script[self.position]
+            self.position += 1
+            self.calls += 1
+            calls = self.calls
+        if self.delay:
+            time.sleep(self.delay)
+
+        # Hand out a fresh copy with unique ids, as the agent keys tool results by id
+        return Message(
+            id=scripted.id,
+            content=scripted.content,
+            role=scripted.role,
+            tool_calls=[
+                ToolCall(
+                    id=tool_call.id or f"scripted-{calls}-{index}",
+                    name=tool_call.name,
+                    arguments=dict(tool_call.arguments),
+                )
+                for index, tool_call in enumerate(scripted.tool_calls)
+            ]
+            if scripted.tool_calls
+            else None,
+            usage=scripted.usage,
+        )
+
+    def get_scripted_response(
+        self, messages: List[Message], tools: List[Tool], system_prompt: str
+    ) -> Message:
+        return self.next_response()
+
+    def stream_scripted_response(
+        self,
+        messages: List[Message],
+        tools: List[Tool],
+        system_prompt: str,
+        callbacks: StreamCallbacks,
+    ) -> Message:
+        response = self.next_response()
+        replay_response(response.content, response.tool_calls, tools, callbacks)
+        return response
+
+
+ScriptedLLMFromEnv = ScriptedLLM(script_path=os.environ.get("SCRIPTED_LLM_FILE"))
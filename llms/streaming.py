@@ -0,0 +1,126 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import jiter
+
+from tools.index import Tool, ToolCall
+
+
+@dataclass
+class StreamCallbacks:
+    on_text: Optional[Callable[[str], None]] = None
+    # Called once per tool call, as soon as its arguments are complete
+    on_tool_call: Optional[Callable[[ToolCall], None]] = None
+
+
+def track_emitted(
+    callbacks: StreamCallbacks,
+) -> Tuple[StreamCallbacks, Callable[[], bool]]:
+    """
+    Wraps callbacks, returning them with a check that nothing has been passed
+    on yet. Once something has, retrying the request would repeat it.
+    """
+    emitted = False
+
+    def on_text(delta: str):
+        nonlocal emitted
+        emitted = True
+        if callbacks.on_text:
+            callbacks.on_text(delta)
+
+    def on_tool_call(tool_call: ToolCall):
+        nonlocal emitted
+        emitted = True
+        if callbacks.on_tool_call:
+            callbacks.on_tool_call(tool_call)
+
+    return (
+        StreamCallbacks(
+            on_text=on_text if callbacks.on_text else None,
+            on_tool_call=on_tool_call if callbacks.on_tool_call else None,
+        ),
+        lambda: not emitted,
+    )
+
+
+class ResponseTextStream:
+    """
+    Turns a streamed response into user-facing text deltas. Plain text is passed
+    straight through, and tool calls whose tool has a display_argument (like
+    send_message_to_user's content) have that argument emitted as it arrives.
+    """
+
+    on_text: Optional[Callable[[str], None]]
+    display_arguments: Dict[str, str]
+    tool_names: Dict[Any, str]
+    tool_arguments: Dict[Any, str]
+    emitted: Dict[Any, int]
+    current: Any
+
+    def __init__(self, tools: List[Tool], callbacks: Optional[StreamCallbacks]):
+        self.on_text = callbacks.on_text if callbacks else None
+        self.display_arguments = {
+            tool.name: tool.display_argument for tool in tools if tool.display_argument
+        }
+        self.tool_names = {}
+        self.tool_arguments = {}
+        self.emitted = {}
+        self.current = None
+
+    def emit(self, key: Any, text: str):
+        if not text or not self.on_text:
+            return
+        # Separate text that comes from different blocks, like two messages
+        if self.current is not None and key != self.current:
+            text = "\n\n" + text
+        self.current = key
+        self.on_text(text)
+
+    def add_text(self, delta: str):
+        self.emit("text", delta)
+
+    def start_tool_call(self, key: Any, name: str):
+        self.tool_names[key] = name
+        self.tool_arguments.setdefault(key, "")
+
+    def add_tool_arguments(self, key: Any, partial_json: str):
+        self.tool_arguments[key] = self.tool_arguments.get(key, "") + partial_json
+
+        argument = self.display_arguments.get(self.tool_names.get(key, ""))
+        if not argument or not self.on_text:
+            return
+        try:
+            parsed = jiter.from_json(
+                self.tool_arguments[key].encode("utf-8"),
+                partial_mode="trailing-strings",
+            )
+        except ValueError:
+            return
+        value = parsed.get(argument) if isinstance(parsed, dict) else None
+        if not isinstance(value, str):
+            return
+        emitted = self.emitted.get(key, 0)
+        if len(value) > emitted:
+            self.emitted[key] = len(value)
+            self.emit(key, value[emitted:])
+
+
+def replay_response(
+    content: Optional[str],
+    tool_calls: Optional[List[ToolCall]],
+    tools: List[Tool],
+    callbacks: StreamCallbacks,
+):
+    """
+    Streams an already complete response through callbacks, through the same
+    display path as the real backends' streams.
+    """
+    text_stream = ResponseTextStream(tools, callbacks)
+    if content:
+        text_stream.add_text(content)
+    for index, tool_call in enumerate(tool_calls or []):
+        text_stream.start_tool_call(index, tool_call.name)
+        text_stream.add_tool_arguments(index, json.dumps(tool_call.arguments))
+        if callbacks.on_tool_call:
+            callbacks.on_tool_call(tool_call)
@@ -0,0 +1,257 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from openai import OpenAI
+
+from utils.http import get_http_client
+
+# Keys looked up per query, below SQLite's limit on parameters
+CACHE_QUERY_SIZE = 500
+
+
+def get_content_hash(identity: str, text: str) -> str:
+    return hashlib.sha256(f"{identity}\0{text}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings kept in SQLite, keyed by a hash of the embedder and the text,
+    so text that hasn't changed is never embedded twice.
+    """
+
+    path: str
+    connection: sqlite3.Connection
+    hits: int
+    misses: int
+    lock: threading.Lock
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), CACHE_QUERY_SIZE):
+                chunk = keys[start : start + CACHE_QUERY_SIZE]
+                rows = self.connection.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes())
+                    for key, vector in items
+                ],
+            )
+            self.connection.commit()
+
+
+embedding_cache: Optional[EmbeddingCache] = None
+embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Returns the cache shared by every embedder, configured by EMBEDDING_CACHE
+    and EMBEDDING_CACHE_PATH. None when off.
+    """
+    global embedding_cache
+    if os.environ.get("EMBEDDING_CACHE", "true").lower() != "true":
+        return None
+    with embedding_cache_lock:
+        if not embedding_cache:
+            embedding_cache = EmbeddingCache(
+                os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+            )
+        return embedding_cache
+
+
+class Embedder:
+    """
+    Turns texts into vectors, batch_size texts per call to embed_batch. With
+    cacheable set, vectors are kept in the embedding cache, so only texts it
+    hasn't seen are embedded.
+    """
+
+    name: str
+    model: str
+    dimensions: int
+    batch_size: int
+    cacheable: bool
+    embed_batch: Callable[[List[str]], np.ndarray]
+    on_startup: Optional[Callable[[], None]]
+    cache: Optional[EmbeddingCache]
+
+    def __init__(
+        self,
+        name: str,
+        embed_batch: Callable[[List[str]], np.ndarray],
+        model: str = "",
+        dimensions: int = 512,
+        batch_size: int = 256,
+        cacheable: bool = True,
+        on_startup: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.name = name
+        self.embed_batch = embed_batch
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.cacheable = cacheable
+        self.on_startup = on_startup
+        self.cache = None
+
+    @property
+    def identity(self) -> str:
+        # Vectors from embedders with different identities can't be compared
+        return f"{self.name}:{self.model}:{self.dimensions}"
+
+    def startup(self):
+        if self.on_startup:
+            self.on_startup()
+        self.cache = get_embedding_cache() if self.cacheable else None
+
+    def embed(self, texts: List[str], cache: bool = True) -> np.ndarray:
+        """
+        Embeds texts, through the cache unless it's off. Queries are best
+        kept out of it, as they're rarely repeated and would only fill it up.
+        """
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        keys = [get_content_hash(self.identity, text) for text in texts]
+        embedding_cache = self.cache if cache else None
+        cached = embedding_cache.get_many(list(set(keys))) if embedding_cache else {}
+
+        # Each text not in the cache is embedded once, however often it appears
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch = missing_keys[start : start + self.batch_size]
+            embedded = self.embed_batch([missing[key] for key in batch])
+            cached.update(zip(batch, embedded))
+            if embedding_cache:
+                embedding_cache.put_many(zip(batch, embedded))
+
+        for i, key in enumerate(keys):
+            vectors[i] = cached[key]
+        return vectors
+
+
+openai_embedding_client: Optional[OpenAI] = None
+
+
+def init_openai_embedder():
+    global openai_embedding_client
+
+    openai_embedding_client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"), http_client=get_http_client()
+    )
+    OpenAIEmbedder.model = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+    OpenAIEmbedder.dimensions = int(os.environ.get("EMBEDDING_DIMENSIONS", 512))
+    OpenAIEmbedder.batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", 256))
+
+
+def embed_openai_batch(texts: List[str]) -> np.ndarray:
+    if not openai_embedding_client:
+        raise ValueError("OpenAI embedding client not initialized")
+    response = openai_embedding_client.embeddings.create(
+        model=OpenAIEmbedder.model,
+        input=texts,
+        dimensions=OpenAIEmbedder.dimensions,
+    )
+    return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+OpenAIEmbedder = Embedder(
+    name="openai",
+    embed_batch=embed_openai_batch,
+    model="text-embedding-3-small",
+    on_startup=init_openai_embedder,
+)
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=65536)
+def get_token_bucket(token: str, dimensions: int) -> Tuple[int, float]:
+    # A stable hash, unlike hash(), so vectors are the same in every process
+    value = int.from_bytes(
+        hashlib.blake2b(token.encode(), digest_size=8).digest(), "little"
+    )
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+
+def embed_hashing_batch(texts: List[str]) -> np.ndarray:
+    """
+    Hashes each word and pair of words into one of the dimensions, with a
+    sign, so texts sharing words get similar vectors. No model or network is
+    needed, which makes it useful for tests and benchmarks.
+    """
+    dimensions = HashingEmbedder.dimensions
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for i, text in enumerate(texts):
+        words = TOKEN_PATTERN.findall(text.lower())
+        pairs = [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for token in words + pairs:
+            bucket, sign = get_token_bucket(token, dimensions)
+            vectors[i, bucket] += sign
+    return vectors
+
+
+def init_hashing_embedder():
+    HashingEmbedder.dimensions = int(os.environ.get("EMBEDDING_DIMENSIONS", 512))
+
+
+HashingEmbedder = Embedder(
+    name="hashing",
+    embed_batch=embed_hashing_batch,
+    batch_size=1024,
+    # Quicker to compute than to look up
+    cacheable=False,
+    on_startup=init_hashing_embedder,
+)
+
+EMBEDDER_CHOICE_MAP = {
+    "openai": OpenAIEmbedder,
+    "hashing": HashingEmbedder,
+}
+
+
+def get_embedder(choice: Optional[str] = None) -> Embedder:
+    choice = (choice or os.environ.get("EMBEDDING_CHOICE", "openai")).lower()
+    if choice not in EMBEDDER_CHOICE_MAP:
+        raise ValueError(
+            f"Unknown embedder {choice}, expected one of {', '.join(EMBEDDER_CHOICE_MAP)}"
+        )
+    return EMBEDDER_CHOICE_MAP[choice]
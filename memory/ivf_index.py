@@ -0,0 +1,254 @@
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Rows kept in memory at once when assigning vectors to lists
+ASSIGN_CHUNK_SIZE = 8192
+# With no nprobe set, this share of the lists is searched, but never under 8
+AUTO_NPROBE_FRACTION = 0.1
+MIN_AUTO_NPROBE = 8
+
+
+def get_nearest_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    nearest = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start : start + ASSIGN_CHUNK_SIZE]
+        nearest[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return nearest
+
+
+def train_centroids(
+    vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+    """
+    Spherical k-means over a sample of normalised vectors, so each centroid is
+    the normalised mean of the vectors closest to it by cosine similarity.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * 256)
+    sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        nearest = get_nearest_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, nearest, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # A centroid nothing was closest to is moved onto a random vector
+        empty = norms[:, 0] == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms[empty] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class InvertedList:
+    """
+    The vectors closest to one centroid, with the id of each. A removed entry
+    keeps its place with an id of -1 until the list is compacted.
+    """
+
+    vectors: np.ndarray
+    ids: np.ndarray
+    count: int
+    removed: int
+
+    def __init__(self, dimensions: int, capacity: int = 16) -> None:
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.count = 0
+        self.removed = 0
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        count = self.count + len(ids)
+        if count > len(self.ids):
+            capacity = max(count, len(self.ids) * 2)
+            self.resize(capacity)
+        self.vectors[self.count : count] = vectors
+        self.ids[self.count : count] = ids
+        self.count = count
+
+    def remove(self, id: int) -> bool:
+        positions = np.flatnonzero(self.ids[: self.count] == id)
+        if not len(positions):
+            return False
+        self.ids[positions] = -1
+        self.removed += len(positions)
+        if self.removed > self.count // 2:
+            self.compact()
+        return True
+
+    def compact(self):
+        kept = self.ids[: self.count] >= 0
+        vectors = self.vectors[: self.count][kept]
+        ids = self.ids[: self.count][kept]
+        # New arrays, as searches may still be reading the old ones
+        self.vectors = np.zeros((max(16, len(ids)), self.vectors.shape[1]), np.float32)
+        self.ids = np.full(len(self.vectors), -1, dtype=np.int64)
+        self.vectors[: len(ids)] = vectors
+        self.ids[: len(ids)] = ids
+        self.count = len(ids)
+        self.removed = 0
+
+    def resize(self, capacity: int):
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        ids = np.full(capacity, -1, dtype=np.int64)
+        vectors[: self.count] = self.vectors[: self.count]
+        ids[: self.count] = self.ids[: self.count]
+        self.vectors = vectors
+        self.ids = ids
+
+
+class IVFIndex:
+    """
+    An approximate nearest neighbour index for normalised vectors. Vectors are
+    grouped into nlist lists by their closest centroid, and a query only scores
+    the vectors in its nprobe closest lists. More probes find more of the true
+    nearest neighbours, at the cost of scoring more vectors. With no nprobe
+    set, it grows with the number of lists, so recall holds as the index does.
+    """
+
+    dimensions: int
+    nlist: int
+    nprobe: int
+    centroids: Optional[np.ndarray]
+    lists: List[InvertedList]
+    count: int
+    lock: threading.Lock
+
+    def __init__(self, dimensions: int, nlist: int = 0, nprobe: int = 0) -> None:
+        self.dimensions = dimensions
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.lists = []
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def get_nprobe(self) -> int:
+        if self.nprobe:
+            return self.nprobe
+        return max(MIN_AUTO_NPROBE, int(len(self.lists) * AUTO_NPROBE_FRACTION))
+
+    def build(self, ids: np.ndarray, vectors: np.ndarray):
+        """
+        Trains the centroids on the given vectors, then adds them all. With no
+        nlist set, it grows with the square root of the number of vectors.
+        """
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        centroids = train_centroids(vectors, min(nlist, len(vectors)))
+        with self.lock:
+            self.centroids = centroids
+            self.lists = [InvertedList(self.dimensions) for _ in centroids]
+            self.count = 0
+        self.add(ids, vectors)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        if self.centroids is None:
+            raise ValueError("The IVF index has to be built before adding vectors")
+        ids = np.asarray(ids, dtype=np.int64)
+        nearest = get_nearest_lists(vectors, self.centroids)
+        order = np.argsort(nearest, kind="stable")
+        lists, starts = np.unique(nearest[order], return_index=True)
+        with self.lock:
+            for list_index, rows in zip(lists, np.split(order, starts[1:])):
+                self.lists[list_index].add(ids[rows], vectors[rows])
+            self.count += len(ids)
+
+    def remove(self, id: int, vector: np.ndarray):
+        """
+        Removes an id, given the vector it was added with to find its list.
+        """
+        if self.centroids is None:
+            return
+        list_index = int(np.argmax(self.centroids @ vector))
+        with self.lock:
+            if self.lists[list_index].remove(id):
+                self.count -= 1
+
+    def search(
+        self, queries: np.ndarray, limit: int, threshold: float
+    ) -> List[List[Tuple[int, float]]]:
+        if self.centroids is None:
+            raise ValueError("The IVF index has to be built before searching")
+        with self.lock:
+            # Arrays are replaced rather than resized, so these stay valid
+            lists = [(lst.vectors, lst.ids, lst.count) for lst in self.lists]
+        nprobe = min(self.get_nprobe(), len(lists))
+        coarse = queries @ self.centroids.T
+        if nprobe < len(lists):
+            probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(len(lists)), coarse.shape)
+
+        results = []
+        for query, query_probes in zip(queries, probes):
+            scores = np.concatenate(
+                [lists[p][0][: lists[p][2]] @ query for p in query_probes]
+            )
+            ids = np.concatenate([lists[p][1][: lists[p][2]] for p in query_probes])
+            scores[ids < 0] = -np.inf
+            top = min(limit, len(scores))
+            if top < len(scores):
+                candidates = np.argpartition(-scores, top - 1)[:top]
+            else:
+                candidates = np.arange(len(scores))
+            candidates = candidates[np.argsort(-scores[candidates])]
+            results.append(
+                [
+                    (int(ids[c]), float(scores[c]))
+                    for c in candidates
+                    if scores[c] >= threshold and ids[c] >= 0
+                ]
+            )
+        return results
+
+    def save(self, path: str, stamp: str = ""):
+        """
+        Writes the centroids and lists to one .npz file. The stamp is kept with
+        them, for the caller to check the index still matches its records.
+        """
+        if self.centroids is None:
+            raise ValueError("The IVF index has to be built before saving")
+        with self.lock:
+            lists = [
+                (lst.vectors[: lst.count], lst.ids[: lst.count]) for lst in self.lists
+            ]
+        ids = np.concatenate([ids for _, ids in lists])
+        kept = ids >= 0
+        list_sizes = np.array([int((list_ids >= 0).sum()) for _, list_ids in lists])
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                vectors=np.concatenate([vectors for vectors, _ in lists])[kept],
+                ids=ids[kept],
+                offsets=np.concatenate([[0], np.cumsum(list_sizes)]),
+                nprobe=self.nprobe,
+                stamp=stamp,
+            )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str, nprobe: Optional[int] = None) -> Tuple["IVFIndex", str]:
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            index = cls(
+                centroids.shape[1],
+                nlist=len(centroids),
+                nprobe=nprobe or int(data["nprobe"]),
+            )
+            index.centroids = centroids
+            vectors, ids, offsets = data["vectors"], data["ids"], data["offsets"]
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                inverted_list = InvertedList(index.dimensions, max(16, end - start))
+                inverted_list.add(ids[start:end], vectors[start:end])
+                index.lists.append(inverted_list)
+            index.count = len(ids)
+            return index, str(data["stamp"])
@@ -0,0 +1,532 @@
+import os
+import threading
+import time
+from typing import Dict, List, Literal, Optional, Tuple, Union, cast
+
+import frontmatter
+import numpy as np
+from rich.console import Console
+
+from memory.embedder import Embedder, get_embedder
+from memory.ivf_index import IVFIndex
+from memory.vector_file import VectorFile, delete_vector_file
+from memory.vector_store import Record, VectorStore
+
+console = Console()
+
+numpy_directory = ""
+numpy_limit = 3
+numpy_threshold = 0.4
+embedder: Optional[Embedder] = None
+numpy_ann = "exact"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    # An all-zero vector stays zero rather than becoming NaN
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Rows scored at once when they have to be converted to float32 first
+SCORE_CHUNK_SIZE = 16384
+
+
+class VectorArray:
+    """
+    Rows and records kept in memory only. The matrix doubles when it fills
+    up, so adding a record doesn't copy all the others.
+    """
+
+    dimensions: int
+    dtype: str
+    scale: float
+    vectors: np.ndarray
+    removed: np.ndarray
+    removed_rows: List[int]
+    count: int
+    removed_count: int
+    records: List[Record]
+
+    def __init__(self, dimensions: int, capacity: int = 1024) -> None:
+        self.dimensions = dimensions
+        self.dtype = "float32"
+        self.scale = 1.0
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.removed = np.zeros(capacity, dtype=bool)
+        self.removed_rows = []
+        self.count = 0
+        self.removed_count = 0
+        self.records = []
+
+    def get_vectors(self) -> np.ndarray:
+        return self.vectors[: self.count]
+
+    def get_removed(self) -> np.ndarray:
+        return self.removed[: self.count]
+
+    def get_removed_rows(self) -> np.ndarray:
+        return np.array(self.removed_rows, dtype=np.int64)
+
+    def append(self, records: List[Record], vectors: np.ndarray):
+        count = self.count + len(records)
+        if count > len(self.vectors):
+            capacity = max(count, len(self.vectors) * 2)
+            grown = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            grown[: self.count] = self.vectors[: self.count]
+            removed = np.zeros(capacity, dtype=bool)
+            removed[: self.count] = self.removed[: self.count]
+            # Searches already running keep the old arrays, which stay valid
+            self.vectors = grown
+            self.removed = removed
+        self.vectors[self.count : count] = vectors
+        self.records.extend(records)
+        self.count = count
+
+    def remove(self, row: int):
+        self.removed[row] = True
+        self.removed_rows.append(row)
+        self.removed_count += 1
+
+    def get_record(self, row: int) -> Record:
+        return self.records[row]
+
+    def get_titles(self) -> Dict[str, int]:
+        return {
+            record.title: row
+            for row, record in enumerate(self.records)
+            if not self.removed[row]
+        }
+
+
+class NumpyIndex:
+    """
+    Embeddings as the rows of one contiguous matrix, normalised so a dot
+    product is the cosine similarity. The rows are held by a VectorArray, or
+    a VectorFile to keep them on disk. Rows are only ever appended, a
+    replaced or removed record's row is marked as removed.
+
+    With an ANN index, searches go through it once there are at least
+    ann_min_records records, and it is rebuilt when it has grown fourfold.
+    """
+
+    dimensions: int
+    storage: Union[VectorArray, VectorFile]
+    titles: Optional[Dict[str, int]]
+    ann: Optional[IVFIndex]
+    ann_min_records: int
+    ann_built_count: int
+    lock: threading.Lock
+
+    def __init__(
+        self,
+        dimensions: int,
+        capacity: int = 1024,
+        ann: Optional[IVFIndex] = None,
+        ann_min_records: int = 10_000,
+        storage: Optional[Union[VectorArray, VectorFile]] = None,
+    ) -> None:
+        self.dimensions = dimensions
+        self.storage = storage or VectorArray(dimensions, capacity)
+        self.titles = None
+        self.ann = ann
+        self.ann_min_records = ann_min_records
+        self.ann_built_count = ann.count if ann else 0
+        self.lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return self.storage.count
+
+    def get_titles(self) -> Dict[str, int]:
+        # Called with the lock held. Only needed once records change.
+        if self.titles is None:
+            self.titles = self.storage.get_titles()
+        return self.titles
+
+    def list_titles(self) -> List[str]:
+        with self.lock:
+            return list(self.get_titles())
+
+    def get_vectors(self, rows: np.ndarray) -> np.ndarray:
+        vectors = self.storage.get_vectors()[rows]
+        return vectors.astype(np.float32) * np.float32(self.storage.scale)
+
+    def add(self, records: List[Record], embeddings: np.ndarray):
+        """
+        Adds records with their embeddings, replacing any with the same title.
+        """
+        embeddings = normalize(embeddings)
+        # Only the last of several records with one title is kept
+        latest = {record.title: i for i, record in enumerate(records)}
+        if len(latest) < len(records):
+            kept = sorted(latest.values())
+            records = [records[i] for i in kept]
+            embeddings = embeddings[kept]
+        with self.lock:
+            titles = self.get_titles()
+            for record in records:
+                self.remove_row(titles.get(record.title))
+            start = self.storage.count
+            self.storage.append(records, embeddings)
+            for row, record in enumerate(records, start):
+                record.id = row
+                titles[record.title] = row
+            if self.ann and self.ann.trained:
+                # The rows as stored, so remove_row finds the same list for them
+                rows = np.arange(start, self.storage.count)
+                self.ann.add(rows, self.get_vectors(rows))
+            self.update_ann()
+
+    def has_record(self, record: Record) -> bool:
+        with self.lock:
+            row = self.get_titles().get(record.title)
+            if row is None:
+                return False
+            stored = self.storage.get_record(row)
+        return (stored.content, stored.type, stored.importance) == (
+            record.content,
+            record.type,
+            record.importance,
+        )
+
+    def remove(self, title: str) -> bool:
+        with self.lock:
+            row = self.get_titles().pop(title, None)
+            self.remove_row(row)
+            return row is not None
+
+    def remove_row(self, row: Optional[int]):
+        # Called with the lock held
+        if row is None or self.storage.removed[row]:
+            return
+        if self.ann:
+            self.ann.remove(row, self.get_vectors(np.array(row)))
+        self.storage.remove(row)
+
+    def attach_ann(self, ann: IVFIndex, covered: int = 0, removed_covered: int = 0):
+        """
+        Searches through an ANN index from now on. A trained one is expected
+        to already hold the first covered rows, as they were after the first
+        removed_covered removals. Anything since is applied to it.
+        """
+        with self.lock:
+            self.ann = ann
+            if ann.trained:
+                for row in self.storage.get_removed_rows()[removed_covered:]:
+                    if row < covered:
+                        ann.remove(int(row), self.get_vectors(row))
+                removed = self.storage.get_removed()[covered:]
+                rows = np.flatnonzero(~removed) + covered
+                if len(rows):
+                    ann.add(rows, self.get_vectors(rows))
+                self.ann_built_count = ann.count
+            self.update_ann()
+
+    def update_ann(self):
+        # Called with the lock held
+        live = self.storage.count - self.storage.removed_count
+        if not self.ann or live < self.ann_min_records:
+            return
+        if self.ann.trained and self.ann.count < 4 * self.ann_built_count:
+            return
+        rows = np.flatnonzero(~self.storage.get_removed())
+        self.ann.build(rows, self.get_vectors(rows))
+        self.ann_built_count = len(rows)
+
+    def score(self, queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        if vectors.dtype == np.float32:
+            return queries @ vectors.T
+        scores = np.empty((len(queries), len(vectors)), dtype=np.float32)
+        for start in range(0, len(vectors), SCORE_CHUNK_SIZE):
+            chunk = vectors[start : start + SCORE_CHUNK_SIZE].astype(np.float32)
+            scores[:, start : start + len(chunk)] = queries @ chunk.T
+        scores *= np.float32(self.storage.scale)
+        return scores
+
+    def search(
+        self, queries: np.ndarray, limit: int, threshold: float
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Scores every query against every record at once, returning each
+        query's best rows and similarities, best first.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if self.ann and self.ann.trained:
+            # Removed rows are only dropped afterwards, so ask for enough extra
+            # to fill the limit without scanning much past it
+            fetch = min(limit + self.storage.removed_count, limit * 4)
+            results = self.ann.search(queries, fetch, threshold)
+            removed = self.storage.removed
+            return [
+                [(row, score) for row, score in rows if not removed[row]][:limit]
+                for rows in results
+            ]
+        with self.lock:
+            vectors = self.storage.get_vectors()
+            removed = self.storage.get_removed() if self.storage.removed_count else None
+        if not len(vectors) or not limit:
+            return [[] for _ in queries]
+
+        scores = self.score(queries, vectors)
+        if removed is not None:
+            scores[:, removed] = -np.inf
+        limit = min(limit, len(vectors))
+        if limit < len(vectors):
+            # Only the top rows need sorting, not all of them
+            candidates = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        else:
+            candidates = np.broadcast_to(np.arange(len(vectors)), scores.shape)
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        return [
+            [
+                (int(row), float(score))
+                for row, score in zip(rows, row_scores)
+                if score >= threshold
+            ]
+            for rows, row_scores in zip(candidates, candidate_scores)
+        ]
+
+    def get_records(self, results: List[Tuple[int, float]]) -> List[Record]:
+        records = []
+        for row, score in results:
+            record = self.storage.get_record(row)
+            records.append(
+                Record(
+                    id=row,
+                    title=record.title,
+                    content=record.content,
+                    type=record.type,
+                    similarity=score,
+                    importance=record.importance,
+                )
+            )
+        return records
+
+
+numpy_index: Optional[NumpyIndex] = None
+numpy_file: Optional[VectorFile] = None
+
+
+def embed_texts(texts: List[str], cache: bool = True) -> np.ndarray:
+    if not embedder:
+        raise ValueError("Embedder not initialized")
+    return embedder.embed(texts, cache)
+
+
+def get_record_text(record: Record) -> str:
+    return f"# {record.title}\n{record.content}"
+
+
+def read_record(file_path: str) -> Record:
+    with open(file_path, "r") as file:
+        fm = frontmatter.load(file)
+    title = os.path.basename(file_path)[: -len(".md")]
+    content = fm.content
+    heading = f"# {title}\n"
+    if content.startswith(heading):
+        content = content[len(heading) :]
+    return Record(
+        id=None,
+        title=title,
+        content=content,
+        type=str(fm.get("type", "")),
+        similarity=None,
+        importance=cast(
+            Literal["low", "medium", "high", "extreme"],
+            str(fm.get("importance", "low")),
+        ),
+    )
+
+
+def query_numpy_vector_store(query: str) -> List[Record]:
+    if not numpy_index:
+        raise ValueError("Numpy vector store not initialized")
+    results = numpy_index.search(
+        embed_texts([query], cache=False), numpy_limit, numpy_threshold
+    )
+    return numpy_index.get_records(results[0])
+
+
+def add_numpy_vector_store_record(record: Record) -> None:
+    if not numpy_index or not numpy_file:
+        raise ValueError("Numpy vector store not initialized")
+    try:
+        # Checked first, so a reader doesn't leave a file the writer would sync
+        numpy_file.check_writable()
+        # The same files as the Simple Vector Store, so either can read them
+        with open(os.path.join(numpy_directory, f"{record.title}.md"), "w") as f:
+            f.write(
+                f"---\nimportance: {record.importance}\ntype: record\n---\n# {record.title}\n{record.content}"
+            )
+        # The watermark is left for the next sync, as moving it here would
+        # skip files edited elsewhere since the last one. The embedding cache
+        # saves embedding this file twice.
+        numpy_index.add([record], embed_texts([get_record_text(record)]))
+    except Exception as e:
+        raise ValueError("Error adding record", e)
+
+
+def remove_numpy_vector_store_record(title: str) -> None:
+    if not numpy_index:
+        raise ValueError("Numpy vector store not initialized")
+    try:
+        if numpy_index.remove(title):
+            os.remove(os.path.join(numpy_directory, f"{title}.md"))
+    except Exception as e:
+        raise ValueError("Error removing record", e)
+
+
+def get_index_directory() -> str:
+    return os.path.join(numpy_directory, ".index")
+
+
+def sync_numpy_vector_store():
+    """
+    Embeds the markdown files changed since the last sync, and removes the
+    records whose file is gone. When nothing changed, only the file times
+    are read.
+    """
+    if not numpy_index or not numpy_file:
+        raise ValueError("Numpy vector store not initialized")
+    started = time.time()
+    synced_at = numpy_file.meta["synced_at"]
+    entries = [
+        entry
+        for entry in os.scandir(numpy_directory)
+        if entry.name.endswith(".md") and entry.is_file()
+    ]
+    changed = [entry.path for entry in entries if entry.stat().st_mtime >= synced_at]
+    # Files written by add_record since the last sync are already in the index
+    records = [read_record(path) for path in sorted(changed)]
+    records = [record for record in records if not numpy_index.has_record(record)]
+    if records:
+        with console.status("[bold blue]Embedding memories...", spinner="dots12"):
+            numpy_index.add(
+                records, embed_texts([get_record_text(record) for record in records])
+            )
+    if len(entries) != numpy_index.count - numpy_file.removed_count:
+        titles = {entry.name[: -len(".md")] for entry in entries}
+        for title in numpy_index.list_titles():
+            if title not in titles:
+                numpy_index.remove(title)
+    numpy_file.set_synced(started)
+
+
+def get_ann_path() -> str:
+    return os.path.join(get_index_directory(), "ivf.npz")
+
+
+def get_ann_stamp() -> str:
+    # Rows are only appended, so this says which ones the index already holds
+    if not numpy_file:
+        raise ValueError("Numpy vector store not initialized")
+    return f"{numpy_file.meta['id']}:{numpy_file.count}:{numpy_file.removed_count}"
+
+
+def load_ann() -> None:
+    if not numpy_index or not numpy_file:
+        raise ValueError("Numpy vector store not initialized")
+    nprobe = int(os.environ.get("IVF_NPROBE", 0))
+    path = get_ann_path()
+    if os.path.exists(path):
+        try:
+            ann, stamp = IVFIndex.load(path, nprobe=nprobe)
+            file_id, covered, removed_covered = stamp.split(":")
+            if (
+                file_id == numpy_file.meta["id"]
+                and ann.dimensions == numpy_file.dimensions
+                and int(covered) <= numpy_file.count
+            ):
+                numpy_index.attach_ann(ann, int(covered), int(removed_covered))
+                if stamp != get_ann_stamp() and not numpy_file.read_only:
+                    ann.save(path, get_ann_stamp())
+                return
+        except Exception as e:
+            console.print(f"[yellow]Rebuilding the memory index:[/yellow] {e}")
+
+    ann = IVFIndex(
+        numpy_file.dimensions,
+        nlist=int(os.environ.get("IVF_NLIST", 0)),
+        nprobe=nprobe,
+    )
+    with console.status("[bold blue]Building memory index...", spinner="dots12"):
+        numpy_index.attach_ann(ann)
+    if ann.trained and not numpy_file.read_only:
+        ann.save(path, get_ann_stamp())
+
+
+def open_vector_file(embedder: Embedder) -> VectorFile:
+    dtype = os.environ.get("NUMPY_VECTOR_STORE_DTYPE", "float32")
+    try:
+        return VectorFile(
+            get_index_directory(), embedder.dimensions, dtype, embedder.identity
+        )
+    except BlockingIOError:
+        console.print(
+            "[yellow]The memory store is open in another process, so it can only be read here[/yellow]"
+        )
+        return VectorFile(
+            get_index_directory(),
+            embedder.dimensions,
+            dtype,
+            embedder.identity,
+            read_only=True,
+        )
+    except ValueError as e:
+        # Written with another model or layout, so every record is embedded again
+        console.print(f"[yellow]Rebuilding the memory store:[/yellow] {e}")
+        delete_vector_file(get_index_directory())
+        return VectorFile(
+            get_index_directory(), embedder.dimensions, dtype, embedder.identity
+        )
+
+
+def on_numpy_init():
+    global numpy_directory
+    global numpy_limit
+    global numpy_threshold
+    global embedder
+    global numpy_index
+    global numpy_file
+    global numpy_ann
+
+    numpy_directory = os.environ.get("NUMPY_VECTOR_STORE_DIRECTORY", "")
+    if not numpy_directory:
+        raise ValueError("NUMPY_VECTOR_STORE_DIRECTORY not set")
+    os.makedirs(numpy_directory, exist_ok=True)
+    numpy_limit = int(os.environ.get("NUMPY_VECTOR_STORE_LIMIT", 3))
+    numpy_threshold = float(os.environ.get("NUMPY_VECTOR_STORE_THRESHOLD", 0.4))
+    numpy_ann = os.environ.get("NUMPY_VECTOR_STORE_INDEX", "exact").lower()
+    if numpy_ann not in ["exact", "ivf"]:
+        raise ValueError(f"Unknown vector index {numpy_ann}, expected exact or ivf")
+    embedder = get_embedder()
+    embedder.startup()
+
+    if numpy_file:
+        numpy_file.close()
+    numpy_file = open_vector_file(embedder)
+    numpy_index = NumpyIndex(
+        embedder.dimensions,
+        ann_min_records=int(os.environ.get("IVF_MIN_RECORDS", 10_000)),
+        storage=numpy_file,
+    )
+    sync = os.environ.get("NUMPY_VECTOR_STORE_SYNC", "true").lower() == "true"
+    if sync and not numpy_file.read_only:
+        sync_numpy_vector_store()
+    if numpy_ann == "ivf":
+        load_ann()
+
+
+NumpyVectorStore = VectorStore(
+    name="numpy",
+    query_store=query_numpy_vector_store,
+    add_record=add_numpy_vector_store_record,
+    on_startup=on_numpy_init,
+    remove_record=remove_numpy_vector_store_record,
+)
@@ -1,7 +1,9 @@
 import os
-from typing import List, Literal, cast
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, cast
 from memory.vector_store import VectorStore, Record
-import requests
+from utils.http import get_session
 from rich.console import Console
 import frontmatter
 
@@ -12,8 +14,95 @@ svs_directory = ""
 svs_name = ""
 
 
+@dataclass
+class FrontmatterEntry:
+    importance: Literal["low", "medium", "high", "extreme"]
+    type: str
+    content: str
+    mtime: float
+    size: int
+
+
+def read_frontmatter_entry(file_path: str) -> FrontmatterEntry:
+    stat = os.stat(file_path)
+    with open(file_path, "r") as file:
+        fm = frontmatter.load(file)
+    return FrontmatterEntry(
+        importance=cast(
+            Literal["low", "medium", "high", "extreme"],
+            str(fm.get("importance", "low")),
+        ),
+        type=str(fm.get("type", "")),
+        content=fm.content,
+        mtime=stat.st_mtime,
+        size=stat.st_size,
+    )
+
+
+class FrontmatterIndex:
+    """
+    The frontmatter of every memory file by title, so queries don't read
+    files. A file is only read again when its size or modification time has
+    changed.
+    """
+
+    directory: str
+    entries: Dict[str, FrontmatterEntry]
+    lock: threading.Lock
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get_path(self, title: str) -> str:
+        return os.path.join(self.directory, f"{title}.md")
+
+    def refresh(self):
+        entries = {}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".md") or not entry.is_file():
+                continue
+            title = entry.name[: -len(".md")]
+            stat = entry.stat()
+            current = self.entries.get(title)
+            if (
+                current
+                and current.mtime == stat.st_mtime
+                and current.size == stat.st_size
+            ):
+                entries[title] = current
+            else:
+                entries[title] = read_frontmatter_entry(entry.path)
+        with self.lock:
+            self.entries = entries
+
+    def update(self, title: str):
+        entry = read_frontmatter_entry(self.get_path(title))
+        with self.lock:
+            self.entries[title] = entry
+
+    def get(self, title: str) -> Optional[FrontmatterEntry]:
+        # A stat is much cheaper than parsing, and catches files edited or
+        # written since the last refresh
+        try:
+            stat = os.stat(self.get_path(title))
+        except FileNotFoundError:
+            with self.lock:
+                self.entries.pop(title, None)
+            return None
+        entry = self.entries.get(title)
+        if entry and entry.mtime == stat.st_mtime and entry.size == stat.st_size:
+            return entry
+        self.update(title)
+        return self.entries.get(title)
+
+
+frontmatter_index: Optional[FrontmatterIndex] = None
+
+
 def query_simple_vector_store(query: str) -> List[Record]:
-    response = requests.post(
+    response = get_session().post(
         f"{svs_url}/stores/{svs_name}/search",
         json={"query": query, "limit": 3, "threshold": 0.4},
     )
@@ -25,24 +114,17 @@ def query_simple_vector_store(query: str) -> List[Record]:
     data = response.json()
     results = data["data"]
     for result in results:
-        file_path = f"{svs_directory}/{result['title']}.md"
-        with open(file_path, "r") as file:
-            fm = frontmatter.load(file)
-            importance_value = fm.get("importance", "low")
-            importance: Literal["low", "medium", "high", "extreme"] = cast(
-                Literal["low", "medium", "high", "extreme"], str(importance_value)
-            )
-            record_type = fm.get("type", "")
-            print("record type: ", record_type)
-            record = Record(
+        entry = frontmatter_index.get(result["title"]) if frontmatter_index else None
+        records.append(
+            Record(
                 id=result["id"],
                 title=result["title"],
                 content=result["content"],
                 similarity=result["distance"],
-                importance=importance,
-                type=str(record_type),
+                importance=entry.importance if entry else "low",
+                type=entry.type if entry else "",
             )
-            records.append(record)
+        )
 
     return records
 
@@ -55,6 +137,8 @@ def add_simple_vector_store_record(record: Record) -> None:
                 f"---\nimportance: {record.importance}\ntype: record\n---\n# {record.title}\n{record.content}"
             )
         sync_svs_store(svs_name)
+        if frontmatter_index:
+            frontmatter_index.update(record.title)
     except Exception as e:
         raise ValueError("Error adding record", e)
 
@@ -62,7 +146,7 @@ def add_simple_vector_store_record(record: Record) -> None:
 def test_svs_store_exists(name: str):
     try:
         with console.status("[bold blue]Checking store...", spinner="dots12"):
-            response = requests.get(f"{svs_url}/stores/{name}")
+            response = get_session().get(f"{svs_url}/stores/{name}")
         if not response.ok:
             return False
         if (
@@ -79,7 +163,7 @@ def test_svs_store_exists(name: str):
 def create_svs_store(name: str):
     try:
         with console.status("[bold blue]Creating store...", spinner="dots12"):
-            response = requests.post(
+            response = get_session().post(
                 f"{svs_url}/stores", json={"name": name, "path": svs_directory}
             )
         if not response.ok:
@@ -92,7 +176,8 @@ def create_svs_store(name: str):
 def sync_svs_store(name: str):
     try:
         with console.status("[bold blue]Syncing store...", spinner="dots12"):
-            response = requests.post(f"{svs_url}/stores/{name}/sync")
+            # Can take as long as the store's documents need
+            response = get_session().post(f"{svs_url}/stores/{name}/sync", timeout=None)
         if not response.ok:
             raise ValueError("Error syncing store")
 
@@ -103,7 +188,10 @@ def sync_svs_store(name: str):
 def build_svs_store(name: str):
     try:
         with console.status("[bold blue]Building store...", spinner="dots12"):
-            response = requests.post(f"{svs_url}/stores/{name}/build")
+            # Can take as long as the store's documents need
+            response = get_session().post(
+                f"{svs_url}/stores/{name}/build", timeout=None
+            )
         if not response.ok:
             raise ValueError("Error building store")
 
@@ -116,6 +204,7 @@ def on_svs_init():
         global svs_url
         global svs_directory
         global svs_name
+        global frontmatter_index
 
         svs_url = os.environ.get("SIMPLE_VECTOR_STORE_URL", "")
         if not svs_url:
@@ -134,6 +223,10 @@ def on_svs_init():
             build_svs_store(svs_name)
         else:
             sync_svs_store(svs_name)
+
+        with console.status("[bold blue]Reading memories...", spinner="dots12"):
+            frontmatter_index = FrontmatterIndex(svs_directory)
+            frontmatter_index.refresh()
     except Exception as e:
         raise ValueError("Error initializing simple vector store", e)
 
@@ -0,0 +1,305 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Literal, Optional, cast
+
+import numpy as np
+
+from memory.vector_store import Record
+
+VECTOR_FILE_VERSION = 1
+VECTOR_DTYPES = ["float32", "int8"]
+# int8 rows hold each normalised component times this
+INT8_SCALE = 127.0
+
+
+def empty_rows(dimensions: int, dtype: str) -> np.ndarray:
+    return np.zeros((0, dimensions), dtype=dtype)
+
+
+class VectorFile:
+    """
+    Vectors and records on disk, laid out so opening them is a memory map
+    rather than a rebuild, and several processes can share the same pages.
+
+    - vectors.bin: one row per record, float32 or int8
+    - records.jsonl: one JSON line per record
+    - offsets.bin: where each record's line starts, as uint64, plus the end
+    - removed.bin: the rows removed, as int64
+
+    Every file is only appended to. A record is committed once its offset is
+    written, so anything past the last offset is left over from a crash and
+    dropped when a writer opens it. A writer holds a lock on the directory
+    for as long as it's open, so a second one fails with BlockingIOError and
+    can open it read-only instead. A reader sees the records committed when it
+    opened, and never changes the files.
+    """
+
+    directory: str
+    dimensions: int
+    dtype: str
+    meta: Dict[str, Any]
+    fsync: bool
+    count: int
+    records_size: int
+    vectors: np.ndarray
+    offsets: np.ndarray
+    removed: np.ndarray
+    removed_count: int
+    file_descriptor: int
+    read_only: bool
+    lock_descriptor: Optional[int]
+
+    def __init__(
+        self,
+        directory: str,
+        dimensions: int,
+        dtype: str = "float32",
+        model: str = "",
+        fsync: Optional[bool] = None,
+        read_only: bool = False,
+    ) -> None:
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(
+                f"Unknown vector type {dtype}, expected one of {', '.join(VECTOR_DTYPES)}"
+            )
+        self.directory = directory
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.fsync = (
+            fsync
+            if fsync is not None
+            else os.environ.get("NUMPY_VECTOR_STORE_FSYNC", "false").lower() == "true"
+        )
+        self.read_only = read_only
+        self.lock_descriptor = None
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+            self.lock_descriptor = lock_directory(directory)
+        try:
+            meta = read_meta(directory)
+            if meta is None and read_only:
+                raise ValueError(f"There is no vector file in {directory}")
+            if meta is None:
+                self.create(model)
+            elif (
+                meta.get("version") != VECTOR_FILE_VERSION
+                or meta.get("dimensions") != dimensions
+                or meta.get("dtype") != dtype
+                or meta.get("model") != model
+            ):
+                raise ValueError(
+                    f"The vector file in {directory} was written with other settings"
+                )
+            else:
+                self.meta = meta
+            self.recover()
+        except BaseException:
+            self.unlock()
+            raise
+        self.file_descriptor = os.open(self.get_path("records.jsonl"), os.O_RDONLY)
+        self.map()
+        removed_rows = self.get_removed_rows()
+        self.removed = np.zeros(max(self.count, 1024), dtype=bool)
+        self.removed[removed_rows[removed_rows < self.count]] = True
+        self.removed_count = int(self.removed.sum())
+
+    @property
+    def scale(self) -> float:
+        return 1.0 / INT8_SCALE if self.dtype == "int8" else 1.0
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def create(self, model: str):
+        self.meta = {
+            "version": VECTOR_FILE_VERSION,
+            "id": uuid.uuid4().hex,
+            "dimensions": self.dimensions,
+            "dtype": self.dtype,
+            "model": model,
+            "synced_at": 0.0,
+        }
+        for name in ["vectors.bin", "records.jsonl", "removed.bin"]:
+            open(self.get_path(name), "wb").close()
+        with open(self.get_path("offsets.bin"), "wb") as f:
+            f.write(np.zeros(1, dtype=np.uint64).tobytes())
+        self.write_meta()
+
+    def check_writable(self):
+        if self.read_only:
+            raise ValueError(f"The vector file in {self.directory} is open read-only")
+
+    def write_meta(self):
+        self.check_writable()
+        temporary_path = self.get_path("meta.json.tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(temporary_path, self.get_path("meta.json"))
+
+    def set_synced(self, synced_at: Optional[float] = None):
+        self.meta["synced_at"] = synced_at or time.time()
+        self.write_meta()
+
+    def recover(self):
+        """
+        Finds the committed records, and as the writer, drops anything past
+        them. A reader leaves it, as it may be a record still being written.
+        """
+        row_size = self.dimensions * np.dtype(self.dtype).itemsize
+        vectors_count = os.path.getsize(self.get_path("vectors.bin")) // row_size
+        offsets_count = os.path.getsize(self.get_path("offsets.bin")) // 8 - 1
+        self.count = max(0, min(vectors_count, offsets_count))
+        with open(self.get_path("offsets.bin"), "rb") as f:
+            f.seek(self.count * 8)
+            self.records_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        if self.read_only:
+            return
+        with open(self.get_path("offsets.bin"), "r+b") as f:
+            f.truncate((self.count + 1) * 8)
+        with open(self.get_path("vectors.bin"), "r+b") as f:
+            f.truncate(self.count * row_size)
+        with open(self.get_path("records.jsonl"), "r+b") as f:
+            f.truncate(self.records_size)
+        with open(self.get_path("removed.bin"), "r+b") as f:
+            f.truncate(os.path.getsize(self.get_path("removed.bin")) // 8 * 8)
+
+    def map(self):
+        if self.count:
+            self.vectors = np.memmap(
+                self.get_path("vectors.bin"),
+                dtype=self.dtype,
+                mode="r",
+                shape=(self.count, self.dimensions),
+            )
+        else:
+            self.vectors = empty_rows(self.dimensions, self.dtype)
+        self.offsets = np.memmap(
+            self.get_path("offsets.bin"), dtype=np.uint64, mode="r"
+        )
+
+    def write(self, name: str, data: bytes):
+        self.check_writable()
+        with open(self.get_path(name), "ab") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def get_vectors(self) -> np.ndarray:
+        return self.vectors
+
+    def get_removed(self) -> np.ndarray:
+        return self.removed[: self.count]
+
+    def get_removed_rows(self) -> np.ndarray:
+        with open(self.get_path("removed.bin"), "rb") as f:
+            data = f.read()
+        # A reader can find a row half written
+        return np.frombuffer(data[: len(data) // 8 * 8], dtype=np.int64)
+
+    def append(self, records: List[Record], vectors: np.ndarray):
+        """
+        Appends records with their normalised vectors.
+        """
+        if vectors.shape != (len(records), self.dimensions):
+            raise ValueError(
+                f"Expected {len(records)} vectors of {self.dimensions} dimensions"
+            )
+        if self.dtype == "int8":
+            vectors = np.round(vectors * INT8_SCALE)
+        lines = [
+            json.dumps(
+                {
+                    "title": record.title,
+                    "content": record.content,
+                    "type": record.type,
+                    "importance": record.importance,
+                }
+            ).encode()
+            + b"\n"
+            for record in records
+        ]
+        ends = self.records_size + np.cumsum([len(line) for line in lines])
+        self.write("records.jsonl", b"".join(lines))
+        self.write("vectors.bin", np.asarray(vectors, dtype=self.dtype).tobytes())
+        # Written last, this is what commits the records
+        self.write("offsets.bin", ends.astype(np.uint64).tobytes())
+        self.records_size = int(ends[-1])
+        self.count += len(records)
+        if self.count > len(self.removed):
+            removed = np.zeros(max(self.count, len(self.removed) * 2), dtype=bool)
+            removed[: len(self.removed)] = self.removed
+            self.removed = removed
+        self.map()
+
+    def remove(self, row: int):
+        self.write("removed.bin", np.array([row], dtype=np.int64).tobytes())
+        self.removed[row] = True
+        self.removed_count += 1
+
+    def read_line(self, row: int) -> Dict[str, Any]:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(os.pread(self.file_descriptor, end - start, start))
+
+    def get_record(self, row: int) -> Record:
+        data = self.read_line(row)
+        return Record(
+            id=row,
+            title=data["title"],
+            content=data["content"],
+            type=data["type"],
+            similarity=None,
+            importance=cast(
+                Literal["low", "medium", "high", "extreme"], data["importance"]
+            ),
+        )
+
+    def get_titles(self) -> Dict[str, int]:
+        # Reads every record, so it is only done once something changes
+        titles = {}
+        with open(self.get_path("records.jsonl"), "rb") as f:
+            for row in range(self.count):
+                title = json.loads(f.readline())["title"]
+                if not self.removed[row]:
+                    titles[title] = row
+        return titles
+
+    def unlock(self):
+        if self.lock_descriptor is not None:
+            os.close(self.lock_descriptor)
+            self.lock_descriptor = None
+
+    def close(self):
+        os.close(self.file_descriptor)
+        self.unlock()
+
+
+def lock_directory(directory: str) -> int:
+    """
+    Takes the writer's lock on a vector file, raising BlockingIOError if
+    another process has it. The lock goes when the descriptor is closed.
+    """
+    descriptor = os.open(os.path.join(directory, "lock"), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BaseException:
+        os.close(descriptor)
+        raise
+    return descriptor
+
+
+def read_meta(directory: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def delete_vector_file(directory: str):
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
@@ -17,6 +17,7 @@ class VectorStore:
     query_store: Callable[[str], List[Record]]
     add_record: Callable[[Record], None]
     on_startup: Callable[[], None]
+    remove_record: Optional[Callable[[str], None]]
 
     def __init__(
         self,
@@ -24,12 +25,14 @@ class VectorStore:
         query_store: Callable[[str], List[Record]],
         add_record: Callable[[Record], None],
         on_startup: Optional[Callable[[], None]] = None,
+        remove_record: Optional[Callable[[str], None]] = None,
     ) -> None:
         self.name = name
         self.query_store = query_store
         self.add_record = add_record
         if on_startup:
             self.on_startup = on_startup
+        self.remove_record = remove_record
 
     def startup(self):
         if self.on_startup:
@@ -40,3 +43,8 @@ class VectorStore:
 
     def add(self, record: Record) -> None:
         self.add_record(record)
+
+    def remove(self, title: str) -> None:
+        if not self.remove_record:
+            raise ValueError(f"The {self.name} vector store can't remove records")
+        self.remove_record(title)
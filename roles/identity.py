@@ -10,14 +10,20 @@ console = Console()
 
 
 class IdentityManager:
-    current_role: Optional[Role] = None
-    available_roles: Dict[str, Role] = {}
+    current_role: Optional[Role]
+    available_roles: Dict[str, Role]
     pubsub: PubSub
     toolbox: Toolbox
+    silence_actions: bool
 
-    def __init__(self, pubsub: PubSub, toolbox: Toolbox) -> None:
+    def __init__(
+        self, pubsub: PubSub, toolbox: Toolbox, silence_actions: bool = False
+    ) -> None:
         self.pubsub = pubsub
         self.toolbox = toolbox
+        self.silence_actions = silence_actions
+        self.current_role = None
+        self.available_roles = {}
 
         self.register_roles(ROLES_INCLUDED)
         self.set_role(DEFAULT_ROLE.name)
@@ -49,13 +55,15 @@ class IdentityManager:
         return description
 
     def set_role(self, role_name: str) -> None:
-        console.rule(f"As a {role_name}", style="blue")
+        if not self.silence_actions:
+            console.rule(f"As a {role_name}", style="blue")
         if self.current_role is not None:
             self.toolbox.unregister_tools(self.current_role.get_tools_listed())
         gotten_role = self.available_roles.get(role_name)
         if gotten_role:
             self.current_role = gotten_role
             self.toolbox.register_tools(self.current_role.get_tools_listed())
+            self.pubsub.publish("role_changed", role_name)
         else:
             raise Exception(f"Role {role_name} not found.")
 
@@ -93,4 +101,7 @@ class IdentityManager:
         # Available Roles
         {self.get_roles_described()}
         """
+        # Agents sharing an LLM would otherwise each append the same roles
+        if prompt in llm.system_prompt:
+            return
         llm.append_to_system_prompt(prompt)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import os
 import signal
 import threading
@@ -12,12 +13,19 @@ from rich.console import Console
 from rich.markdown import Markdown
 
 from agent.agent import Agent
+from agent.batch import BatchRunner
+from agent.server import SessionServer
+from agent.journal import SessionJournal
+from agent.sessions import SessionManager
 from llms.openai import OpenAILLM
 from llms.anthropic import AnthropicLLM
+from llms.scripted import ScriptedLLMFromEnv
+from memory.numpy_vector_store import NumpyVectorStore
 from memory.simple_vector_store import SVSVectorStore
 from memory.vector_store import VectorStore
 from tools.index import Toolbox
 from utils.pubsub import PubSub
+from utils.tracing import tracer
 
 load_dotenv()
 
@@ -29,8 +37,12 @@ llm_choice = os.environ.get(
 vector_store_choice = os.environ.get("VECTOR_STORE_CHOICE", "none")
 verbose = False
 silence_actions = False
+stream = True
+trace = False
 log_directory = os.environ.get("LOG_DIRECTORY", "simple-agent-logs")
 os.makedirs(log_directory, exist_ok=True)  # Ensure the log directory exists
+sessions_directory = os.path.join(log_directory, "sessions")
+journal: Optional[SessionJournal] = None
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -49,11 +61,13 @@ if not SYSTEM_PROMPT:
 LLM_CHOICE_MAP = {
     "openai": OpenAILLM,
     "anthropic": AnthropicLLM,
+    "scripted": ScriptedLLMFromEnv,
 }
 LLM = LLM_CHOICE_MAP.get(llm_choice, OpenAILLM)
 
 VECTOR_STORE_CHOICE_MAP: dict[str, Optional[VectorStore]] = {
     "simple_vector_store": SVSVectorStore,
+    "numpy": NumpyVectorStore,
     "none": None,
 }
 VECTOR_STORE: Optional[VectorStore] = VECTOR_STORE_CHOICE_MAP.get(
@@ -79,6 +93,53 @@ def clear_threads():
         f.write("")
 
 
+def get_latest_session() -> Optional[str]:
+    if not os.path.isdir(sessions_directory):
+        return None
+    sessions = [
+        os.path.join(sessions_directory, name)
+        for name in os.listdir(sessions_directory)
+    ]
+    if not sessions:
+        return None
+    return os.path.basename(max(sessions, key=os.path.getmtime))
+
+
+def run_batch(input_path: str, output_path: Optional[str], concurrency: Optional[int]):
+    output_path = output_path or f"{os.path.splitext(input_path)[0]}.results.jsonl"
+    manager = SessionManager(llm=LLM, vector_store=VECTOR_STORE, verbose=verbose)
+    runner = BatchRunner(manager=manager, concurrency=concurrency)
+    console.print(
+        f"Running {input_path} with {runner.concurrency} sessions at a time, writing to {output_path}"
+    )
+    started = time.perf_counter()
+    results = asyncio.run(runner.run(input_path, output_path))
+    manager.close_all()
+
+    statuses: dict[str, int] = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    summary = ", ".join(f"{count} {status}" for status, count in statuses.items())
+    console.print(
+        f"Ran {len(results)} jobs in {time.perf_counter() - started:.1f}s ({summary or 'nothing to do'})"
+    )
+
+
+def run_server(host: str, port: int):
+    manager = SessionManager(
+        llm=LLM, vector_store=VECTOR_STORE, verbose=verbose, stream=stream
+    )
+    server = SessionServer(manager=manager)
+    console.print(f"Serving agent sessions on http://{host}:{port}")
+    try:
+        server.serve(host, port)
+    except KeyboardInterrupt:
+        console.print("\nShutting down server...")
+    finally:
+        server.shutdown()
+        manager.close_all()
+
+
 def handle_errors():
     PUBSUB.subscribe("error", lambda error: console.print(f"[red]Error:[/red] {error}"))
     PUBSUB.subscribe(
@@ -120,16 +181,47 @@ def prompt_user():
     PUBSUB.publish("new_user_message", user_input)
 
 
-def on_new_agent_message(message: str):
-    console.print("[blue bold]Simmy:[/blue bold]")
-    console.print(Markdown(message))
+streamed_text = ""
+
+
+def on_new_agent_message_delta(delta: str):
+    global streamed_text
+    if not streamed_text.strip():
+        console.print("[blue bold]Simmy:[/blue bold]")
+        delta = delta.lstrip()
+    streamed_text += delta
+    console.print(delta, end="", markup=False, highlight=False)
+
+
+def consume_streamed_text(message: str) -> bool:
+    """
+    Returns whether the message was already shown while it streamed in.
+    """
+    global streamed_text
+    pending = streamed_text.lstrip()
+    streamed_text = ""
+    if not message or not pending.startswith(message):
+        if pending:
+            console.print()
+        return False
+    console.print()
+    streamed_text = pending[len(message) :]
+    return True
+
+
+def show_agent_message(message: str):
+    if not consume_streamed_text(message):
+        console.print("[blue bold]Simmy:[/blue bold]")
+        console.print(Markdown(message))
     write_to_file(os.path.join(log_directory, "last_thread.md"), f"Agent: {message}")
 
 
+def on_new_agent_message(message: str):
+    show_agent_message(message)
+
+
 def on_new_agent_message_with_prompt(message: str):
-    console.print("[blue bold]Simmy:[/blue bold]")
-    console.print(Markdown(message))
-    write_to_file(os.path.join(log_directory, "last_thread.md"), f"Agent: {message}")
+    show_agent_message(message)
     prompt_user()
 
 
@@ -139,9 +231,22 @@ def on_new_agent_perception(perception: str):
     )
 
 
+def write_traces():
+    if not trace:
+        return
+    tracer.export_jsonl(os.path.join(log_directory, "trace.jsonl"))
+    tracer.export_chrome(os.path.join(log_directory, "trace.json"))
+    console.print(
+        f"Traces written to {log_directory}/trace.json (open in chrome://tracing or Perfetto)"
+    )
+
+
 def handle_exit(m: str):
     console.print("Shutting down agent...")
     agent.stop()
+    if journal:
+        journal.close()
+    write_traces()
     console.print("Agent stopped. Exiting now.")
     exit(0)
 
@@ -152,6 +257,7 @@ def signal_handler(sig, frame):
 
 
 PUBSUB.subscribe("new_agent_message", on_new_agent_message)
+PUBSUB.subscribe("new_agent_message_delta", on_new_agent_message_delta)
 PUBSUB.subscribe("new_agent_prompt", on_new_agent_message_with_prompt)
 PUBSUB.subscribe("new_agent_perception", on_new_agent_perception)
 PUBSUB.subscribe("exit_signal", handle_exit)
@@ -176,15 +282,87 @@ if __name__ == "__main__":
         help="Silence actions like function calls and task messages.",
     )
     parser.add_argument("--clear-logs", action="store_true", help="Clear the logs.")
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for complete responses instead of showing them as they arrive.",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Trace each iteration and write the traces to the log directory on exit.",
+    )
+    parser.add_argument(
+        "--session",
+        type=str,
+        help="A name for this session, used to resume it later. Defaults to the start time.",
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        help='Resume a previous session by name, or "latest" for the most recent one.',
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        help="Run each prompt in a JSONL file headlessly instead of chatting.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Where --batch writes its results. Defaults to <input>.results.jsonl.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="How many --batch prompts run at once. Defaults to BATCH_CONCURRENCY.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Serve agent sessions over HTTP instead of chatting.",
+    )
+    parser.add_argument(
+        "--host", type=str, default=os.environ.get("SERVER_HOST", "127.0.0.1")
+    )
+    parser.add_argument(
+        "--port", type=int, default=int(os.environ.get("SERVER_PORT", 8765))
+    )
     args = parser.parse_args()
 
     llm_choice = args.llm
     verbose = args.verbose
     silence_actions = args.silence_actions
+    stream = not args.no_stream
+    trace = args.trace
+    if trace:
+        tracer.enable()
+
+    if args.batch:
+        run_batch(args.batch, args.output, args.concurrency)
+        write_traces()
+        exit(0)
+
+    if args.serve:
+        run_server(args.host, args.port)
+        write_traces()
+        exit(0)
+
+    session_id = args.resume or args.session or time.strftime("%Y%m%d-%H%M%S")
+    if session_id == "latest":
+        session_id = get_latest_session()
+    if args.resume and (
+        not session_id
+        or not os.path.isdir(os.path.join(sessions_directory, session_id))
+    ):
+        console.print(f"[red]Error:[/red] No session named {args.resume} to resume.")
+        exit(1)
 
-    clear_logs()
+    # A resumed session keeps the logs and thread it left behind
+    if not args.resume:
+        clear_logs()
 
-    clear_threads()
+        clear_threads()
 
     console.print("[blue bold]Simmy:[/blue bold] Hello and welcome! My name is Simmy!")
 
@@ -203,7 +381,20 @@ if __name__ == "__main__":
         vector_store=VECTOR_STORE,
         verbose=verbose,
         silence_actions=silence_actions,
+        stream=stream,
     )
+
+    journal = SessionJournal(os.path.join(sessions_directory, session_id))
+    if args.resume:
+        state = journal.load()
+        journal.restore(agent, state)
+        console.print(
+            f"Resumed session {session_id} with {len(state.messages)} messages and {len(state.tasks)} tasks.",
+            style="bright_black",
+        )
+    else:
+        console.print(f"Session: {session_id}", style="bright_black")
+    journal.attach(agent)
     agent.start()
 
     # Set up the signal handler for graceful shutdown
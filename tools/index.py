@@ -1,7 +1,15 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
 
 from utils.pubsub import PubSub
+from utils.tracing import tracer
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -12,6 +20,18 @@ class Tool:
         [Any, PubSub], (str)
     ]  # Callable that takes any arguments and returns any type
     parameters: Dict[str, Any]  # Dictionary with string keys and values of any type
+    concurrent: bool = False  # Whether calls may run alongside other tool calls
+    read_only: bool = False  # Whether calls change nothing, so can start early
+    lock_key: Optional[Callable[[Any], Optional[str]]] = (
+        None  # Calls that share a lock key never run at the same time
+    )
+    max_concurrency: Optional[int] = None  # Limit on simultaneous calls to this tool
+    async_function: Optional[Callable[[Any, PubSub], Awaitable[str]]] = (
+        None  # Used instead of function when running on an event loop
+    )
+    display_argument: Optional[str] = (
+        None  # Argument shown to the user while the model is still writing it
+    )
 
 
 @dataclass
@@ -21,15 +41,133 @@ class ToolCall:
     arguments: Dict[str, Any]
 
 
+class ToolList(List[Tool]):
+    """
+    The tools a Toolbox had at one version. What's built from them, like each
+    provider's schemas, is kept alongside until the tools change.
+    """
+
+    version: int
+    compiled: Dict[str, Any]
+
+    def __init__(self, tools: List[Tool], version: int) -> None:
+        super().__init__(tools)
+        self.version = version
+        self.compiled = {}
+
+
+def get_compiled(tools: List[Tool], key: str, compile: Callable[[List[Tool]], T]) -> T:
+    """
+    Builds something from a list of tools once per Toolbox version. The result
+    is shared, so it mustn't be changed. Plain lists are built every time.
+    """
+    if not isinstance(tools, ToolList):
+        return compile(tools)
+    if key not in tools.compiled:
+        tools.compiled[key] = compile(tools)
+    return tools.compiled[key]
+
+
+def file_lock_key(args: Any) -> Optional[str]:
+    if not args or not args.get("file_path"):
+        return None
+    return f"file:{os.path.abspath(args['file_path'])}"
+
+
+class ToolLimits:
+    """
+    The per-key locks and per-tool semaphores tool calls run under. Toolboxes
+    given the same limits enforce them together, so sessions in one process
+    don't write the same file at once. The async ones only hold between
+    toolboxes on the same event loop, and don't exclude threaded calls.
+    """
+
+    locks: Dict[str, threading.Lock]
+    semaphores: Dict[str, threading.BoundedSemaphore]
+    async_locks: Dict[str, asyncio.Lock]
+    async_semaphores: Dict[str, asyncio.Semaphore]
+    guard: threading.Lock
+
+    def __init__(self) -> None:
+        self.locks = {}
+        self.semaphores = {}
+        self.async_locks = {}
+        self.async_semaphores = {}
+        self.guard = threading.Lock()
+
+    def get_lock(self, key: str) -> threading.Lock:
+        with self.guard:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def get_semaphore(self, tool: Tool) -> Optional[threading.BoundedSemaphore]:
+        if not tool.max_concurrency:
+            return None
+        with self.guard:
+            if tool.name not in self.semaphores:
+                self.semaphores[tool.name] = threading.BoundedSemaphore(
+                    tool.max_concurrency
+                )
+            return self.semaphores[tool.name]
+
+    def get_async_lock(self, key: str) -> asyncio.Lock:
+        if key not in self.async_locks:
+            self.async_locks[key] = asyncio.Lock()
+        return self.async_locks[key]
+
+    def get_async_semaphore(self, tool: Tool) -> Optional[asyncio.Semaphore]:
+        if not tool.max_concurrency:
+            return None
+        if tool.name not in self.async_semaphores:
+            self.async_semaphores[tool.name] = asyncio.Semaphore(tool.max_concurrency)
+        return self.async_semaphores[tool.name]
+
+
 class Toolbox:
     pubsub: Optional[PubSub] = None
-    tools: Dict[str, Tool] = {}
+    tools: Dict[str, Tool]
+    max_workers: int
+    executor: ThreadPoolExecutor
+    limits: ToolLimits
+    queued: Dict[str, Future[str]]
+    async_queued: Dict[str, asyncio.Task[str]]
+    guard: threading.Lock
+    version: int
+    listed: Optional[ToolList]
 
-    def __init__(self, pubsub: PubSub) -> None:
+    def __init__(
+        self,
+        pubsub: PubSub,
+        max_workers: Optional[int] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+        limits: Optional[ToolLimits] = None,
+    ) -> None:
         self.pubsub = pubsub
+        self.tools = {}
+        self.max_workers = max_workers or int(os.environ.get("MAX_TOOL_CONCURRENCY", 4))
+        # Sessions hosted together can share one pool instead of one each
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="toolbox"
+        )
+        # Like the pool, limits can be shared so they hold across sessions
+        self.limits = limits or ToolLimits()
+        self.queued = {}
+        self.async_queued = {}
+        self.guard = threading.Lock()
+        self.version = 0
+        self.listed = None
 
     def get_tools_listed(self) -> List[Tool]:
-        return list(self.tools.values())
+        listed = self.listed
+        if listed is None:
+            listed = ToolList(list(self.tools.values()), self.version)
+            self.listed = listed
+        return listed
+
+    def on_tools_changed(self):
+        self.version += 1
+        self.listed = None
 
     def get_tool(self, tool_name: str) -> Optional[Tool]:
         return self.tools.get(tool_name)
@@ -48,13 +186,204 @@ class Toolbox:
         if not tool:
             self.pubsub.publish("toolbox_error", f"Tool '{tool_name}' not found.")
             return "Tool not found."
-        message = tool.function(arguments, self.pubsub)
+        with tracer.span(f"tool:{tool_name}") as span:
+            span.set_size("argument_bytes", arguments)
+            message = tool.function(arguments, self.pubsub)
+            span.set_size("result_bytes", message)
         self.tool_log(tool_name, message, arguments)
         return message
 
+    def run_tool_guarded(self, tool_call: ToolCall) -> str:
+        tool = self.get_tool(tool_call.name)
+        semaphore = self.limits.get_semaphore(tool) if tool else None
+        key = self.get_lock_key(tool_call)
+        lock = self.limits.get_lock(key) if key else None
+
+        if semaphore:
+            semaphore.acquire()
+        if lock:
+            lock.acquire()
+        try:
+            return self.run_tool(
+                tool_name=tool_call.name, arguments=tool_call.arguments
+            )
+        finally:
+            if lock:
+                lock.release()
+            if semaphore:
+                semaphore.release()
+
+    def get_lock_key(self, tool_call: ToolCall) -> Optional[str]:
+        tool = self.get_tool(tool_call.name)
+        return tool.lock_key(tool_call.arguments) if tool and tool.lock_key else None
+
+    def start_tool_call(self, tool_call: ToolCall) -> Optional[Future[str]]:
+        """
+        Starts a concurrent tool call on the pool. Returns None for tools which
+        have to run in order on the calling thread. Calls sharing a lock key
+        start one after another, in the order they were started.
+        """
+        tool = self.get_tool(tool_call.name)
+        if self.max_workers <= 1 or not tool or not tool.concurrent:
+            return None
+        future: Future[str] = Future()
+        # Carry the caller's context over so trace spans nest under the iteration
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                future.set_result(context.run(self.run_tool_guarded, tool_call))
+            except BaseException as e:
+                future.set_exception(e)
+
+        key = self.get_lock_key(tool_call)
+        if not key:
+            self.executor.submit(run)
+            return future
+
+        with self.guard:
+            previous = self.queued.get(key)
+            self.queued[key] = future
+
+        def on_done(_: Future[str]):
+            with self.guard:
+                if self.queued.get(key) is future:
+                    del self.queued[key]
+
+        future.add_done_callback(on_done)
+        if previous:
+            # Submitted once the call before it is done, so no worker waits on it
+            previous.add_done_callback(lambda _: self.executor.submit(run))
+        else:
+            self.executor.submit(run)
+        return future
+
+    def run_tool_calls(
+        self,
+        tool_calls: List[ToolCall],
+        started: Optional[Dict[str, Future[str]]] = None,
+    ) -> List[str]:
+        """
+        Runs a batch of tool calls, returning their results in the order given.
+        Concurrent tools are handed to the pool, everything else runs on the
+        calling thread once the calls before it are done, and the calls after
+        it only start once it is. Calls already started with start_tool_call
+        can be passed in by id.
+        """
+        futures = dict(started or {})
+        results: Dict[str, str] = {}
+        for tool_call in tool_calls:
+            if tool_call.id not in futures:
+                future = self.start_tool_call(tool_call)
+                if future:
+                    futures[tool_call.id] = future
+                    continue
+                if futures:
+                    wait(list(futures.values()))
+                results[tool_call.id] = self.run_tool_guarded(tool_call)
+
+        return [
+            results[tool_call.id]
+            if tool_call.id in results
+            else futures[tool_call.id].result()
+            for tool_call in tool_calls
+        ]
+
+    async def run_tool_async(self, tool_name: str, arguments: Any) -> str:
+        if not self.pubsub:
+            raise Exception("No PubSub provided.")
+        tool = self.get_tool(tool_name)
+        if not tool:
+            self.pubsub.publish("toolbox_error", f"Tool '{tool_name}' not found.")
+            return "Tool not found."
+        with tracer.span(f"tool:{tool_name}") as span:
+            span.set_size("argument_bytes", arguments)
+            if tool.async_function:
+                message = await tool.async_function(arguments, self.pubsub)
+            else:
+                # Sync tools run on the toolbox pool so they never block the event loop
+                message = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, tool.function, arguments, self.pubsub
+                )
+            span.set_size("result_bytes", message)
+        self.tool_log(tool_name, message, arguments)
+        return message
+
+    async def run_tool_guarded_async(self, tool_call: ToolCall) -> str:
+        tool = self.get_tool(tool_call.name)
+        semaphore = self.limits.get_async_semaphore(tool) if tool else None
+        key = self.get_lock_key(tool_call)
+        lock = self.limits.get_async_lock(key) if key else None
+
+        if semaphore:
+            await semaphore.acquire()
+        if lock:
+            await lock.acquire()
+        try:
+            return await self.run_tool_async(
+                tool_name=tool_call.name, arguments=tool_call.arguments
+            )
+        finally:
+            if lock:
+                lock.release()
+            if semaphore:
+                semaphore.release()
+
+    def start_tool_call_async(self, tool_call: ToolCall) -> Optional[asyncio.Task[str]]:
+        tool = self.get_tool(tool_call.name)
+        if not tool or not tool.concurrent:
+            return None
+        key = self.get_lock_key(tool_call)
+        previous = self.async_queued.get(key) if key else None
+        task = asyncio.create_task(self.run_tool_after_async(previous, tool_call))
+        if key:
+            self.async_queued[key] = task
+
+            def on_done(_: asyncio.Task[str]):
+                if self.async_queued.get(key) is task:
+                    del self.async_queued[key]
+
+            task.add_done_callback(on_done)
+        return task
+
+    async def run_tool_after_async(
+        self, previous: Optional[asyncio.Task[str]], tool_call: ToolCall
+    ) -> str:
+        # Calls sharing a lock key run in the order they were started
+        if previous:
+            await asyncio.wait([previous])
+        return await self.run_tool_guarded_async(tool_call)
+
+    async def run_tool_calls_async(
+        self,
+        tool_calls: List[ToolCall],
+        started: Optional[Dict[str, asyncio.Task[str]]] = None,
+    ) -> List[str]:
+        tasks = dict(started or {})
+        results: Dict[str, str] = {}
+        for tool_call in tool_calls:
+            if tool_call.id not in tasks:
+                task = self.start_tool_call_async(tool_call)
+                if task:
+                    tasks[tool_call.id] = task
+                    continue
+                # A sequential call waits for the calls before it, and holds
+                # back those after it
+                if tasks:
+                    await asyncio.wait(list(tasks.values()))
+                results[tool_call.id] = await self.run_tool_guarded_async(tool_call)
+
+        return [
+            results[tool_call.id]
+            if tool_call.id in results
+            else await tasks[tool_call.id]
+            for tool_call in tool_calls
+        ]
+
     def register_tool(self, tool: Tool):
         try:
             self.tools[tool.name] = tool
+            self.on_tools_changed()
         except Exception as e:
             raise Exception(f"Error registering tool: {e}")
 
@@ -62,6 +391,7 @@ class Toolbox:
         if tool.name in self.tools:
             try:
                 del self.tools[tool.name]
+                self.on_tools_changed()
             except KeyError:
                 raise Exception(
                     f"Error unregistering tool: Tool '{tool.name}' not found."
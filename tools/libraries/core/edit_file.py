@@ -1,6 +1,6 @@
 from typing import Any
 
-from tools.index import Tool
+from tools.index import Tool, file_lock_key
 from utils.formatting import parse_range
 from utils.pubsub import PubSub
 
@@ -59,6 +59,8 @@ edit_file = Tool(
         },
         "required": ["file_path", "selection", "content"],
     },
+    concurrent=True,
+    lock_key=file_lock_key,
 )
 
 
@@ -1,6 +1,6 @@
 from typing import Any, Optional
 import fitz  # PyMuPDF
-from tools.index import Tool
+from tools.index import Tool, file_lock_key
 from utils.pubsub import PubSub
 
 
@@ -80,4 +80,7 @@ read_file = Tool(
         },
         "required": ["file_path"],
     },
+    concurrent=True,
+    read_only=True,
+    lock_key=file_lock_key,
 )
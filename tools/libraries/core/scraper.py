@@ -2,10 +2,10 @@ from tools.index import Tool
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service as ChromeService
 from webdriver_manager.chrome import ChromeDriverManager
+from utils.http import get_session
 from utils.pubsub import PubSub
 from typing import Any
 from bs4 import BeautifulSoup
-import requests
 
 
 def run(args: Any, ps: PubSub):
@@ -49,6 +49,8 @@ run_javascript = Tool(
         },
         "required": ["url", "script"],
     },
+    concurrent=True,
+    max_concurrency=2,
 )
 
 
@@ -65,7 +67,7 @@ def run_bs(args: Any, ps: PubSub):
     arguments = args["arguments"]
 
     try:
-        response = requests.get(url)
+        response = get_session().get(url)
         response.raise_for_status()
         soup = BeautifulSoup(response.content, "html.parser")
 
@@ -105,4 +107,6 @@ run_beautiful_soup = Tool(
         },
         "required": ["url", "method", "arguments"],
     },
+    concurrent=True,
+    read_only=True,
 )
@@ -40,4 +40,6 @@ search_duckduckgo = Tool(
         },
         "required": ["query"],
     },
+    concurrent=True,
+    read_only=True,
 )
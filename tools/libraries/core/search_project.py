@@ -129,4 +129,6 @@ search_project = Tool(
         },
         "required": ["query", "path"],
     },
+    concurrent=True,
+    read_only=True,
 )
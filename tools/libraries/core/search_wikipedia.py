@@ -25,38 +25,42 @@ async def fetch_page(query: str):
         return None
 
 
-def run_search_wikipedia(args: Any, pubsub: PubSub) -> str:
-    try:
-        if not args or "query" not in args:
-            return "Error running search_wikipedia: No query provided."
+def format_results(query: str, page) -> str:
+    if not page:
+        return "No articles found for the given query."
 
-        # Explicitly create and set a new event loop for this thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-        page = loop.run_until_complete(fetch_page(args.get("query")))
-        loop.close()  # Close the event loop when done to prevent resource leaks
-
-        if not page:
-            return "No articles found for the given query."
-
-        results = f"""Results for search query: {args.get("query")}
+    results = f"""Results for search query: {query}
         {page.title}
         ---
         {page.markdown}
         ---
         """
 
-        truncated_results = results[:5000]
-        return truncated_results
+    truncated_results = results[:5000]
+    return truncated_results
+
+
+async def run_search_wikipedia_async(args: Any, pubsub: PubSub) -> str:
+    try:
+        if not args or "query" not in args:
+            return "Error running search_wikipedia: No query provided."
+
+        page = await fetch_page(args.get("query"))
+        return format_results(args.get("query"), page)
     except Exception as e:
         return f"Error running search_wikipedia: {e}"
 
 
+def run_search_wikipedia(args: Any, pubsub: PubSub) -> str:
+    # Only used off the event loop, async agents call run_search_wikipedia_async
+    return asyncio.run(run_search_wikipedia_async(args, pubsub))
+
+
 search_wikipedia = Tool(
     name="search_wikipedia",
     description="Search Wikipedia for information on a given query.",
     function=run_search_wikipedia,
+    async_function=run_search_wikipedia_async,
     parameters={
         "type": "object",
         "properties": {
@@ -67,4 +71,6 @@ search_wikipedia = Tool(
         },
         "required": ["query"],
     },
+    concurrent=True,
+    read_only=True,
 )
@@ -24,6 +24,7 @@ send_message_to_user = Tool(
         },
         "required": ["content"],
     },
+    display_argument="content",
 )
 
 
@@ -48,4 +49,5 @@ prompt_user = Tool(
         },
         "required": ["content"],
     },
+    display_argument="content",
 )
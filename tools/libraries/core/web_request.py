@@ -1,5 +1,6 @@
 from tools.index import Tool
 from utils.pubsub import PubSub
+from utils.http import get_session
 import requests
 from typing import Any
 
@@ -15,7 +16,7 @@ def run(args: Any, ps: PubSub):
     data = args.get("data", None)
 
     try:
-        response = requests.request(
+        response = get_session().request(
             method, url, headers=headers, params=params, data=data
         )
         response.raise_for_status()
@@ -60,4 +61,5 @@ web_request = Tool(
         },
         "required": ["url"],
     },
+    concurrent=True,
 )
@@ -1,6 +1,6 @@
 from typing import Any
 
-from tools.index import Tool
+from tools.index import Tool, file_lock_key
 from utils.pubsub import PubSub
 
 
@@ -43,4 +43,6 @@ write_file = Tool(
         },
         "required": ["file_path", "content", "mode"],
     },
+    concurrent=True,
+    lock_key=file_lock_key,
 )
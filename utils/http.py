@@ -0,0 +1,242 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import h2  # noqa: F401
+
+    h2_installed = True
+except ImportError:
+    h2_installed = False
+
+# Only retried after the server answered, for methods safe to send twice
+RETRY_STATUS_CODES = [502, 503, 504]
+
+
+def get_timeout() -> float:
+    return float(os.environ.get("HTTP_TIMEOUT", 60))
+
+
+def get_connect_timeout() -> float:
+    return float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10))
+
+
+def get_pool_size() -> int:
+    return int(os.environ.get("HTTP_POOL_SIZE", 32))
+
+
+def get_retries() -> int:
+    return int(os.environ.get("HTTP_RETRIES", 3))
+
+
+def use_http2() -> bool:
+    # HTTP/2 needs the optional h2 package, without it requests use HTTP/1.1
+    return h2_installed and os.environ.get("HTTP2", "true").lower() == "true"
+
+
+class PooledSession(requests.Session):
+    """
+    A requests Session with a default timeout, so no call can hang forever.
+    Only its connections are meant to be shared, so it never keeps a cookie,
+    and one session can't see or send what another site set for another.
+    """
+
+    timeout: Any
+
+    def __init__(self, timeout: Any) -> None:
+        super().__init__()
+        self.timeout = timeout
+        # No domain is allowed, so every cookie a response sets is dropped
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    def request(self, method, url, *args, **kwargs):  # type: ignore[override]
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, *args, **kwargs)
+
+
+class HTTPStats:
+    requests: int
+    errors: int
+    lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def on_request(self, *args: Any, **kwargs: Any):
+        with self.lock:
+            self.requests += 1
+
+    def on_response(self, status_code: int):
+        if status_code >= 400:
+            with self.lock:
+                self.errors += 1
+
+
+session: Optional[PooledSession] = None
+session_stats = HTTPStats()
+http_client: Optional[httpx.Client] = None
+async_http_client: Optional[httpx.AsyncClient] = None
+client_stats = HTTPStats()
+lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    The requests Session shared by tools and the vector store. Connections are
+    kept alive and reused, and idempotent requests are retried with backoff
+    when they fail to connect or get a 502, 503 or 504.
+    """
+    global session
+    with lock:
+        if not session:
+            session = PooledSession(timeout=(get_connect_timeout(), get_timeout()))
+            retry = Retry(
+                total=get_retries(),
+                backoff_factor=float(os.environ.get("HTTP_BACKOFF", 0.5)),
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=get_pool_size(),
+                pool_maxsize=get_pool_size(),
+                max_retries=retry,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.hooks["response"].append(
+                lambda response, *args, **kwargs: session_stats.on_response(
+                    response.status_code
+                )
+            )
+        return session
+
+
+def get_client_options() -> Dict[str, Any]:
+    return {
+        "timeout": httpx.Timeout(get_timeout(), connect=get_connect_timeout()),
+        "follow_redirects": True,
+    }
+
+
+def get_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=get_pool_size(),
+        max_keepalive_connections=get_pool_size(),
+        keepalive_expiry=float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30)),
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """
+    The httpx client shared by the LLM SDKs. Only connection failures are
+    retried here, as a request that reached the provider may not be safe to
+    send again. Rate limits are left to the scheduler.
+    """
+    global http_client
+    with lock:
+        if not http_client:
+            http_client = httpx.Client(
+                transport=httpx.HTTPTransport(
+                    limits=get_limits(), http2=use_http2(), retries=get_retries()
+                ),
+                event_hooks={
+                    "request": [client_stats.on_request],
+                    "response": [
+                        lambda response: client_stats.on_response(response.status_code)
+                    ],
+                },
+                **get_client_options(),
+            )
+        return http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    global async_http_client
+
+    async def on_request(request: httpx.Request):
+        client_stats.on_request()
+
+    async def on_response(response: httpx.Response):
+        client_stats.on_response(response.status_code)
+
+    with lock:
+        if not async_http_client:
+            async_http_client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(
+                    limits=get_limits(), http2=use_http2(), retries=get_retries()
+                ),
+                event_hooks={"request": [on_request], "response": [on_response]},
+                **get_client_options(),
+            )
+        return async_http_client
+
+
+def get_httpx_pool_stats(client: Any) -> Dict[str, Any]:
+    # httpx doesn't expose its pool, so this reads httpcore's where it can
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    http2 = 0
+    idle = 0
+    for connection in connections:
+        if connection.is_idle():
+            idle += 1
+        if "HTTP/2" in connection.info():
+            http2 += 1
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "http2": http2,
+    }
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Connection pool usage across every shared client, for monitoring.
+    """
+    stats: Dict[str, Any] = {"http2_available": use_http2()}
+
+    if session:
+        adapter = session.get_adapter("https://")
+        hosts = []
+        for key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(key)
+            if not pool:
+                continue
+            hosts.append(
+                {
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    # Slots in the queue are None until a connection is made
+                    "idle": sum(1 for c in list(pool.pool.queue) if c)
+                    if pool.pool
+                    else 0,
+                }
+            )
+        stats["requests"] = {
+            "errors": session_stats.errors,
+            "hosts": hosts,
+        }
+
+    clients = {}
+    if http_client:
+        clients["sync"] = get_httpx_pool_stats(http_client)
+    if async_http_client:
+        clients["async"] = get_httpx_pool_stats(async_http_client)
+    if clients:
+        stats["httpx"] = {
+            "requests": client_stats.requests,
+            "errors": client_stats.errors,
+            **clients,
+        }
+    return stats
@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 import threading
 from typing import Any, Callable, Dict, List
 
@@ -24,14 +26,31 @@ class PubSub:
                 if not self.subscribers[event_type]:
                     del self.subscribers[event_type]
 
-    def publish(self, event_type: str, data: Any) -> None:
-        """Publishes an event to all subscribers of that event type."""
-        subscribers_copy = []
+    def get_subscribers(self, event_type: str) -> List[Callable[[Any], Any]]:
         with self.lock:
-            if event_type in self.subscribers:
-                # Copy the subscriber list to avoid issues if subscribers are modified during iteration
-                subscribers_copy = self.subscribers[event_type][:]
+            # Copy the subscriber list to avoid issues if subscribers are modified during iteration
+            return self.subscribers.get(event_type, [])[:]
 
+    def publish(self, event_type: str, data: Any) -> None:
+        """Publishes an event to all subscribers of that event type."""
         # Invoke handlers outside the locked region to avoid potential deadlocks and to allow concurrent handling
-        for handler in subscribers_copy:
-            handler(data)
+        for handler in self.get_subscribers(event_type):
+            result = handler(data)
+            if inspect.isawaitable(result):
+                self.schedule(result)
+
+    async def publish_async(self, event_type: str, data: Any) -> None:
+        """Publishes an event, awaiting any async subscribers in order."""
+        for handler in self.get_subscribers(event_type):
+            result = handler(data)
+            if inspect.isawaitable(result):
+                await result
+
+    def schedule(self, awaitable: Any) -> None:
+        """Runs an async handler's result from synchronous code."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(awaitable)
+            return
+        loop.create_task(awaitable)
@@ -1,20 +1,174 @@
+import functools
+import hashlib
+import json
 import os
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 import tiktoken
 
 from llms.llm import Message
+from tools.index import Tool, get_compiled
 
+# Roughly what providers add around each message, and before the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Models tiktoken doesn't know, like Anthropic's, get a close approximation
+        pass
+    except Exception:
+        # Encodings are downloaded on first use, which can fail when offline
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_text_tokens(text: str, encoding: Optional[tiktoken.Encoding]) -> int:
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class TokenCache:
+    """
+    A bounded map of content hash to token count, shared by every session so
+    the same message is only ever encoded once per encoding.
+    """
+
+    entries: "OrderedDict[Tuple[str, str], int]"
+    max_entries: int
+    lock: threading.Lock
+
+    def __init__(self, max_entries: int = 100000) -> None:
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[int]:
+        with self.lock:
+            count = self.entries.get(key)
+            if count is not None:
+                self.entries.move_to_end(key)
+            return count
+
+    def set(self, key: Tuple[str, str], count: int) -> None:
+        with self.lock:
+            self.entries[key] = count
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+token_cache = TokenCache()
+
+
+def get_message_text(message: Message) -> str:
+    text = f"{message.role}\n{message.content or ''}"
+    if message.tool_call_id:
+        text += f"\n{message.tool_call_id}"
+    if message.tool_calls:
+        for tool_call in message.tool_calls:
+            text += f"\n{tool_call.id}\n{tool_call.name}\n"
+            text += json.dumps(tool_call.arguments)
+    return text
+
+
+def get_tool_text(tool: Tool) -> str:
+    return f"{tool.name}\n{tool.description}\n{json.dumps(tool.parameters)}"
 
-def get_current_num_tokens(messages: List[Message], model: str):
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = 0
 
-    for message in messages:
-        if message.content:
-            num_tokens += 4
-            num_tokens += len(encoding.encode(message.content))
+def count_cached(text: str, model: str) -> int:
+    encoding = get_encoding(model)
+    key = (
+        encoding.name if encoding else "estimate",
+        hashlib.sha1(text.encode("utf-8")).hexdigest(),
+    )
+    count = token_cache.get(key)
+    if count is None:
+        count = count_text_tokens(text, encoding)
+        token_cache.set(key, count)
+    return count
 
-    return num_tokens
+
+def count_message_tokens(message: Message, model: str) -> int:
+    return MESSAGE_OVERHEAD + count_cached(get_message_text(message), model)
+
+
+def count_tool_tokens(tools: List[Tool], model: str) -> int:
+    return get_compiled(
+        tools,
+        f"tokens:{model}",
+        lambda tools: sum(count_cached(get_tool_text(tool), model) for tool in tools),
+    )
+
+
+class TokenCounter:
+    """
+    Counts the tokens in a growing message history. Each call only counts the
+    messages appended since the last one, so it can run on every iteration.
+    """
+
+    model: str
+    source: Optional[List[Message]]
+    last_message: Optional[Message]
+    counts: List[int]
+    total: int
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        self.source = None
+        self.last_message = None
+        self.counts = []
+        self.total = 0
+
+    def is_continuation(self, messages: List[Message]) -> bool:
+        if messages is not self.source or len(messages) < len(self.counts):
+            return False
+        if not self.counts:
+            return True
+        return messages[len(self.counts) - 1] is self.last_message
+
+    def message_counts(self, messages: List[Message]) -> List[int]:
+        if not self.is_continuation(messages):
+            self.reset()
+            self.source = messages
+
+        for message in messages[len(self.counts) :]:
+            count = count_message_tokens(message, self.model)
+            self.counts.append(count)
+            self.total += count
+
+        self.last_message = messages[-1] if messages else None
+        return self.counts
+
+    def count_messages(self, messages: List[Message]) -> int:
+        self.message_counts(messages)
+        return self.total
+
+    def count_request(
+        self, messages: List[Message], tools: List[Tool], system_prompt: str
+    ) -> int:
+        return (
+            self.count_messages(messages)
+            + count_tool_tokens(tools, self.model)
+            + MESSAGE_OVERHEAD
+            + count_cached(system_prompt, self.model)
+            + REPLY_OVERHEAD
+        )
+
+
+def get_current_num_tokens(messages: List[Message], model: str):
+    return sum(count_message_tokens(message, model) for message in messages)
 
 
 def truncate_message(message: Message):
@@ -22,5 +176,6 @@ def truncate_message(message: Message):
 
     if message.content and len(message.content) > max_message_length:
         message.content = message.content[:max_message_length] + "...[TRUNCATED]"
+        message.converted = {}
 
     return message
@@ -0,0 +1,174 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+@dataclass
+class Span:
+    id: int
+    name: str
+    parent_id: Optional[int]
+    thread_id: int
+    start_us: float
+    end_us: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_us(self) -> float:
+        return (self.end_us or self.start_us) - self.start_us
+
+
+def payload_size(payload: Any) -> int:
+    if isinstance(payload, str):
+        return len(payload.encode())
+    return len(json.dumps(payload, default=str).encode())
+
+
+class NoopSpan:
+    def set(self, key: str, value: Any):
+        pass
+
+    def set_size(self, key: str, payload: Any):
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+# A context variable rather than a thread local, so spans nest correctly in
+# asyncio tasks as well as threads
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class ActiveSpan:
+    tracer: "Tracer"
+    span: Span
+    token: Optional[contextvars.Token]
+
+    def __init__(self, tracer: "Tracer", span: Span) -> None:
+        self.tracer = tracer
+        self.span = span
+        self.token = None
+
+    def set(self, key: str, value: Any):
+        self.span.set(key, value)
+
+    def set_size(self, key: str, payload: Any):
+        # Serializing is only worth paying for while tracing is on
+        self.span.set(key, payload_size(payload))
+
+    def __enter__(self) -> "ActiveSpan":
+        self.token = current_span.set(self.span)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        self.span.end_us = self.tracer.now_us()
+        if exc is not None:
+            self.span.set("error", repr(exc))
+        if self.token is not None:
+            current_span.reset(self.token)
+        self.tracer.record(self.span)
+
+
+class Tracer:
+    """
+    Records nested, timed spans for each phase of the agent loop. Disabled by
+    default, in which case span() hands back a shared no-op.
+    """
+
+    enabled: bool
+    spans: List[Span]
+    lock: threading.Lock
+    origin_ns: int
+    next_id: int
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.spans = []
+        self.lock = threading.Lock()
+        self.origin_ns = time.perf_counter_ns()
+        self.next_id = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def now_us(self) -> float:
+        return (time.perf_counter_ns() - self.origin_ns) / 1000
+
+    def span(self, name: str, **attributes: Any):
+        if not self.enabled:
+            return NOOP_SPAN
+        parent = current_span.get()
+        with self.lock:
+            self.next_id += 1
+            span_id = self.next_id
+        return ActiveSpan(
+            self,
+            Span(
+                id=span_id,
+                name=name,
+                parent_id=parent.id if parent else None,
+                thread_id=threading.get_ident(),
+                start_us=self.now_us(),
+                attributes=attributes,
+            ),
+        )
+
+    def record(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+    def get_spans(self) -> List[Span]:
+        with self.lock:
+            return sorted(self.spans, key=lambda span: span.start_us)
+
+    def export_jsonl(self, path: str):
+        with open(path, "w") as f:
+            for span in self.get_spans():
+                record = asdict(span)
+                record["duration_us"] = span.duration_us
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def export_chrome(self, path: str):
+        """
+        Writes the Chrome trace event format, which chrome://tracing and
+        Perfetto can open.
+        """
+        events = [
+            {
+                "name": span.name,
+                "ph": "X",
+                "ts": span.start_us,
+                "dur": span.duration_us,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": span.attributes,
+            }
+            for span in self.get_spans()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f, default=str)
+
+
+tracer = Tracer()